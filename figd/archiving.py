@@ -0,0 +1,227 @@
+import gzip
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import click
+import requests
+from tqdm import tqdm
+
+from figma_core.client import FigmaClient
+from figma_core.document import find_document
+from figma_core.download import download_image, download_images, existing_images
+from figma_core.renders import fetch_node_images, get_node_ids_and_depths, get_node_areas, load_unrenderable, save_unrenderable, plan_instance_renders, NodeFilter
+from state import ArchiveState
+
+
+def fetch_image_fills(file_key: str, token: str, session: Optional[requests.Session] = None) -> Dict:
+    """Fetch images from Figma API using file key and access token.
+    
+    Args:
+        file_key: Figma file key
+        token: Figma access token
+        session: The session to request with (optional)
+        
+    Returns:
+        Dict containing the API response with image URLs
+        
+    Raises:
+        requests.RequestException: If the API request fails
+    """
+    headers = {
+        'X-Figma-Token': token
+    }
+    
+    # Get images directly from the images endpoint
+    images_url = f'https://api.figma.com/v1/files/{file_key}/images'
+    response = (session or requests).get(images_url, headers=headers)
+    response.raise_for_status()
+    
+    return response.json()
+
+
+def archive_images(response_data: Dict, output_dir: Path, session: requests.Session, concurrency: int, no_extension: bool, force: bool, leave: bool = True):
+    """Download the images in the response to the output directory, skipping the images already saved.
+    
+    Args:
+        response_data: The Figma API response with the image URLs
+        output_dir: The directory to save the images to
+        session: The (shared) session to download with
+        concurrency: The number of concurrent downloads
+        no_extension: Save files without extensions
+        force: Re-download the images already saved
+        leave: Leave the progress bar when done
+        
+    Returns:
+        The number of images, the number of skipped images and the errors by the image id
+        
+    Raises:
+        ValueError: If the response is invalid or has an error
+    """
+    if response_data.get('error') or response_data.get('status') != 200:
+        raise ValueError("Invalid response format or error in response")
+    
+    # the images that are not available (e.g. deleted) have no url
+    images = {k: v for k, v in response_data.get('meta', {}).get('images', {}).items() if v}
+    
+    existing = set() if force else existing_images(output_dir)
+    missing = {k: v for k, v in images.items() if k not in existing}
+    
+    errors = {}
+    if missing:
+        output_dir.mkdir(parents=True, exist_ok=True)
+        with tqdm(total=len(missing), desc="Downloading images", leave=leave) as pbar:
+            _, errors = download_images(missing, output_dir, session, concurrency=concurrency, no_extension=no_extension, pbar=pbar)
+    
+    return len(images), len(images) - len(missing), errors
+
+
+def archive_keys(keys: list, output_dir: Path, token: str, session: requests.Session, concurrency: int, no_extension: bool, force: bool):
+    """Archive the images of many files in one run, each to <output_dir>/<key>/.
+    
+    The progress is recorded in the state file (see ArchiveState), so an interrupted run resumes where it left off.
+    """
+    state = ArchiveState(output_dir)
+    pending = keys if force else [key for key in keys if not state.is_complete(key)]
+    click.echo(f"Archiving {len(pending)} files ({len(keys) - len(pending)} already complete)")
+    
+    failed = 0
+    for key in tqdm(pending, desc="Files"):
+        try:
+            response_data = fetch_image_fills(key, token, session)
+            total, skipped, errors = archive_images(response_data, output_dir / key, session, concurrency, no_extension, force, leave=False)
+        except (requests.RequestException, ValueError) as e:
+            failed += 1
+            state.mark_failed(key, str(e))
+            tqdm.write(f"Error archiving {key}: {str(e)}")
+            continue
+        
+        if errors:
+            failed += 1
+            state.mark_failed(key, f"{len(errors)} of {total} images failed")
+            tqdm.write(f"Error archiving {key}: {len(errors)} of {total} images failed")
+        else:
+            state.mark_complete(key, total)
+    
+    click.echo(f"\n{len(pending) - failed} files have been saved to: {output_dir} ({failed} failed)")
+
+
+def export_name(node_id: str, scale) -> str:
+    """The file name (without extension) of the node export - follows the archiver's layout, e.g. 1:2 (1x) or 1:2@2x"""
+    return node_id if str(scale) == '1' else f"{node_id}@{scale}x"
+
+
+def archive_file(client: FigmaClient, key: str, output_dir: Path, compress: bool = False, force: bool = False, **params) -> Optional[Path]:
+    """Download the file (document) to <output_dir>/<key>.json (or .json.gz).
+    
+    Args:
+        client: The api client
+        key: Figma file key
+        output_dir: The directory to save the file to
+        compress: Save the file gzipped (.json.gz)
+        force: Re-download the file if already archived (in any of the supported formats)
+        params: The query parameters of the request (e.g. geometry='paths')
+        
+    Returns:
+        The path of the saved file, None if skipped (already archived)
+        
+    Raises:
+        FigmaAPIError: If the api responds with an error
+        requests.RequestException: If the request fails
+    """
+    if not force and find_document(output_dir, key):
+        return None
+    
+    data = client.file(key, **params)
+    path = output_dir / (f"{key}.json.gz" if compress else f"{key}.json")
+    tmp = path.with_name(f".{path.name}.tmp")
+    with (gzip.open(tmp, 'wt', encoding='utf-8') if compress else open(tmp, 'w', encoding='utf-8')) as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+    return path
+
+
+def archive_exports(client: FigmaClient, key: str, document: Dict, output_dir: Path, scale, format: str, depth: Optional[int] = None, types: Optional[List[str]] = None, include_canvas: bool = False, concurrency: int = 16, force: bool = False, dedupe_instances: bool = False, node_filter: Optional[NodeFilter] = None):
+    """Render the nodes of the document and download them to <output_dir>/<node id>[@<scale>x].<format>.
+    
+    Args:
+        client: The api client
+        key: Figma file key
+        document: The file (document) to export the nodes of
+        output_dir: The directory to save the exports to
+        scale: The export scale
+        format: The export format (png, jpg, svg or pdf)
+        depth: The layer depth to go recursively (None for all)
+        types: The types of the nodes to export (None for all)
+        include_canvas: Export the canvases as well
+        concurrency: The number of concurrent requests
+        force: Re-download the exports already saved
+        dedupe_instances: Render a single instance per identical instances - the others are linked to it in <output_dir>/meta.json ("links")
+        node_filter: Skips (and counts) the nodes not worth rendering - invisible, empty, too small or masks (None for all)
+        
+    Returns:
+        The number of nodes, the number of skipped nodes (saved, unrenderable or linked) and the errors by the node id
+    """
+    ids, _, _ = get_node_ids_and_depths(document, depth=depth, include_canvas=include_canvas, types=types, node_filter=node_filter)
+    total = len(ids)
+    if dedupe_instances:
+        ids, links = plan_instance_renders(document, ids)
+        save_links(output_dir, links)
+    existing = set() if force else existing_images(output_dir)
+    # the nodes failed to render (alone) in the previous runs are skipped
+    unrenderable = {} if force else load_unrenderable(output_dir, scale, format)
+    names = {export_name(id_, scale): id_ for id_ in ids}
+    missing = [id_ for name, id_ in names.items() if name not in existing and id_ not in unrenderable]
+    
+    errors = {}
+    if missing:
+        output_dir.mkdir(parents=True, exist_ok=True)
+        urls = fetch_node_images(client, key, missing, scale, format, concurrency=concurrency, areas=get_node_areas(document), unrenderable=unrenderable)
+        save_unrenderable(output_dir, scale, format, unrenderable)
+        # the nodes that could not be rendered have no url
+        for id_ in missing:
+            if not urls.get(id_):
+                errors[id_] = unrenderable.get(id_, 'not rendered')
+        images = {export_name(id_, scale): url for id_, url in urls.items() if url}
+        with tqdm(total=len(images), desc="Downloading exports", leave=False) as pbar:
+            _, failed = download_images(images, output_dir, client.session, concurrency=concurrency, pbar=pbar)
+        errors.update({names[name]: e for name, e in failed.items()})
+    
+    return total, total - len(missing), errors
+
+
+def save_links(output_dir: Path, links: Dict[str, str]):
+    """Save the links of the identical instances to their rendered representative - <output_dir>/meta.json ("links": {id: id}).
+    
+    The other keys of the meta file are kept.
+    """
+    metafile = output_dir / 'meta.json'
+    meta = {}
+    if metafile.exists():
+        try:
+            with open(metafile, 'r') as f:
+                meta = json.load(f)
+        except json.JSONDecodeError:
+            meta = {}
+    meta['links'] = links
+    output_dir.mkdir(parents=True, exist_ok=True)
+    tmp = metafile.with_name(metafile.name + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(meta, f, separators=(',', ':'))
+    os.replace(tmp, metafile)
+
+
+def archive_thumbnail(client: FigmaClient, key: str, output_dir: Path, force: bool = False) -> Optional[Path]:
+    """Download the thumbnail of the file to <output_dir>/thumbnail.png.
+    
+    Returns:
+        The path of the saved thumbnail, None if skipped (already archived) or the file has no thumbnail
+    """
+    if not force and 'thumbnail' in existing_images(output_dir):
+        return None
+    url = client.thumbnail_url(key)
+    if not url:
+        return None
+    output_dir.mkdir(parents=True, exist_ok=True)
+    return download_image(client.session, url, output_dir, 'thumbnail')
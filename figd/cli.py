@@ -1,41 +1,29 @@
 import click
 import os
+import sys
 import json
-import requests
-import imghdr
 import tempfile
 from pathlib import Path
-from typing import Dict, Optional
-from tqdm import tqdm
 
-def fetch_image_fills(file_key: str, token: str) -> Dict:
-    """Fetch images from Figma API using file key and access token.
-    
-    Args:
-        file_key: Figma file key
-        token: Figma access token
-        
-    Returns:
-        Dict containing the API response with image URLs
-        
-    Raises:
-        requests.RequestException: If the API request fails
-    """
-    headers = {
-        'X-Figma-Token': token
-    }
-    
-    # Get images directly from the images endpoint
-    images_url = f'https://api.figma.com/v1/files/{file_key}/images'
-    response = requests.get(images_url, headers=headers)
-    response.raise_for_status()
-    
-    return response.json()
+# for importing the shared figma_core package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-def validate_source_params(ctx, param, value):
-    if not any([ctx.params.get('response'), ctx.params.get('file_key')]):
-        raise click.BadParameter('Either --response or --file-key must be provided')
-    return value
+# the commands import their dependencies (requests, the figma_core modules, ...) lazily, so the cli starts fast.
+
+class SourceCommand(click.Command):
+    """A command requiring one of the `sources` options (e.g. --file-key or --keys).
+    
+    Checked on invoke, once all the params are parsed - an option callback only sees the params before it on the command line."""
+    
+    def __init__(self, *args, sources=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sources = sources
+    
+    def invoke(self, ctx):
+        if not any(ctx.params.get(source) for source in self.sources):
+            options = ', '.join(f"--{source.replace('_', '-')}" for source in self.sources[:-1])
+            raise click.UsageError(f"Either {options} or --{self.sources[-1].replace('_', '-')} must be provided", ctx=ctx)
+        return super().invoke(ctx)
 
 @click.group()
 def cli():
@@ -47,18 +35,30 @@ def archive():
     """Archive related commands"""
     pass
 
-@archive.command()
+def list_keys(keys) -> list:
+    """Read the file keys, one per line (blank lines and # comments are ignored)."""
+    listed = []
+    for line in keys:
+        key = line.split('#', 1)[0].strip()
+        if key and key not in listed:
+            listed.append(key)
+    return listed
+
+@archive.command(cls=SourceCommand, sources=['response', 'file_key', 'keys'])
 @click.option('--output', '-o', type=click.Path(), help='Output directory for archived images')
 @click.option('--response', type=click.Path(), help='Path to response.json containing Figma API response')
 @click.option('--file-key', help='Figma file key')
+@click.option('--keys', type=click.File('r'), help='Path to a file with Figma file keys, one per line ("-" for stdin). The images are saved to <output>/<key>/')
 @click.option('--token', 
     help='Figma access token (defaults to FIGMA_PERSONAL_ACCESS_TOKEN environment variable)',
-    default=lambda: os.environ.get('FIGMA_PERSONAL_ACCESS_TOKEN'),
-    callback=validate_source_params)
+    default=lambda: os.environ.get('FIGMA_PERSONAL_ACCESS_TOKEN'))
 @click.option('--no-extension', is_flag=True, help='Save files without extensions')
-def image(output, response, file_key, token, no_extension):
+@click.option('--concurrency', '-c', type=int, default=16, help='Number of concurrent downloads')
+@click.option('--retries', type=int, default=3, help='Number of retries for the failed downloads')
+@click.option('--force', is_flag=True, help='Re-download the images (and files) already archived')
+def image(output, response, file_key, keys, token, no_extension, concurrency, retries, force):
     """Archive an image file with optional Figma metadata. 
-    Requires either --response or --file-key."""
+    Requires either --response, --file-key or --keys."""
     
     if not output:
         # Create a temporary directory
@@ -70,6 +70,17 @@ def image(output, response, file_key, token, no_extension):
     # Create output directory if it doesn't exist
     output_dir.mkdir(parents=True, exist_ok=True)
     
+    import requests
+    from figma_core.client import create_session
+    from archiving import fetch_image_fills, archive_images, archive_keys
+    
+    # shared across the requests (and the files) - connection pooling & retries
+    session = create_session(concurrency=concurrency, retries=retries)
+    
+    if keys:
+        archive_keys(list_keys(keys), output_dir, token, session, concurrency, no_extension, force)
+        return
+    
     if response:
         click.echo(f"Using Figma response data from {response}")
         try:
@@ -84,46 +95,158 @@ def image(output, response, file_key, token, no_extension):
     elif file_key:
         click.echo(f"Fetching images from Figma file: {file_key}")
         try:
-            response_data = fetch_image_fills(file_key, token)
+            response_data = fetch_image_fills(file_key, token, session)
         except requests.RequestException as e:
             click.echo(f"Error fetching images from Figma: {str(e)}", err=True)
             return
     
-    if not response_data.get('error') and response_data.get('status') == 200:
-        images = response_data.get('meta', {}).get('images', {})
-        
-        if not images:
-            click.echo("No images found in the response")
-            return
-            
-        click.echo(f"Found {len(images)} images to download")
-        
-        with tqdm(total=len(images), desc="Downloading images") as pbar:
-            for image_id, image_url in images.items():
-                try:
-                    # Download the image
-                    response = requests.get(image_url)
-                    response.raise_for_status()
-                    
-                    # Detect image type from content
-                    image_type = imghdr.what(None, response.content)
-                    file_ext = '' if no_extension else (f'.{image_type}' if image_type else '.bin')
-                    
-                    # Save the image
-                    output_path = output_dir / f"{image_id}{file_ext}"
-                    with open(output_path, 'wb') as f:
-                        f.write(response.content)
-                    
-                    pbar.update(1)
-                    
-                except requests.RequestException as e:
-                    click.echo(f"\nError downloading image {image_id}: {str(e)}", err=True)
-                except IOError as e:
-                    click.echo(f"\nError saving image {image_id}: {str(e)}", err=True)
-        
-        click.echo(f"\nAll images have been saved to: {output_dir}")
-    else:
-        click.echo("Invalid response format or error in response", err=True)
+    try:
+        total, skipped, errors = archive_images(response_data, output_dir, session, concurrency, no_extension, force)
+    except ValueError as e:
+        click.echo(str(e), err=True)
+        return
+    
+    if not total:
+        click.echo("No images found in the response")
+        return
+    
+    click.echo(f"Found {total} images ({skipped} already saved)")
+    
+    for image_id, e in errors.items():
+        click.echo(f"Error downloading image {image_id}: {str(e)}", err=True)
+    
+    click.echo(f"\nAll images have been saved to: {output_dir}")
+
+def token_option():
+    return click.option('--token',
+        help='Figma access token (defaults to FIGMA_PERSONAL_ACCESS_TOKEN environment variable)',
+        default=lambda: os.environ.get('FIGMA_PERSONAL_ACCESS_TOKEN'))
+
+def resolve_keys(file_key, keys) -> list:
+    return list_keys(keys) if keys else [file_key]
+
+@archive.command(cls=SourceCommand, sources=['file_key', 'keys'])
+@click.option('--output', '-o', type=click.Path(file_okay=False), default='.', help='Output directory for the files - <output>/<key>.json')
+@click.option('--file-key', help='Figma file key')
+@click.option('--keys', type=click.File('r'), help='Path to a file with Figma file keys, one per line ("-" for stdin)')
+@token_option()
+@click.option('--geometry', is_flag=True, help='Include the vector paths (geometry=paths)')
+@click.option('--gzip', 'compress', is_flag=True, help='Save the files gzipped (.json.gz)')
+@click.option('--concurrency', '-c', type=int, default=4, help='Number of concurrent downloads')
+@click.option('--force', is_flag=True, help='Re-download the files already archived')
+def file(output, file_key, keys, token, geometry, compress, concurrency, force):
+    """Archive the file (document) json.
+    Requires either --file-key or --keys."""
+    from concurrent.futures import ThreadPoolExecutor
+    import requests
+    from tqdm import tqdm
+    from figma_core.client import FigmaClient, FigmaAPIError
+    from archiving import archive_file
+    
+    output_dir = Path(output)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    client = FigmaClient(token, concurrency=concurrency)
+    params = {'geometry': 'paths'} if geometry else {}
+    
+    def task(key):
+        try:
+            return key, archive_file(client, key, output_dir, compress=compress, force=force, **params), None
+        except (FigmaAPIError, requests.RequestException) as e:
+            return key, None, e
+    
+    keys = resolve_keys(file_key, keys)
+    saved = failed = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for key, path, e in tqdm(executor.map(task, keys), total=len(keys), desc="Files"):
+            if e is not None:
+                failed += 1
+                tqdm.write(f"Error archiving {key}: {str(e)}")
+            elif path is not None:
+                saved += 1
+    
+    click.echo(f"\n{saved} files have been saved to: {output_dir} ({len(keys) - saved - failed} already archived, {failed} failed)")
+
+@archive.command(cls=SourceCommand, sources=['file_key', 'keys'])
+@click.option('--output', '-o', type=click.Path(file_okay=False), default='.', help='Output directory for the exports - <output>/<key>/exports/')
+@click.option('--file-key', help='Figma file key')
+@click.option('--keys', type=click.File('r'), help='Path to a file with Figma file keys, one per line ("-" for stdin)')
+@token_option()
+@click.option('--src', type=click.Path(file_okay=False), default=None, help='Directory of the archived files (<src>/<key>.json, .json.gz or .json.zst). The files are fetched if not specified')
+@click.option('--scale', '-s', default='1', help='Export scale')
+@click.option('--format', '-fmt', 'format', default='png', type=click.Choice(['png', 'jpg', 'svg', 'pdf']), help='Export format')
+@click.option('--depth', '-d', type=int, default=None, help='Layer depth to go recursively (all layers if not specified)')
+@click.option('--types', default=None, help='Comma separated types of the nodes to export (e.g. FRAME,COMPONENT)')
+@click.option('--include-canvas', is_flag=True, help='Export the canvases as well')
+@click.option('--concurrency', '-c', type=int, default=16, help='Number of concurrent requests')
+@click.option('--rate-limit', type=float, default=None, help='Max api requests per second (the renders are requested concurrently)')
+@click.option('--force', is_flag=True, help='Re-download the exports already saved')
+@click.option('--dedupe-instances', is_flag=True, help='Render a single instance per identical instances (component, size & overrides) - the others are linked to it in exports/meta.json')
+@click.option('--keep-invisible', is_flag=True, help='Export the invisible layers (visible: false) as well')
+@click.option('--keep-masks', is_flag=True, help='Export the mask layers as well')
+@click.option('--min-area', type=float, default=1.0, help='Minimum render area (px²) of the layers to export - smaller and empty ones are skipped (0 for all)')
+def exports(output, file_key, keys, token, src, scale, format, depth, types, include_canvas, concurrency, rate_limit, force, dedupe_instances, keep_invisible, keep_masks, min_area):
+    """Archive the node exports (renders) of the file.
+    Requires either --file-key or --keys."""
+    import requests
+    from tqdm import tqdm
+    from figma_core.client import FigmaClient, FigmaAPIError
+    from figma_core.document import find_document, load_document
+    from figma_core.renders import NodeFilter
+    from archiving import archive_exports
+    
+    client = FigmaClient(token, concurrency=concurrency, rate_limit=rate_limit)
+    node_filter = NodeFilter(invisible=not keep_invisible, empty=min_area > 0, min_area=min_area, masks=not keep_masks)
+    types = [t.strip() for t in types.split(',')] if types else None
+    
+    keys = resolve_keys(file_key, keys)
+    for key in tqdm(keys, desc="Files", disable=len(keys) == 1):
+        try:
+            path = find_document(src, key) if src else None
+            document = load_document(path) if path else client.file(key, depth=depth + 2 if depth is not None else None)
+            total, skipped, errors = archive_exports(
+                client, key, document, Path(output) / key / 'exports', scale, format,
+                depth=depth, types=types, include_canvas=include_canvas, concurrency=concurrency, force=force,
+                dedupe_instances=dedupe_instances, node_filter=node_filter)
+        except (FigmaAPIError, requests.RequestException, ValueError) as e:
+            tqdm.write(f"Error archiving {key}: {str(e)}")
+            continue
+        tqdm.write(f"{key}: {total - skipped - len(errors)} exported, {skipped} already saved, {len(errors)} failed")
+    click.echo(f"Skipped layers: {node_filter.summary()}")
+
+@archive.command(cls=SourceCommand, sources=['file_key', 'keys'])
+@click.option('--output', '-o', type=click.Path(file_okay=False), default='.', help='Output directory for the thumbnails - <output>/<key>/thumbnail.png')
+@click.option('--file-key', help='Figma file key')
+@click.option('--keys', type=click.File('r'), help='Path to a file with Figma file keys, one per line ("-" for stdin)')
+@token_option()
+@click.option('--concurrency', '-c', type=int, default=16, help='Number of concurrent downloads')
+@click.option('--force', is_flag=True, help='Re-download the thumbnails already saved')
+def thumbnails(output, file_key, keys, token, concurrency, force):
+    """Archive the thumbnails of the files.
+    Requires either --file-key or --keys."""
+    from concurrent.futures import ThreadPoolExecutor
+    import requests
+    from tqdm import tqdm
+    from figma_core.client import FigmaClient, FigmaAPIError
+    from archiving import archive_thumbnail
+    
+    client = FigmaClient(token, concurrency=concurrency)
+    
+    def task(key):
+        try:
+            return key, archive_thumbnail(client, key, Path(output) / key, force=force), None
+        except (FigmaAPIError, requests.RequestException, IOError) as e:
+            return key, None, e
+    
+    keys = resolve_keys(file_key, keys)
+    saved = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for key, path, e in tqdm(executor.map(task, keys), total=len(keys), desc="Thumbnails"):
+            if e is not None:
+                tqdm.write(f"Error archiving {key}: {str(e)}")
+            elif path is not None:
+                saved += 1
+    
+    click.echo(f"\n{saved} thumbnails have been saved to: {output}")
 
 if __name__ == '__main__':
     cli()
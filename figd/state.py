@@ -0,0 +1,44 @@
+import json
+import os
+from pathlib import Path
+from typing import Dict
+
+
+class ArchiveState:
+    """Resumable state of a batch archive run, stored as `.figd-state.json` in the output directory.
+
+    The files (keys) that are completely archived are skipped on the next run, the failed ones are retried.
+    """
+
+    NAME = '.figd-state.json'
+
+    def __init__(self, output_dir: Path):
+        self.path = Path(output_dir) / self.NAME
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            data = {}
+        # {key: the number of images}
+        self.complete: Dict[str, int] = data.get('complete', {})
+        # {key: the last error}
+        self.failed: Dict[str, str] = data.get('failed', {})
+
+    def is_complete(self, key: str) -> bool:
+        return key in self.complete
+
+    def mark_complete(self, key: str, images: int):
+        self.complete[key] = images
+        self.failed.pop(key, None)
+        self.save()
+
+    def mark_failed(self, key: str, error: str):
+        self.failed[key] = error
+        self.save()
+
+    def save(self):
+        """Write the state atomically - an interrupted write never corrupts the state."""
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump({'complete': self.complete, 'failed': self.failed}, f, indent=2)
+        os.replace(tmp, self.path)
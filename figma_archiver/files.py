@@ -12,6 +12,12 @@ import requests
 from tqdm import tqdm
 from multiprocessing import Pool, cpu_count
 
+# for importing the shared figma_core package
+sys.path.insert(0, os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))))
+
+from figma_core.document import open_document, create_document, document_key, is_document, find_document
+
 load_dotenv()
 
 FIGMA_API_BASE_URL = "https://api.figma.com/v1/files"
@@ -28,18 +34,19 @@ def is_valid_url(url):
 
 def is_valid_json_file(file: Path):
     if file.exists():
-        with open(file, "r") as output_file:
-            try:
+        try:
+            with open_document(file) as output_file:
                 json_data = json.load(output_file)
                 if "document" in json_data:
                     return True
-            except:
-                return False
+        except:
+            return False
 
 
 def save_file_locally(args):
     file_key, figma_token, output_path, validate, replace, replace_before, minify = args
-    file_path = Path(output_path / f"{file_key}.json")
+    # the existing document is replaced in place, keeping its compression (.json.gz / .json.zst)
+    file_path = find_document(output_path, file_key) or Path(output_path / f"{file_key}.json")
 
     if replace_before:
         # check the last modified date of the file
@@ -71,7 +78,7 @@ def save_file_locally(args):
             json_data = response.json()
             if replace:
                 file_path.unlink(missing_ok=True)
-            with open(file_path, "w") as file:
+            with create_document(file_path) as file:
                 if not minify:
                     json.dump(json_data, file, indent=4)
                 else:
@@ -83,7 +90,7 @@ def save_file_locally(args):
         else:
             return f"Failed to download file {file_key}. Error: {response.status_code}"
 
-        if is_valid_json_file(output_path / f"{file_key}.json"):
+        if is_valid_json_file(file_path):
             return True
         else:
             return f"Failed to save json file properly {file_key}. Malformed json."
@@ -124,7 +131,8 @@ def main(map_file, figma_token, output_dir, concurrency, replace, replace_before
     file_keys = [extract_file_key(link)
                  for link in file_links if extract_file_key(link)]
 
-    existing_files = set([p.stem for p in output_path.glob("*.json")])
+    existing_files = set([document_key(p)
+                         for p in output_path.glob("*.json*") if is_document(p)])
 
     if validate or replace:
         file_keys_to_download = file_keys
@@ -148,7 +156,7 @@ def main(map_file, figma_token, output_dir, concurrency, replace, replace_before
         sys.exit(1)
 
     if validate:
-        for file in tqdm(output_path.glob("*.json"), desc="Validation"):
+        for file in tqdm([p for p in output_path.glob("*.json*") if is_document(p)], desc="Validation"):
             if not is_valid_json_file(file):
                 tqdm.write(
                     f"Failed to validate json file properly {file}. Malformed json. Unlinking...")
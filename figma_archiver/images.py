@@ -1,18 +1,15 @@
 import glob
 import logging
 import mimetypes
-from multiprocessing import cpu_count
+from multiprocessing import Pool, cpu_count
 import random
 import threading
 import click
 import time
 import json
 import os
-import shutil
-import tempfile
 import requests
 from requests.adapters import HTTPAdapter
-from urllib.parse import urlencode
 from urllib3 import Retry
 import backoff
 from ssl import SSLError
@@ -24,14 +21,23 @@ from functools import partial
 import queue
 from typing import List, Callable
 import resource
-from PIL import Image, ImageFile, UnidentifiedImageError
-from PIL.PngImagePlugin import PngInfo
+from PIL import ImageFile
 from datetime import datetime
-import math
 import logging
 from colorama import Fore
-import numpy as np
 import resource
+import sys
+
+# for importing the shared figma_core package
+sys.path.insert(0, os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))))
+
+from figma_core.document import open_document, document_key, find_document
+from figma_core.client import FigmaClient, FigmaAPIError
+from figma_core import imagesize
+from figma_core.priority import load_popularity, POPULARITY_FIELDS
+from figma_core.renders import fetch_node_images, get_node_ids_and_depths, get_node_areas, load_unrenderable, save_unrenderable, plan_instance_renders, load_instance_links, save_instance_links, NodeFilter
+from figma_core.optimize import optimize_image, FillSizePlan, image_paint_map, read_image_optimization_metadata, transcode_image, avif_supported, TRANSCODE_FORMATS, write_previews, previews_metadata
 
 
 # TODO: gifRef support
@@ -61,14 +67,28 @@ API_BASE_URL = "https://api.figma.com/v1"
 @click.option('--thumbnails', is_flag=True, default=False, help="Set this flag to download thumbnail.png as well")
 @click.option('--only-sync', is_flag=True, default=False, help="Set this flag to only sync the files without downloading or optimizing images")
 @click.option("-t", "--figma-token", help="Figma API access token.", default=os.getenv("FIGMA_ACCESS_TOKEN"), type=str)
-@click.option("-src", '--source-dir', default="./downloads/*.json", help="Path to the JSON file")
+@click.option("-src", '--source-dir', default="./downloads/*.json", help="Path to the JSON file (.json, .json.gz and .json.zst are supported, e.g. ./downloads/*.json*)")
 @click.option("-c", "--concurrency", help="Number of concurrent processes.", default=cpu_count(), type=int)
 @click.option("--skip-n", help="Number of files to skip (for dubugging).", default=0, type=int)
 @click.option("--no-download", is_flag=True, help="No downloading the images (This can be used if you want this script to only run for optimizing existing images)", default=0, type=int)
 @click.option("--shuffle", is_flag=True, help="Rather if to randomize the input for even distribution", default=False, type=click.BOOL)
 @click.option("--sample", default=None, help="Sample n files from the input", type=click.INT)
 @click.option("--hide-progress", help="Hide progress bar", default=None, type=click.Choice([True, False, None, "*", "c"]))
-def main(version, dir, format, scale, depth, include_canvas, no_fills, optimize, no_exports, max_mb_hash, types, thumbnails, only_thumbnails, only_sync, figma_token, source_dir, concurrency, skip_n, no_download, shuffle, sample, hide_progress):
+@click.option("--rate-limit", help="Max requests per second per token, shared by all threads (rate limited requests pause all threads regardless). 0 for no limit.", default=2.0, type=click.FLOAT)
+@click.option("--export-concurrency", help="Number of concurrent /v1/images requests per file - up to -c x this many renders are in flight per token.", default=3, type=click.IntRange(1))
+@click.option("--from-report", help="Only process the keys listed in the malforms report (scripts/malforms.py) - re-fetches the quarantined images (except the too small ones)", default=None, type=click.Path(exists=True, dir_okay=False))
+@click.option("--transcode", help="Transcode the images & exports to webp (lossless) or avif (near-lossless, if supported by the local codec) after downloading", default=None, type=click.Choice(TRANSCODE_FORMATS))
+@click.option("--transcode-quality", help="Lossy quality (0~100) for --transcode - lossless by default", default=None, type=click.IntRange(0, 100))
+@click.option("--transcode-replace", is_flag=True, default=False, help="Remove the originals once transcoded (by default, the transcoded images are written next to the originals)")
+@click.option("--previews", help="Write a preview pyramid of the images & exports after downloading - the max sizes in pixels, comma separated (e.g. 64,256,1024) - {images|exports}/previews/{size}/{name}.webp", default=None, type=click.STRING)
+@click.option("--dedupe-instances", is_flag=True, default=False, help="Render a single instance per identical (component, size, overrides) instances - the others are linked to it in exports/meta.json")
+@click.option("--keep-invisible", is_flag=True, default=False, help="Export the invisible layers (visible: false) as well - skipped by default")
+@click.option("--keep-masks", is_flag=True, default=False, help="Export the mask layers as well - skipped by default")
+@click.option("--min-area", help="The minimum render area (px²) of the layers to export - smaller ones (e.g. zero-size vectors) and the empty ones are skipped. 0 to export all", default=1.0, type=click.FLOAT)
+@click.option("--breadth-first", is_flag=True, default=False, help="Export depth level by depth level across all the files (the top level layers of every file first), instead of file by file")
+@click.option("--priority", help="Process the popular files first - the meta.jsonl of the index (or the index directory), with the map.json next to it", default=None, type=click.Path(exists=True))
+@click.option("--priority-by", help="The meta field to rank the files by (with --priority)", default="like_count", type=click.Choice(POPULARITY_FIELDS))
+def main(version, dir, format, scale, depth, include_canvas, no_fills, optimize, no_exports, max_mb_hash, types, thumbnails, only_thumbnails, only_sync, figma_token, source_dir, concurrency, skip_n, no_download, shuffle, sample, hide_progress, rate_limit, export_concurrency, from_report, transcode, transcode_quality, transcode_replace, previews, dedupe_instances, keep_invisible, keep_masks, min_area, breadth_first, priority, priority_by):
 
     now = datetime.now()
     iso_now = now.replace(microsecond=0).isoformat()
@@ -153,14 +173,30 @@ def main(version, dir, format, scale, depth, include_canvas, no_fills, optimize,
     if not optimize:
         max_mb_hash = 0
 
+    if previews is not None:
+        try:
+            previews = sorted(set(int(size.strip()) for size in previews.split(",")))
+        except ValueError:
+            click.echo(f"Error: --previews must be comma separated sizes (e.g. 64,256,1024), got {previews}")
+            return
+
+    if transcode == "avif" and not avif_supported():
+        tqdm.write(Fore.YELLOW + "AVIF is not supported by the local codec (Pillow >= 11.2 with libavif, or pillow-avif-plugin) - transcoding to webp instead" + Fore.RESET)
+        transcode = "webp"
+
     root_dir = Path(dir)
 
     _src_dir = Path('/'.join(source_dir.split("/")[0:-1]))   # e.g. ./downloads
     _src_file_pattern = source_dir.split("/")[-1]            # e.g. *.json
     json_files = glob.glob(_src_file_pattern, root_dir=_src_dir)
+    if from_report:
+        # the missing (quarantined) images are re-fetched as any other missing image - only the reported keys need a pass
+        reported = read_report_keys(from_report)
+        json_files = [file for file in json_files if document_key(file) in reported]
+        tqdm.write(f"{len(json_files)} files from {from_report}")
     json_files = json_files[skip_n:]
     json_files = json_files[:sample] if sample else json_files
-    file_keys = [Path(file).stem for file in json_files]
+    file_keys = [document_key(file) for file in json_files]
 
     # randomize for even distribution
     if shuffle:
@@ -169,6 +205,16 @@ def main(version, dir, format, scale, depth, include_canvas, no_fills, optimize,
         json_files = [json_files[i] for i in shuffled]
         file_keys = [file_keys[i] for i in shuffled]
 
+    # the popular files first (the unknown ones last, in their order)
+    if priority:
+        popularity = load_popularity(priority, by=priority_by)
+        if file_keys and not any(key in popularity for key in file_keys):
+            raise click.UsageError(
+                f"None of the files has a popularity in {priority} - the file keys are mapped from the community ids with the map.json next to the meta.jsonl")
+        ranked = sorted(range(len(json_files)), key=lambda i: -popularity.get(file_keys[i], -1))
+        json_files = [json_files[i] for i in ranked]
+        file_keys = [file_keys[i] for i in ranked]
+
     # set up the queue and background downloader thread
     img_queue = queue.Queue()
     # download thread
@@ -176,7 +222,23 @@ def main(version, dir, format, scale, depth, include_canvas, no_fills, optimize,
         target=image_queue_handler, args=(img_queue,))
     download_thread.start()
 
-    if not only_sync:
+    # the layers not worth rendering (blank or null renders) are skipped while planning the exports - shared by all threads for the counts
+    node_filter = NodeFilter(invisible=not keep_invisible, empty=min_area > 0,
+                             min_area=min_area, masks=not keep_masks)
+
+    if breadth_first and not only_sync and not no_exports and not only_thumbnails:
+        tqdm.write(f"🔥 Exporting breadth-first - {concurrency} threads / {len(figma_tokens)} identities")
+        export_breadth_first(
+            list(zip(file_keys, json_files)), root_dir=root_dir, src_dir=_src_dir, img_queue=img_queue,
+            figma_tokens=figma_tokens, depth=depth, include_canvas=include_canvas, types=types,
+            node_filter=node_filter, format=format, scale=scale,
+            transcode=transcode if transcode_replace else None, dedupe_instances=dedupe_instances,
+            concurrency=concurrency, export_concurrency=export_concurrency, rate_limit=rate_limit,
+            no_download=no_download, hide_progress=hide_progress_main)
+        # the exports are done - the fills & thumbnails are processed file by file below
+        no_exports = True
+
+    if not only_sync and (not no_exports or not no_fills or thumbnails):
         # main progress bar
         pbar = tqdm(total=len(json_files),
                     position=pbarpos(0), leave=True, disable=hide_progress_main)
@@ -210,7 +272,12 @@ def main(version, dir, format, scale, depth, include_canvas, no_fills, optimize,
                 'pbar': pbar,
                 'no_download': no_download,
                 'concurrency': concurrency,
-                'hide_progress': hide_progress_c
+                'hide_progress': hide_progress_c,
+                'rate_limit': rate_limit,
+                'export_concurrency': export_concurrency,
+                'transcode': transcode if transcode_replace else None,
+                'dedupe_instances': dedupe_instances,
+                'node_filter': node_filter,
             })
             t.start()
             threads.append(t)
@@ -220,22 +287,35 @@ def main(version, dir, format, scale, depth, include_canvas, no_fills, optimize,
         for t in threads:
             t.join()
 
+    if not only_sync:
+        tqdm.write(f"Skipped layers: {node_filter.summary()}")
         tqdm.write("All done!")
     # Signal the handler to stop by adding a None item
     img_queue.put(('EOD', 'EOD', None))
     # finally wait for the download thread to finish
     download_thread.join()
 
+    if transcode and not only_sync:
+        transcode_archives(root_dir, [document_key(_) for _ in json_files], format=transcode,
+                           quality=transcode_quality, replace=transcode_replace, concurrency=concurrency)
+
+    if previews and not only_sync:
+        preview_archives(root_dir, [document_key(_) for _ in json_files],
+                         sizes=previews, concurrency=concurrency)
+
     # validation & meta sync
     for _ in tqdm(json_files, desc="🔥 Final Validation & Meta Sync", position=pbarpos(0), leave=True):
-        key = Path(_).stem
+        key = document_key(_)
         sync_metadata_for_exports(root_dir=root_dir, src_dir=_src_dir, key=key)
         sync_metadata_for_hash_images(
             root_dir=root_dir, src_dir=_src_dir, key=key)
         tqdm.write(f"🔥 {root_dir/key}")
 
 
-def process_files(files, root_dir: Path, src_dir: Path, img_queue: queue.Queue, include_canvas: bool, no_fills: bool, no_exports: bool, thumbnails: bool, types: list[str], figma_token: str, format: str, scale: int, optimize: bool, max_mb_hash: int, depth: int, index: int, size: int, pbar: tqdm, concurrency: int, no_download: bool, hide_progress: bool):
+def process_files(files, root_dir: Path, src_dir: Path, img_queue: queue.Queue, include_canvas: bool, no_fills: bool, no_exports: bool, thumbnails: bool, types: list[str], figma_token: str, format: str, scale: int, optimize: bool, max_mb_hash: int, depth: int, index: int, size: int, pbar: tqdm, concurrency: int, no_download: bool, hide_progress: bool, rate_limit: float = None, export_concurrency: int = 3, transcode: str = None, dedupe_instances: bool = False, node_filter: NodeFilter = None):
+    # one client (connection pool) per thread / identity
+    client = FigmaClient(figma_token, max_retries=5 * concurrency,
+                         retry_delay=5 * concurrency, rate_limit=rate_limit)
     # for key, json_file in files:
     for key, json_file in tqdm(files, desc=fixstr(f"⚡️ C{index + 1}", 6), position=pbarpos(0, index=index, margin=4, batch=concurrency), leave=True, total=size, disable=hide_progress):
         subdir: Path = root_dir / key
@@ -260,7 +340,7 @@ def process_files(files, root_dir: Path, src_dir: Path, img_queue: queue.Queue,
                     # tqdm.write(f"Saved thumbnail to {subdir / 'thumbnail.png'}")
 
             node_ids, depths, maxdepth = get_node_ids_and_depths(
-                file_data, depth=depth, include_canvas=include_canvas, types=types)
+                file_data, depth=depth, include_canvas=include_canvas, types=types, node_filter=node_filter)
             # ----------------------------------------------------------------------
             # image fills
             if not no_fills:
@@ -280,20 +360,20 @@ def process_files(files, root_dir: Path, src_dir: Path, img_queue: queue.Queue,
                     hash for hash in hashes if hash not in existing_hashes
                 ]
 
+                # the usages of all the fills are planned once per file - each image is then sized in one vectorized pass
+                plan = FillSizePlan(paint_map) if optimize else None
+
                 def optimizer(path):
                     hash = Path(path).stem
-                    # tqdm.write(hash, paint_map)
-                    # print(hashes, hash, paint_map, json_file)
-                    opt = optimized_image_paint_map(
-                        paint_map={hash: paint_map[hash]},
-                        images={
-                            hash: path
-                        }
-                    )
+                    if hash not in plan.index:
+                        return
+                    # the header only - the image is decoded only if it is resized
+                    size = imagesize.dimensions(path)
+                    if size is None:
+                        log_error(f"Cannot read image {path}. Skipping...")
+                        return
 
-                    max_width = opt[hash].get("max", {}).get("width", None)
-                    max_height = opt[hash].get(
-                        "max", {}).get("height", None)
+                    max_width, max_height = plan.max_size(hash, size)
 
                     success, saved, dimA, dimB, scale = optimize_image(
                         path=path,
@@ -315,7 +395,7 @@ def process_files(files, root_dir: Path, src_dir: Path, img_queue: queue.Queue,
                 # Fetch and save image fills (B)
                 if len(hashes_to_download) > 0 and not no_download:
                     # tqdm.write("Fetching image fills...")
-                    image_fills = fetch_file_images(key, token=figma_token)
+                    image_fills = fetch_file_images(client, key)
                     url_and_path_pairs = [
                         (url, images_dir / hash_)
                         for hash_, url in image_fills.items()
@@ -357,42 +437,15 @@ def process_files(files, root_dir: Path, src_dir: Path, img_queue: queue.Queue,
             # ----------------------------------------------------------------------
             # exports
             if not no_exports:
-                images_dir = subdir / "exports"
-                images_dir.mkdir(parents=True, exist_ok=True)
-                existing_images = get_existing_images(images_dir)
-
-                # Fetch and save layer images (A)
-                node_ids_to_fetch = [
-                    node_id
-                    for node_id in node_ids
-                    if f"{node_id}.{format}" not in existing_images
-                    and f"{node_id}@{scale}x.{format}" not in existing_images
-                ]
-
-                if node_ids_to_fetch and not no_download:
-                    # tqdm.write(f"Fetching {len(node_ids_to_fetch)} of {len(node_ids)} layer images...")
-                    layer_images = fetch_node_images(
-                        key, node_ids_to_fetch, scale, format,
-                        token=figma_token,
-                        position=pbarpos(
-                            1, index=index, margin=5, batch=concurrency),
-                        conncurrency=concurrency)
-                    url_and_path_pairs = [
-                        (
-                            url,
-                            os.path.join(
-                                images_dir,
-                                f"{node_id}{'@' + str(scale) + 'x' if scale != '1' else ''}.{format}",
-                            ),
-                        )
-                        for node_id, url in layer_images.items()
-                    ]
-                    for pair in url_and_path_pairs:
-                        img_queue.put(pair + (None,))
+                # the identical instances are rendered once - the others are linked to it (see sync_metadata_for_exports)
+                render_ids = node_ids
+                if dedupe_instances:
+                    render_ids, links = plan_instance_renders(file_data, node_ids)
+                    save_instance_links(subdir / "exports", links)
+                if fetch_exports(client, key, render_ids, subdir, img_queue, format=format, scale=scale,
+                                 areas=get_node_areas(file_data), transcode=transcode, concurrency=export_concurrency, no_download=no_download,
+                                 position=pbarpos(1, index=index, margin=5, batch=concurrency)):
                     skipped = False
-                else:
-                    # tqdm.write(f"{images_dir} - Layer images already fetched")
-                    ...
         if satisfied:
             color = Fore.YELLOW if skipped else Fore.GREEN
             tqdm.write(color + f"☑ {subdir}" + Fore.RESET)
@@ -401,6 +454,147 @@ def process_files(files, root_dir: Path, src_dir: Path, img_queue: queue.Queue,
         pbar.update(1)
 
 
+def plan_exports(file_data: dict, depth: int, include_canvas: bool, types: list[str], node_filter: NodeFilter, dedupe_instances: bool = False):
+    """
+    the export plan of a file, from a single pass over the document - the ids to render by their level ({depth: [id, ...]}), their render areas ({id: area}) and the links of the identical instances ({id: id})
+    """
+    ids, depths, _ = get_node_ids_and_depths(
+        file_data, depth=depth, include_canvas=include_canvas, types=types, node_filter=node_filter)
+    links = {}
+    if dedupe_instances:
+        # the shallowest instance represents the identical ones - rendered at the earliest level
+        ids, links = plan_instance_renders(file_data, sorted(ids, key=depths.get))
+    areas = get_node_areas(file_data)
+    levels = {}
+    for id_ in ids:
+        levels.setdefault(depths[id_], []).append(id_)
+    return levels, {id_: areas.get(id_, 0) for id_ in ids}, links
+
+
+def export_breadth_first(files: list[tuple[str, str]], root_dir: Path, src_dir: Path, img_queue: queue.Queue, figma_tokens: list[str], depth: int, include_canvas: bool, types: list[str], node_filter: NodeFilter, format: str, scale, transcode: str = None, dedupe_instances: bool = False, concurrency: int = 1, export_concurrency: int = 3, rate_limit: float = None, no_download: bool = False, hide_progress: bool = False):
+    """
+    exports the layers level by level across all the files - every file's top level layers first, then the next level of every file, ...
+    within a level, the files are taken in their order (e.g. by popularity). an interrupted run has the shallow levels of the whole corpus, rather than all the levels of a few files.
+
+    each document is read once, on the first level - only its export plan (the ids by level and their areas, see `plan_exports`) is kept for the next levels, and dropped after its last level.
+    """
+    clients = [
+        FigmaClient(figma_tokens[(i + 1) % len(figma_tokens)], max_retries=5 * concurrency,
+                    retry_delay=5 * concurrency, rate_limit=rate_limit)
+        for i in range(concurrency)
+    ]
+    if depth is not None:
+        depth = int(depth)
+    # the export plan of each file - (levels, areas)
+    plans = {}
+    lock = threading.Lock()
+
+    active = list(files)
+    level = 0
+    while active and (depth is None or level <= depth):
+        tasks = queue.Queue()
+        for item in active:
+            tasks.put(item)
+        pbar = tqdm(total=len(active), desc=f"🔥 Depth {level}", position=pbarpos(0), leave=True, disable=hide_progress)
+
+        def worker(index):
+            client = clients[index]
+            while True:
+                try:
+                    key, json_file = tasks.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    if key not in plans:
+                        file_data = read_file_data(src_dir / Path(json_file))
+                        if not file_data:
+                            continue
+                        levels, areas, links = plan_exports(
+                            file_data, depth=depth, include_canvas=include_canvas, types=types,
+                            node_filter=node_filter, dedupe_instances=dedupe_instances)
+                        del file_data
+                        save_instance_links(Path(root_dir) / key / "exports", links)
+                        with lock:
+                            plans[key] = (levels, areas)
+                    levels, areas = plans[key]
+                    if level in levels:
+                        fetch_exports(client, key, levels[level], Path(root_dir) / key, img_queue, format=format, scale=scale,
+                                      areas=areas, transcode=transcode, concurrency=export_concurrency, no_download=no_download,
+                                      position=pbarpos(1, index=index, margin=5, batch=concurrency))
+                except Exception as e:
+                    log_error(f"☒ {key} (depth {level}) - {e}", print=True)
+                finally:
+                    pbar.update(1)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        pbar.close()
+
+        # the files with deeper levels left - the plans of the others are dropped
+        for key in list(plans):
+            if max(plans[key][0], default=-1) <= level:
+                del plans[key]
+        active = [(key, json_file) for key, json_file in active if key in plans]
+        level += 1
+
+
+def fetch_exports(client: FigmaClient, key: str, node_ids: list[str], subdir: Path, img_queue: queue.Queue, format: str, scale, areas: dict = None, transcode: str = None, concurrency: int = 1, no_download: bool = False, position: int = None) -> bool:
+    """
+    renders the nodes not exported yet (nor unrenderable) and queues their downloads to {subdir}/exports - returns True if any was queued
+    the `areas` of the nodes (see `get_node_areas`) mix the cheap and the expensive nodes in each render chunk.
+    """
+    images_dir = subdir / "exports"
+    images_dir.mkdir(parents=True, exist_ok=True)
+    existing_images = get_existing_images(images_dir)
+
+    # Fetch and save layer images (A)
+    # (the originals replaced by the transcoded images are not fetched again)
+    formats = [format, transcode] if transcode else [format]
+    node_ids_to_fetch = [
+        node_id
+        for node_id in node_ids
+        if not any(
+            f"{node_id}.{fmt}" in existing_images
+            or f"{node_id}@{scale}x.{fmt}" in existing_images
+            for fmt in formats)
+    ]
+
+    # the layers failed to render (alone) in the previous runs are skipped
+    unrenderable = load_unrenderable(images_dir, scale, format)
+    node_ids_to_fetch = [
+        node_id for node_id in node_ids_to_fetch if node_id not in unrenderable
+    ]
+
+    if not node_ids_to_fetch or no_download:
+        # tqdm.write(f"{images_dir} - Layer images already fetched")
+        return False
+
+    # tqdm.write(f"Fetching {len(node_ids_to_fetch)} of {len(node_ids)} layer images...")
+    layer_images = fetch_node_images(
+        client, key, node_ids_to_fetch, scale, format,
+        concurrency=concurrency,
+        areas=areas,
+        unrenderable=unrenderable,
+        position=position)
+    save_unrenderable(images_dir, scale, format, unrenderable)
+    url_and_path_pairs = [
+        (
+            url,
+            os.path.join(
+                images_dir,
+                f"{node_id}{'@' + str(scale) + 'x' if scale != '1' else ''}.{format}",
+            ),
+        )
+        for node_id, url in layer_images.items()
+    ]
+    for pair in url_and_path_pairs:
+        img_queue.put(pair + (None,))
+    return True
+
+
 def requests_retry_session(
     retries=3,
     backoff_factor=1,
@@ -419,13 +613,92 @@ def requests_retry_session(
     return session
 
 
+def transcode_task(args):
+    path, format, quality, replace = args
+    return (path, *transcode_image(path, format=format, quality=quality, replace=replace))
+
+
+def transcode_archives(root_dir, keys, format, quality=None, replace=False, concurrency=cpu_count()):
+    """
+    transcodes the png / jpg images & exports of the keys ({root_dir}/{key}/images|exports) to webp / avif, in a process pool
+    """
+    paths = []
+    for key in keys:
+        for section in ["images", "exports"]:
+            directory = Path(root_dir) / key / section
+            paths.extend(
+                directory / file for file in get_existing_images(directory)
+                if Path(file).suffix.lower() in [".png", ".jpg", ".jpeg"]
+                and not (directory / file).with_suffix(f".{format}").exists()
+            )
+
+    saved = 0
+    transcoded = 0
+    with Pool(concurrency) as pool:
+        tasks = [(path, format, quality, replace) for path in paths]
+        for path, success, _saved, out in tqdm(pool.imap_unordered(transcode_task, tasks, chunksize=16), total=len(tasks), desc=f"🔥 Transcoding ({format})", position=pbarpos(0), leave=True):
+            if success:
+                transcoded += 1
+                saved += _saved
+
+    tqdm.write(f"☑ Transcoded {transcoded} of {len(paths)} images to {format} - saved {(saved / mb):.2f}MB")
+
+
+def preview_task(args):
+    path, sizes = args
+    return path, write_previews(path, sizes)
+
+
+def preview_archives(root_dir, keys, sizes, concurrency=cpu_count()):
+    """
+    writes the preview pyramids of the images & exports of the keys ({root_dir}/{key}/images|exports/previews/{size}/), in a process pool
+    """
+    paths = []
+    for key in keys:
+        for section in ["images", "exports"]:
+            directory = Path(root_dir) / key / section
+            # a single source per image - the original, if transcoded next to it
+            sources = {}
+            for file in sorted(get_existing_images(directory)):
+                file = Path(file)
+                if file.suffix.lower() in [".svg", ".pdf"]:
+                    continue
+                if file.stem not in sources or file.suffix[1:] not in TRANSCODE_FORMATS:
+                    sources[file.stem] = directory / file
+            paths.extend(sources.values())
+
+    written = 0
+    with Pool(concurrency) as pool:
+        tasks = [(path, sizes) for path in paths]
+        for path, done in tqdm(pool.imap_unordered(preview_task, tasks, chunksize=16), total=len(tasks), desc="🔥 Previews", position=pbarpos(0), leave=True):
+            written += len(done)
+
+    tqdm.write(f"☑ {written} previews of {len(paths)} images ({', '.join(map(str, sizes))})")
+
+
+# the malforms report reasons a re-fetch does not fix - the too small images are valid (e.g. a 1x1 fill), the same image is downloaded again
+REPORT_SKIP_REASONS = {"too small"}
+
+
+def read_report_keys(report):
+    """the file keys listed in the malforms report (jsonl) - with a malformed file a re-fetch can fix"""
+    keys = set()
+    with open(report, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                record = json.loads(line)
+                if record.get("reason") not in REPORT_SKIP_REASONS:
+                    keys.add(record["key"])
+    return keys
+
+
 def validate_image(image_path):
-    """Check if the image is valid or not."""
-    try:
-        Image.open(image_path).verify()
-        return True
-    except (IOError, SyntaxError):
-        return False
+    """Check if the image is valid or not (the header and the trailer only - a truncated download fails)."""
+    ext = os.path.splitext(image_path)[1][1:].lower()
+    if ext in imagesize.VECTOR_FORMATS:
+        return imagesize.is_valid_vector(image_path, ext)
+    return imagesize.is_valid(image_path)
 
 
 @backoff.on_exception(
@@ -446,7 +719,7 @@ def __download(url: str, output_path: str, timeout: int = 10):
             if chunk:  # filter out keep-alive new chunks
                 f.write(chunk)
     # if image,
-    if mimetype in GRAPHIC_FORMATS:
+    if mimetype in imagesize.GRAPHIC_FORMATS:
         # check if the image is valid, if not delete it
         if not validate_image(output_path):
             os.remove(output_path)
@@ -517,22 +790,21 @@ def image_queue_handler(img_queue: queue.Queue, batch=64):
             except queue.Empty:
                 ...
 
-        if url == 'EOD':  # Break the outer loop if sentinel value is encountered
-            tqdm.write("⏰ sentinel value encountered")
-            break
-
-        if not items_to_process:
-            break
-
-        progress.desc = f"{random.choice(emojis)}"
-        with ThreadPoolExecutor(max_workers=batch) as executor:
-            download_func = partial(
-                download_image_with_progress_bar, progress=progress)
-            executor.map(download_func, items_to_process)
+        if items_to_process:
+            progress.desc = f"{random.choice(emojis)}"
+            with ThreadPoolExecutor(max_workers=batch) as executor:
+                download_func = partial(
+                    download_image_with_progress_bar, progress=progress)
+                executor.map(download_func, items_to_process)
 
-        time.sleep(0.1)
+            time.sleep(0.1)
         progress.close()
 
+        # Break the outer loop if sentinel value is encountered (after the last batch is processed)
+        if url == 'EOD':
+            tqdm.write("⏰ sentinel value encountered")
+            break
+
     tqdm.write("✅ Image Archiving Complete")
 
 
@@ -576,322 +848,14 @@ def fixstr(str, n=80):
 mb = 1024 * 1024
 
 
-def optimize_image(path, out=None, max_size=1*mb, max_width=None, max_height=None):
-    """
-    Note: This only supports PNGs at the moment
-
-    max_size: maximum size in bytes - pass None to skip this check
-    max_width: maximum width in pixels - pass None to skip this check
-    max_height: maximum height in pixels - pass None to skip this check
-
-    If max_width or max_height is specified, the image will be resized again if necessary
-
-    returns:
-    - 0. True / False: whether the image was optimized
-    - 1. The space saved in bytes
-    - 2. The "A" width and height of the image
-    - 3. The "new" width and height of the image
-    - 4. The scale factor used to resize the image
-    """
-    # validate inputs
-    if max_width == 0:
-        max_width = None
-    if max_height == 0:
-        max_height = None
-    # either max_size or max_width or max_height must be specified
-    if max_size is None and max_width is None and max_height is None:
-        raise ValueError(
-            "Either max_size or max_width or max_height must be specified")
-
-    if out is None:
-        out = path
-
-    optimization_data = read_image_optimization_metadata(path)
-    ext = os.path.splitext(path)[1].lower()
-
-    if ext == '.png':
-        target_ext = 'png'
-    elif ext == '.jpg' or ext == '.jpeg':
-        target_ext = 'jpg'
-    else:
-        # not supported
-        return False, 0, 0, 0, 0
-
-    margin = 0.3
-    try:
-        # Open the image
-        img = Image.open(path)
-
-        if optimization_data is not None:
-            a_size = optimization_data['size']['a']
-            a_w, a_h = optimization_data['dimensions']['a']
-        else:
-            a_size = os.path.getsize(path)
-            # current dimensions
-            a_w, a_h = img.size
-
-        new_size = (a_w, a_h)
-
-        targetsize = max_size - \
-            (margin * mb) if max_size is not None else float('inf')
-
-        scale_factor_a = math.sqrt(
-            targetsize / a_size) if max_size is not None and a_size > max_size else 1
-
-        # If either max_width or max_height is specified, resize the image while preserving aspect ratio
-        w_scale = max_width / a_w if max_width else float('inf')
-        h_scale = max_height / a_h if max_height else float('inf')
-        scale_factor_b = min(w_scale, h_scale)
-
-        scale_factor = min(scale_factor_a, scale_factor_b)
-
-        if scale_factor < 1:  # Only resize if new size is smaller
-            new_size = (int(a_w * scale_factor), int(a_h * scale_factor))
-            if new_size[0] == 0 or new_size[1] == 0:
-                return False, 0, 0, 0, 0
-            img = img.resize(new_size)
-
-        # Save the image to a temporary file
-        with tempfile.NamedTemporaryFile(mode='wb', suffix=f'.{target_ext}', delete=False) as tmp:
-            metadata = a_w, a_h, a_size
-            if target_ext == 'png':
-                img.save(tmp.name,
-                         format='PNG',
-                         optimize=True,
-                         pnginfo=png_optimization_metadata(*metadata))
-            elif target_ext == 'jpg':
-                exif = img.getexif()
-                # 0x9286 is the exif tag for user comment
-                exif[0x9286] = jpg_optimization_metadata(*metadata)
-                img.save(tmp.name,
-                         format='JPEG',
-                         optimize=True,
-                         exif=exif)
-            else:
-                raise ValueError(f"Unsupported image format: {target_ext}")
-
-            # double check if it actually got smaller
-            if os.path.getsize(tmp.name) >= a_size:
-                os.remove(tmp.name)
-                return False, 0, (a_w, a_h), (a_w, a_h), 1
-            # Remove the original file before moving the temporary file to the original filename
-            os.remove(path)
-            shutil.move(tmp.name, out)
-        endsize = os.path.getsize(out)
-        saved = a_size - endsize
-
-        return True, saved, (a_w, a_h), new_size, scale_factor
-    except Exception as e:
-        log_error(f"☒ Error optimizing {path}: {e}", print=True)
-        return False, 0, None, None, None
-
-
-def read_image_optimization_metadata(path):
-    path = Path(path)
-    ext = path.suffix.lower()
-    if ext == '.png':
-        return read_png_optimization_metadata(path)
-    elif ext == '.jpg' or ext == '.jpeg':
-        return read_jpg_optimization_metadata(path)
-    else:
-        return None
-        # raise ValueError(f"Unsupported file extension: {ext}")
-
-
-def png_optimization_metadata(aW, aH, aS):
-    metadata = PngInfo()
-    # save compressed text info
-    # AD stands for "A dimensions - original dimensions"
-    metadata.add_text('AD', f'{aW}x{aH}')
-    # AS stands for "A size - original size in bytes"
-    metadata.add_text('AS', f'{aS}')
-    return metadata
-
-
-def read_png_optimization_metadata(path):
-    try:
-        img = Image.open(path)
-    except (UnidentifiedImageError, OSError) as e:
-        log_error(f"☒ Error reading {path}: {e}", print=True)
-        return None
-    metadata = img.info
-    aD = metadata.get('AD', None)
-    aW = int(aD.split('x')[0]) if aD else None
-    aH = int(aD.split('x')[1]) if aD else None
-    aS = metadata.get('AS', None)
-    aS = float(aS) if aS else None
-    img.close()
-
-    if aD is None:
-        return None
-
-    return {
-        'dimensions': {
-            'a': (aW, aH),
-            'b': img.size,
-        },
-        'size': {
-            'a': aS,
-            'b': os.path.getsize(path),
-        },
-    }
-
-
-def read_jpg_optimization_metadata(path):
-    try:
-        img = Image.open(path)
-    except (UnidentifiedImageError, OSError) as e:
-        log_error(f"☒ Error reading {path}: {e}", print=True)
-        return None
-    exif = img.getexif()
-    # 0x9286 is the exif tag for user comment
-    data = exif.get(0x9286, None)
-    img.close()
+def fetch_file_images(client: FigmaClient, file_key):
     try:
-        data = json.loads(data)
-        return {
-            'dimensions': {
-                'a': (data['AW'], data['AH']),
-                'b': img.size,
-            },
-            'size': {
-                'a': data['AS'],
-                'b': os.path.getsize(path),
-            },
-        }
-    except:
-        return None
-
-
-def jpg_optimization_metadata(aW, aH, aS):
-    return json.dumps({
-        'AW': aW,
-        'AH': aH,
-        'AS': aS,
-    }, separators=(',', ':'))
-
-
-def fetch_file_images(file_key, token):
-    url = f"{API_BASE_URL}/files/{file_key}/images"
-    headers = {"X-FIGMA-TOKEN": token}
-    try:
-        response = requests.get(url, headers=headers)
-        data = response.json()
-    except (requests.exceptions.ConnectionError, json.decoder.JSONDecodeError) as e:
+        return client.file_images(file_key)
+    except (requests.exceptions.RequestException, ValueError) as e:
         log_error(f"☒ Error fetching image fills: {e}", print=True)
         return {}
-
-    if "error" in data and data["error"]:
+    except FigmaAPIError:
         raise ValueError("Error fetching image fills")
-    try:
-        return data["meta"]["images"]
-    except KeyError:
-        return {}
-
-
-def fetch_node_images(file_key, ids, scale, format, token, position, conncurrency):
-    url = f"{API_BASE_URL}/images/{file_key}"
-    headers = {"X-FIGMA-TOKEN": token}
-    params = {
-        "ids": "",
-        "use_absolute_bounds": "true",
-        "scale": scale,
-        "format": format,
-    }
-
-    # figma server allows up to 5000 characters in the url (between 4000 ~ 6000 characters)
-    def chunk(ids, url=url, params=params, max_len=5000):
-        """
-        chunk the ids for the api call to avoid the url max length limit.
-        most browsers have a limit of 2048 characters, but for this case, it is safe to increase it to 4000
-        use the url and params info to calculate the length of the api call
-        the chunked ids will be formatted as id1,id2,id3
-        """
-
-        def get_chunk_len(chunk):
-            return len(url) + len(",".join(chunk)) + len(urlencode(params))
-
-        chunk = []
-        for id_ in ids:
-            if get_chunk_len(chunk + [id_]) > max_len:
-                yield chunk
-                chunk = []
-            chunk.append(id_)
-        yield chunk
-
-    max_retry = 5 * conncurrency
-    delay_between_429 = 5
-    ids_chunks = list(chunk(ids))
-    size = len(ids)
-
-    def fetch_images_chunk(chunk, retry=0):
-        params["ids"] = ",".join(chunk)
-        try:
-            response = requests.get(url, headers=headers, params=params)
-        except requests.exceptions.ReadTimeout as e:
-            return {}
-        except requests.exceptions.ConnectionError as e:
-            return {}
-        except requests.exceptions.JSONDecodeError as e:
-            return {}
-        except json.decoder.JSONDecodeError as e:
-            return {}
-
-        if response.status_code == 429:
-            if retry >= max_retry:
-                log_error(
-                    f"Error fetching [{(','.join(chunk))}] layer images. Rate limit exceeded.")
-                tqdm.write(Fore.YELLOW +
-                           f"☒ HTTP429 - Rate limit exceeded. ({max_retry} tries)")
-                return {}
-
-            # check if retry-after header is present
-            retry_after = response.headers.get("retry-after")
-            retry_after = int(
-                retry_after) if retry_after else delay_between_429 * (retry + 1) * conncurrency
-
-            if max_retry - retry < 2:
-                # only show the last retry message
-                tqdm.write(
-                    Fore.YELLOW +
-                    f"☒ HTTP429 - Waiting {retry_after} seconds before retrying...  ({retry + 1}/{max_retry})")
-            time.sleep(retry_after)
-            return fetch_images_chunk(chunk, retry=retry + 1)
-
-        try:
-            data = response.json()
-        except requests.exceptions.JSONDecodeError as e:
-            return {}
-
-        if "err" in data and data["err"]:
-            # ignore and report error
-            msg = f"Error fetching {len(chunk)} layer images [{','.join(chunk)}], e:{data['err']}"
-            log_error(msg)
-            return {}
-        return data["images"]
-
-    max_concurrent_requests = conncurrency
-    num_batches = -(-len(ids_chunks) // max_concurrent_requests)
-    batch_chunks = chunked_list(ids_chunks, num_batches)
-
-    # TODO: group the batches to one ThreadPoolExecutor
-    # TODO: the below logic seems duplicated.
-    emojis = ['🛫', '🛬']
-    image_urls = {}
-    with tqdm(range(num_batches), desc=f"{random.choice(emojis)} ({len(ids)}/{len(ids_chunks)}/{num_batches})", position=position, leave=False, mininterval=1) as pbar:
-        for batch_idx in pbar:
-            for _chunk in batch_chunks[batch_idx]:
-                pbar.set_description(
-                    fixstr(f"{random.choice(emojis)} {fixstr(file_key, 8)} @{scale}x.{format} ({size})", 25))
-                image_urls.update(fetch_images_chunk(chunk=_chunk))
-
-            if batch_idx < num_batches - 1:
-                delay_between_batches = 3
-                pbar.set_description(
-                    f"{random.choice(emojis)} {batch_idx + 1 + 1}/{num_batches}: Waiting {delay_between_batches} seconds before next batch...")
-                time.sleep(delay_between_batches)
-
-    return image_urls
 
 
 def calculate_program():
@@ -920,7 +884,8 @@ def sync_metadata_for_hash_images(root_dir, src_dir, key):
     if not path.exists():
         return
 
-    document = read_file_data(Path(src_dir) / f"{key}.json")
+    document = read_file_data(find_document(
+        src_dir, key) or Path(src_dir) / f"{key}.json")
     if not document:
         return
 
@@ -938,13 +903,18 @@ def sync_metadata_for_hash_images(root_dir, src_dir, key):
             olddata = {}
 
         images = {}
+        transcoded = {}
         optimization = {}
         dimensions = {}
-        for hash_ in hashes:
-            # hash : file
-            file = [file for file in files if file.stem == hash_][0]
-            ext = file.suffix
+        for hash_ in set(hashes):
+            # hash : file (the original, if transcoded next to it)
+            candidates = sorted(file for file in files if file.stem == hash_)
+            originals = [file for file in candidates if file.suffix[1:] not in TRANSCODE_FORMATS]
+            variants = [file for file in candidates if file.suffix[1:] in TRANSCODE_FORMATS]
+            file = (originals or variants)[0]
             images[hash_] = file.name
+            if variants and originals:
+                transcoded[hash_] = variants[0].name
             data = read_image_optimization_metadata(path / file)
             if not data:
                 continue
@@ -976,6 +946,10 @@ def sync_metadata_for_hash_images(root_dir, src_dir, key):
             "archivedAt": datetime.now().isoformat(),
             # images map hash to file name
             "images": images,
+            # hash to the transcoded (webp / avif) file name - when kept next to the original
+            "transcoded": transcoded,
+            # the preview pyramid (previews/{size}/{hash}.webp), None if not generated
+            "previews": previews_metadata(path),
             # original
             "dimensions": {
                 # hash: [width, height]
@@ -1003,7 +977,8 @@ def sync_metadata_for_exports(root_dir, src_dir, key):
     if not path.exists():
         return
 
-    document = read_file_data(Path(src_dir) / f"{key}.json")
+    document = read_file_data(find_document(
+        src_dir, key) or Path(src_dir) / f"{key}.json")
     if not document:
         return
 
@@ -1025,6 +1000,16 @@ def sync_metadata_for_exports(root_dir, src_dir, key):
         name, scale, fmt = scale_and_format_from_name(export)
         node_exports[name].append(f"@{scale}x.{fmt}")
 
+    # the identical instances (rendered once, with --dedupe-instances) - linked to the exports of their representative, as planned (see save_instance_links)
+    links = {
+        id_: representative for id_, representative in load_instance_links(path).items()
+        if id_ in node_exports and not node_exports[id_] and node_exports.get(representative)
+    }
+    resolved_exports = {
+        id_: node_exports[links[id_]] if id_ in links else exports_
+        for id_, exports_ in node_exports.items()
+    }
+
     # validate the resolutions
     # "resolutions": [
     #     # depth, scale, format
@@ -1036,7 +1021,7 @@ def sync_metadata_for_exports(root_dir, src_dir, key):
     resolutions = []
     for depth in range(maxdepth):
         ids = [key for key, v in depths.items() if v == depth]
-        exports = [export for id_ in ids for export in node_exports[id_]]
+        exports = [export for id_ in ids for export in resolved_exports[id_]]
         scales_and_formats = [scale_and_format_from_name(
             export) for export in exports]
         scales = set([s for _, s, _ in scales_and_formats])
@@ -1061,7 +1046,11 @@ def sync_metadata_for_exports(root_dir, src_dir, key):
         # the last mod date of the meta file (a.k.a last archived)
         "archivedAt": datetime.now().isoformat(),
         "resolutions": resolutions,  # the resolutions that are exported
+        # the preview pyramid (previews/{size}/{name}.webp), None if not generated
+        "previews": previews_metadata(path),
         "map": node_exports,
+        # the nodes with no export of their own, rendering identically to another node - {id: id}
+        "links": links,
         "depths": {
             "min": 1,
             "max": maxdepth + 1,
@@ -1078,22 +1067,22 @@ def sync_metadata_for_exports(root_dir, src_dir, key):
 def read_file_data(file: Path):
     if file.is_file():
         try:
-            with open(file, "r") as file:
-                file_data = json.load(file)
+            with open_document(file) as f:
+                file_data = json.load(f)
                 return file_data
-        except json.decoder.JSONDecodeError as e:
+        except (json.decoder.JSONDecodeError, EOFError, OSError) as e:
             log_error(
-                f"Error loading {file} Skipping... (Malformed JSON file)) - error: {e.msg} {e.args}")
+                f"Error loading {file} Skipping... (Malformed JSON file)) - error: {e}")
 
             # read the json file and print the start and end of it for debugging
             try:
-                with open(file, "r") as file:
-                    txt = file.read()
+                with open_document(file) as f:
+                    txt = f.read().decode("utf-8", errors="replace")
                     _first_few = txt[0: 100]
                     _last_few = txt[-100:]
                     tqdm.write(f"First few characters: \n{_first_few}")
                     tqdm.write(f"Last few characters: \n{_last_few}")
-            except TypeError as e:
+            except (TypeError, EOFError, OSError) as e:
                 ...
             return None
     else:
@@ -1101,60 +1090,6 @@ def read_file_data(file: Path):
         return None
 
 
-def get_node_ids_and_depths(data, depth=None, include_canvas=False, types=None):
-    """
-    Returns a tuple of three lists:
-    1. The IDs of the nodes.
-    2. A dictionary that maps each ID to its depth in the tree.
-    3. The maximum depth among all nodes.
-
-    If `types` are specified, only nodes of those types are returned. Defaults to all types (None).
-    """
-    def extract_ids_recursively(node, current_depth):
-        if depth is not None and current_depth > depth:
-            return [], {}
-
-        ids = []
-        depth_map = {}
-
-        if types is None or node["type"] in types:
-            ids.append(node["id"])
-            depth_map[node["id"]] = current_depth
-
-        if "children" in node:
-            for child in node["children"]:
-                child_ids, child_depth_map = extract_ids_recursively(
-                    child, current_depth + 1)
-                ids.extend(child_ids)
-                depth_map.update(child_depth_map)
-
-        return ids, depth_map
-    try:
-        if include_canvas:
-            ids, depth_map = zip(*[
-                extract_ids_recursively(child, 0)
-                for child in data["document"]["children"]
-            ])
-        else:
-            ids, depth_map = zip(*[
-                extract_ids_recursively(child, 0)
-                for canvas in data["document"]["children"]
-                for child in canvas['children']
-            ])
-
-        # Flatten lists and merge dictionaries
-        ids = [id_ for sublist in ids for id_ in sublist]
-        depth_map = {k: v for dict_ in depth_map for k, v in dict_.items()}
-        try:
-            max_depth = max(depth_map.values())
-        except ValueError:
-            max_depth = 0
-
-        return ids, depth_map, max_depth
-    except (ValueError, TypeError):
-        return [], {}, 0
-
-
 def get_existing_images(images_dir):
     try:
         return set(filter_graphic_files(os.listdir(images_dir)))
@@ -1162,260 +1097,6 @@ def get_existing_images(images_dir):
         return set()
 
 
-def get_node_dimensions(node):
-    """
-    Extract the width and height from a node's transformation matrix.
-
-    Parameters:
-    node: A document tree node.
-
-    Returns:
-    Tuple of width and height. (scale is applied to the original size)
-
-    Note: this is not considered as "absolute" transform since it does not iterates through the parents' relativeTransform.
-    """
-
-    # Get the transformation matrix
-    transform = node['relativeTransform']
-    size = node['size']
-
-    if transform is None or size is None:
-        raise ValueError(
-            f"Node {node.get('id')} is missing either relativeTransform or size")
-
-    x = size['x']
-    y = size['y']
-
-    if x is None or y is None:
-        raise ValueError(
-            f"Node {node.get('id')} is missing either size.x or size.y")
-
-    # The scaling factors are at positions [0][0] and [1][1]
-    width_scale = transform[0][0]
-    height_scale = transform[1][1]
-
-    # The width and height are the scaling factors multiplied by the original size
-    width = (width_scale if width_scale else 1) * size['x']
-    height = (height_scale if height_scale else 1) * size['y']
-
-    return width, height
-
-
-def optimized_image_paint_map(paint_map, images: dict) -> dict[str, dict]:
-    """
-    Create a map that shows each hash image's usage in a document and the nodes that use it, along with the paint object.
-    Plus, it also returns a "max" property for each hash image, which is the maximum size of the image used in the document.
-    We can use max property to resize the image as so (if the original image is bigger than max), without losing quality.
-
-    Parameters:
-    node: A document tree node.
-    images: A dictionary mapping image hashes to local directory path (original file, without any optimizations).
-    """
-
-    # TODO: validate this with testing
-    def calculate_fit_size(nodesize, imgsize):
-        """
-        Calculate the size of the image when the scale mode is FIT.
-        FIT means the image will be scaled up or down to fit within the size of the node, while maintaining the aspect ratio.
-        """
-        iw, ih = imgsize
-        node_width, node_height = nodesize
-        width_ratio = node_width / iw
-        height_ratio = node_height / ih
-        ratio = min(width_ratio, height_ratio)
-
-        return iw * ratio, ih * ratio
-
-    # TODO: validate this with testing
-    def calculate_fill_size(nodesize, imgsize):
-        """
-        Calculate the size of the image when the scale mode is FILL.
-        FILL means the image will be scaled up or down to cover the whole node, while maintaining the aspect ratio.
-        """
-        iw, ih = imgsize
-        node_width, node_height = nodesize
-        width_ratio = node_width / iw
-        height_ratio = node_height / ih
-        ratio = max(width_ratio, height_ratio)
-
-        return iw * ratio, ih * ratio
-
-    # TODO: validate this with testing
-    def calculate_tile_size(imgsize, scaling_factor):
-        """
-        Calculate the size of the image when the scale mode is TILE.
-        TILE means the image will be repeated across the node.
-        """
-        iw, ih = imgsize
-
-        # For tiling, we need to ensure the size of the individual tile,
-        # i.e., the image size after applying the scaling factor.
-        tile_width = iw * scaling_factor
-        tile_height = ih * scaling_factor
-
-        return tile_width, tile_height
-
-    # TODO: validate this with testing
-    def calculate_stretch_size(imgsize, image_transform, rotation, relativeTransform):
-        """
-        Calculate the size of an image with the STRETCH scale mode.
-
-        Parameters:
-        node: A dictionary representing the node, with the keys "w" and "h" representing the width and height of the node, respectively.
-        image_transform: A 2D array representing the affine transform applied to the image.
-        rotation: A float representing the rotation of the image, in degrees.
-
-        Returns:
-        A tuple (width, height) representing the size of the image.
-        """
-        iw, ih = imgsize
-
-        # Convert the image transform and relativeTransform to Numpy arrays.
-        image_transform = np.array(image_transform)
-        relativeTransform = np.array(relativeTransform)
-
-        # Convert the rotation from degrees to radians.
-        rotation = np.deg2rad(rotation)
-        rotation_matrix = np.array([
-            [np.cos(rotation), -np.sin(rotation)],
-            [np.sin(rotation), np.cos(rotation)]
-        ])
-
-        # Compute inverse of the rotation_matrix
-        inv_rotation_matrix = np.linalg.inv(rotation_matrix)
-
-        # Combine the image transform with the rotation.
-        image_transform_rotated = np.dot(
-            image_transform[:, :2], rotation_matrix)
-        image_transform_rotated = np.hstack(
-            [image_transform_rotated, image_transform[:, 2, np.newaxis]])
-
-        # the final transform - image_transform (rotation applied) * relativeTransform (node transform)
-        transform = np.dot(image_transform_rotated[:, :2], inv_rotation_matrix)
-        transform = np.hstack(
-            [transform, image_transform_rotated[:, 2, np.newaxis]])
-
-        # Apply the transform to the size of the node.
-        rendersize = np.dot(transform[:, :2], [iw, ih])
-        rw, rh = rendersize
-
-        # The size might not be integer values after applying the transform, so we take the absolute value and round up to the nearest integer.
-        width = np.ceil(np.abs(rw))
-        height = np.ceil(np.abs(rh))
-
-        return width, height
-
-    for hash_image, info in paint_map.items():
-        max_width = 0
-        max_height = 0
-        original_image_path = images[hash_image]
-
-        # Read original image size
-        try:
-            with Image.open(original_image_path) as img:
-                imgsize = img.size
-                ow, oh = imgsize
-        except (UnidentifiedImageError, OSError):
-            log_error(f"Cannot read image {original_image_path}. Skipping...")
-            continue
-
-        for usage in info["usage"]:
-            id = usage["id"]
-            paint = usage["paint"]
-            node = info["nodes"][id]
-            # Note: this is not considered as "absolute" transform since it does not iterates through the parents' relativeTransform.
-            relativeTransform = node["relativeTransform"]
-            try:
-                nodesize = get_node_dimensions(node)
-            except ValueError as e:
-                log_error(f'Invalid node value - {e}')
-                continue
-
-            scale_mode = paint["scaleMode"]
-
-            if scale_mode == "FIT":
-                width, height = calculate_fit_size(
-                    nodesize=nodesize, imgsize=imgsize)
-            elif scale_mode == "FILL":
-                width, height = calculate_fill_size(
-                    nodesize=nodesize, imgsize=imgsize)
-            elif scale_mode == "TILE":
-                scaling_factor = paint["scalingFactor"]
-                width, height = calculate_tile_size(
-                    imgsize=imgsize, scaling_factor=scaling_factor)
-            elif scale_mode == "STRETCH":
-                image_transform = paint["imageTransform"]
-                rotation = paint.get("rotation", 0)
-                try:
-                    width, height = calculate_stretch_size(
-                        imgsize, image_transform, rotation, relativeTransform)
-                except TypeError as e:
-                    log_error(f'unable to get desired size - {e}')
-                    continue
-            else:
-                raise ValueError(f"Unsupported scale mode: {scale_mode}")
-
-            # Compare with original image size, we cannot have an image bigger than the original
-            width = min(ow, width)
-            height = min(oh, height)
-
-            max_width = max(max_width, width)
-            max_height = max(max_height, height)
-            # print((max_width, max_height), imgsize,  nodesize, node, paint)
-        info["max"] = {
-            "width": max_width,
-            "height": max_height,
-        }
-
-    return paint_map
-
-
-def image_paint_map(node) -> dict:
-    """
-    Create a map that shows where each image hash is used in a document.
-
-    Parameters:
-    node: The current node in the document tree.
-
-    Returns:
-    A dictionary mapping each hash to a list of dictionaries, each containing the id, and the fill object of a node where the hash is used.
-    """
-    map = {}
-
-    # If the node has fills, check them for image references
-    if "fills" in node:
-        for fill in node["fills"]:
-            if "imageRef" in fill:
-                # This fill includes an image reference, so we record this node
-                if fill["imageRef"] not in map:
-                    map[fill["imageRef"]] = {"usage": [], "nodes": {}}
-
-                # Append usage and nodes if not already present
-                map[fill["imageRef"]]["usage"].append(
-                    {"id": node["id"], "paint": fill})
-                if node["id"] not in map[fill["imageRef"]]["nodes"]:
-                    map[fill["imageRef"]]["nodes"][node["id"]] = {
-                        "type": node["type"],
-                        "relativeTransform": node["relativeTransform"],
-                        "size": node["size"],
-                    }
-
-    # Recurse into the children of this node, if it has any
-    if "children" in node:
-        for child in node["children"]:
-            child_map = image_paint_map(child)
-            # Merge the child's map into our map
-            for hash, data in child_map.items():
-                if hash not in map:
-                    map[hash] = {"usage": [], "nodes": {}}
-
-                # Merge usage and nodes lists
-                map[hash]["usage"].extend(data["usage"])
-                map[hash]["nodes"].update(data["nodes"])
-
-    return map
-
-
 def chunked_zips(a: list, b: list, n: int) -> List[zip]:
     zipsize = len(a)
     per_zip = zipsize // n
@@ -1435,40 +1116,13 @@ def chunked_zips(a: list, b: list, n: int) -> List[zip]:
     return zips
 
 
-def chunked_list(a: list, n: int) -> List[zip]:
-    listsize = len(a)
-    perlist = listsize // n
-    remainder = listsize - perlist * n
-    chunks = []
-    for i in range(n - 1):
-        start = i * perlist
-        end = start + perlist
-        _a = a[start:end]
-        chunks.append(_a)
-    start = (n - 1) * perlist
-    end = start + perlist + remainder
-    _a = a[start:end]
-    chunks.append(_a)
-    return chunks
-
-
-GRAPHIC_FORMATS = [
-    ".png",
-    ".jpg",
-    ".jpeg",
-    ".gif"
-    ".svg",
-    ".pdf",
-]
-
-
 def filter_graphic_files(files):
     return [
         file
         for file in files
         if any(
             file.endswith(fmt)
-            for fmt in GRAPHIC_FORMATS
+            for fmt in imagesize.GRAPHIC_FORMATS
         )
     ]
 
@@ -0,0 +1,211 @@
+# near-duplicate index over the archived exports (and images) - many community files are forks of the same kits, rendering the same layers under different keys & ids.
+# the perceptual hash (dHash) of each file is indexed once (incrementally) to an npz, then queried / clustered by the hamming distance (multi-index hashing).
+
+import os
+import sys
+import json
+import hashlib
+from multiprocessing import Pool, cpu_count
+from pathlib import Path
+from tqdm import tqdm
+import click
+
+# for importing the shared figma_core package
+sys.path.insert(0, os.path.dirname(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__)))))
+
+from figma_core.phash import dhash, HashIndex, clusters as find_clusters, hamming, load_index, save_index
+from figma_core.optimize import TRANSCODE_FORMATS, PREVIEWS_DIR, preview_path
+
+SECTIONS = ['exports']
+
+extensions = ['.png', '.jpg', '.jpeg', '.gif', '.webp', '.avif']
+
+
+def hash_task(args):
+    """
+    the dHash of the file - from its smallest preview if there is one (see images.py --previews), None if it can't be read
+    """
+    root, name = args
+    path = Path(root) / name
+    source = path
+    previews = path.parent / PREVIEWS_DIR
+    if previews.is_dir():
+        sizes = sorted(int(entry.name) for entry in os.scandir(previews) if entry.name.isdigit())
+        for size in sizes:
+            preview = preview_path(path, size)
+            if preview.exists() and preview.stat().st_mtime >= path.stat().st_mtime:
+                source = preview
+                break
+    try:
+        return name, dhash(source)
+    except Exception:
+        return name, None
+
+
+def scan(root, sections):
+    """
+    the files to index under the root ({root}/{key}/{section}/*) - relative names and their mtimes, a single file per stem (the original, if transcoded next to it)
+    """
+    files = {}
+    for entry in os.scandir(root):
+        if not entry.is_dir() or entry.name.startswith('.'):
+            continue
+        for section in sections:
+            directory = Path(entry.path) / section
+            if not directory.is_dir():
+                continue
+            sources = {}
+            for file in sorted(os.scandir(directory), key=lambda f: f.name):
+                stem, ext = os.path.splitext(file.name)
+                if not file.is_file() or ext.lower() not in extensions:
+                    continue
+                if stem not in sources or ext[1:].lower() not in TRANSCODE_FORMATS:
+                    sources[stem] = file
+            for file in sources.values():
+                files[f"{entry.name}/{section}/{file.name}"] = file.stat().st_mtime_ns
+    return files
+
+
+def digest(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def link_file(src, dst):
+    """
+    replaces dst with a hardlink to src (atomically)
+    """
+    tmp = Path(str(dst) + '.link.tmp')
+    os.link(src, tmp)
+    os.replace(tmp, dst)
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.argument('dir', type=click.Path(exists=True, file_okay=False))
+@click.option('-o', '--output', default=None, type=click.Path(dir_okay=False), help='The index file (defaults to {dir}/dupes.npz) - updated incrementally')
+@click.option('--sections', default=','.join(SECTIONS), help='The directories of each archive to index (comma separated) - e.g. exports,images')
+@click.option('-c', '--concurrency', type=click.INT, default=cpu_count(), help='Number of processes to utilize')
+def index(dir, output, sections, concurrency):
+    """
+    indexes the dHash of the {dir}/{key}/{sections} files - only the new & modified files are hashed
+    """
+    output = output or os.path.join(dir, 'dupes.npz')
+    sections = [section.strip() for section in sections.split(',')]
+    files = scan(dir, sections)
+
+    data = load_index(output)
+    # the unchanged files are kept as they are
+    known = {
+        name: (h, mtime) for name, h, mtime in zip(data['paths'].tolist(), data['hashes'].tolist(), data['mtimes'].tolist())
+        if files.get(name) == mtime
+    }
+    todo = [name for name in files if name not in known]
+    tqdm.write(f'{len(files)} files, {len(known)} indexed, {len(todo)} to hash')
+
+    failed = 0
+    with Pool(concurrency) as pool:
+        for name, h in tqdm(pool.imap_unordered(hash_task, [(dir, name) for name in todo], chunksize=64), total=len(todo), desc='#️⃣'):
+            if h is None:
+                failed += 1
+                tqdm.write(f'☒ {name} - cannot read')
+                continue
+            known[name] = (h, files[name])
+
+    names = sorted(known)
+    save_index(output, os.path.abspath(dir),
+               names, [known[name][0] for name in names], [known[name][1] for name in names])
+    click.echo(f'{len(names)} indexed ({failed} failed) → {output}')
+
+
+@cli.command()
+@click.argument('index', type=click.Path(exists=True, dir_okay=False))
+@click.argument('image', type=click.Path(exists=True, dir_okay=False))
+@click.option('-d', '--distance', default=4, type=click.IntRange(0, 7), help='Max hamming distance (bits of 64)')
+def query(index, image, distance):
+    """
+    lists the indexed files near the image
+    """
+    data = load_index(index)
+    h = dhash(image)
+    matches = HashIndex(data['hashes']).query(h, distance)
+    for i in matches:
+        d = int(hamming(data['hashes'][i], h))
+        click.echo(f"{d}\t{os.path.join(data['root'], data['paths'][i])}")
+
+
+@cli.command()
+@click.argument('index', type=click.Path(exists=True, dir_okay=False))
+@click.option('-d', '--distance', default=4, type=click.IntRange(0, 7), help='Max hamming distance (bits of 64)')
+@click.option('-o', '--output', default=None, type=click.Path(dir_okay=False), help='Write the clusters to a jsonl report')
+@click.option('--hardlink', is_flag=True, default=False, help='Replace the byte-identical duplicates with hardlinks to the first of their cluster (storage dedupe)')
+@click.option('--drop', is_flag=True, default=False, help='Remove the members within the distance of the first of their cluster (dataset dedupe - on a copy, not on the archive images.py writes to)')
+@click.option('--dry-run', is_flag=True, default=False, help='Only list what would be linked / removed')
+def clusters(index, distance, output, hardlink, drop, dry_run):
+    """
+    lists the clusters of near-duplicates (connected within the distance)
+    """
+    if hardlink and drop:
+        raise click.UsageError('--hardlink and --drop are exclusive')
+    data = load_index(index)
+    root = Path(data['root'])
+    paths = data['paths']
+    hashes = data['hashes']
+
+    groups = find_clusters(hashes, distance)
+    # the largest clusters first
+    groups.sort(key=len, reverse=True)
+
+    report = open(output, 'w') if output else None
+    linked = dropped = saved = 0
+    for n, group in enumerate(tqdm(groups, desc='🔗')):
+        group = sorted(group, key=lambda i: paths[i])
+        first, rest = group[0], group[1:]
+        members = [{'path': str(paths[i]), 'distance': int(hamming(hashes[i], hashes[first]))} for i in group]
+        if report:
+            report.write(json.dumps({'cluster': n, 'size': len(group), 'members': members}) + '\n')
+        else:
+            tqdm.write(f'{n}\t{len(group)}\t' + ' '.join(str(paths[i]) for i in group))
+
+        if hardlink:
+            src = root / paths[first]
+            src_digest = digest(src)
+            src_inode = src.stat().st_ino
+            for i in rest:
+                dst = root / paths[i]
+                if dst.stat().st_ino == src_inode or digest(dst) != src_digest:
+                    continue
+                size = dst.stat().st_size
+                not dry_run and link_file(src, dst)
+                linked += 1
+                saved += size
+        elif drop:
+            for i in rest:
+                # the clusters are transitive (single linkage) - the members far from the first one are kept
+                if hamming(hashes[i], hashes[first]) > distance:
+                    continue
+                dst = root / paths[i]
+                if not dst.exists():
+                    continue
+                saved += dst.stat().st_size
+                not dry_run and dst.unlink()
+                dropped += 1
+
+    if report:
+        report.close()
+    click.echo(f'{len(groups)} clusters of {sum(len(g) for g in groups)} files (of {len(paths)})')
+    if hardlink or drop:
+        action = ' (dry run)' if dry_run else ''
+        click.echo(f'{linked} linked, {dropped} dropped{action} - {(saved / 1024 / 1024):.2f}MB')
+
+
+if __name__ == '__main__':
+    cli()
@@ -1,48 +1,150 @@
+# scans the archived images & exports ({dir}/{key}/images|exports) for malformed files - not an image, too small (e.g. 1x1) or truncated (no IEND / EOI, or no </svg> / %%EOF).
+# the bad files are moved to the quarantine directory, and listed in a jsonl report - pass it to `images.py --from-report` to re-fetch only those keys (except the too small ones - a re-fetch gives the same image).
+
 import os
+import sys
+import json
+import shutil
+from datetime import datetime
+from multiprocessing import Pool, cpu_count
 from pathlib import Path
 from tqdm import tqdm
-from PIL import Image, UnidentifiedImageError
 import click
 
+# for importing the shared figma_core package
+sys.path.insert(0, os.path.dirname(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__)))))
+
+from figma_core import imagesize
+
+SECTIONS = ['images', 'exports']
+
+# Define the file extensions to match - the same as the archiver downloads
+extensions = imagesize.GRAPHIC_FORMATS
+
+
+def deep_check(file):
+    """
+    fully decodes the image - catches the corrupted data (not only the truncated files)
+    """
+    from PIL import Image
+    try:
+        with Image.open(file) as img:
+            img.load()
+        return True
+    except Exception:
+        return False
+
+
+def check(file, min, deep):
+    """
+    the reason the file is malformed (with its dimensions), None if it is fine
+    """
+    ext = os.path.splitext(file)[1][1:].lower()
+    if ext in imagesize.VECTOR_FORMATS:
+        # no dimensions (nor a decode) - the signature and the trailer only
+        if not imagesize.is_valid_vector(file, ext):
+            return f'invalid {ext}', None
+        return None, None
+    info = imagesize.probe(file)
+    if info is None:
+        return 'not an image', None
+    size = (info.width, info.height)
+    if info.width <= min or info.height <= min:
+        return 'too small', size
+    if not imagesize.is_complete(file, info):
+        return 'truncated', size
+    if deep and not deep_check(file):
+        return 'corrupted', size
+    return None, size
+
+
+def scan_dir(args):
+    """
+    scans a single {key}/{section} directory - moves the bad files to {quarantine}/{key}/{section}/ (unless dry run) and returns the report records
+    """
+    directory, quarantine, min, deep, dry_run = args
+    key, section = directory.parent.name, directory.name
+    records = []
+    checked = 0
+    for entry in os.scandir(directory):
+        if not entry.is_file() or os.path.splitext(entry.name)[1].lower() not in extensions:
+            continue
+        checked += 1
+        file = Path(entry.path)
+        try:
+            reason, size = check(file, min, deep)
+        except Exception as e:
+            reason, size = f'error: {e}', None
+        if reason is None:
+            continue
+
+        moved = None
+        if not dry_run:
+            moved = Path(quarantine) / key / section / entry.name
+            moved.parent.mkdir(parents=True, exist_ok=True)
+            shutil.move(str(file), str(moved))
+        records.append({
+            'key': key,
+            'section': section,
+            'name': entry.name,
+            'path': str(file),
+            'reason': reason,
+            'size': size,
+            'quarantine': str(moved) if moved else None,
+        })
+    return checked, records
+
+
+def section_dirs(search_dir, sections):
+    """
+    the {key}/{section} directories under the search dir (or the sections of the search dir itself, if it is a single archive)
+    """
+    for section in sections:
+        if (search_dir / section).is_dir():
+            yield search_dir / section
+    for entry in os.scandir(search_dir):
+        if not entry.is_dir() or entry.name.startswith('.'):
+            continue
+        for section in sections:
+            directory = Path(entry.path) / section
+            if directory.is_dir():
+                yield directory
+
 
 @click.command()
 @click.argument('search_dir', type=click.Path(exists=True))
 @click.option('--min', default=1, help='Minimum image size')
-@click.option('--dry-run', is_flag=True, help='Dry run')
-def main(search_dir, min, dry_run):
+@click.option('--dry-run', is_flag=True, help='Dry run (report only, nothing is moved)')
+@click.option('--deep', is_flag=True, default=False, help='Fully decode the images as well (slow) - by default, only the header and the trailer are checked')
+@click.option('--sections', default=','.join(SECTIONS), help='The directories of each archive to scan (comma separated)')
+@click.option('--quarantine', default=None, type=click.Path(file_okay=False), help='The directory to move the malformed files to (defaults to {search_dir}/.quarantine)')
+@click.option('--report', default=None, type=click.Path(dir_okay=False), help='The jsonl report to write (defaults to ./malforms-{time}.jsonl)')
+@click.option('-c', '--concurrency', type=click.INT, default=cpu_count(), help='Number of processes to utilize')
+def main(search_dir, min, dry_run, deep, sections, quarantine, report, concurrency):
     search_dir = Path(search_dir)
-    # Define the directory pattern to match
-    dir_pattern = '**/images'
-
-    # Define the file extensions to match
-    extensions = ['.png', '.jpg']
-
-    # Iterate over all directories that match the pattern
-    for dir in tqdm(search_dir.glob(dir_pattern)):
-        if dir.is_dir():
-            # Iterate over all files in the directory with the specified extensions
-            files = os.listdir(dir)
-            files = [os.path.join(dir, f)
-                     for f in files if os.path.splitext(f)[1] in extensions]
-
-            for file in files:
-                file = Path(file)
-                try:
-                    # Open the image and get its size
-                    with Image.open(file) as img:
-                        width, height = img.size
-
-                    # If the image size is 1x1, delete the file
-                    if width <= min or height <= min:
-                        not dry_run and file.unlink()
-                        tqdm.write(
-                            f'Deleted {file} - reason: {width}x{height} image')
-                except (UnidentifiedImageError, OSError):
-                    # If the file is not an image, delete it
-                    not dry_run and file.unlink()
-                    tqdm.write(f'Deleted {file} - reason: not an image')
-                except Exception as e:
-                    tqdm.write(f'Error processing file {file}: {e}')
+    sections = [section.strip() for section in sections.split(',')]
+    quarantine = Path(quarantine or search_dir / '.quarantine')
+    report = report or f"malforms-{datetime.now().replace(microsecond=0).isoformat()}.jsonl"
+
+    directories = list(section_dirs(search_dir, sections))
+    tasks = [(directory, quarantine, min, deep, dry_run)
+             for directory in directories]
+
+    checked = 0
+    malformed = 0
+    with open(report, 'w') as f, Pool(concurrency) as pool:
+        for n, records in tqdm(pool.imap_unordered(scan_dir, tasks), total=len(tasks)):
+            checked += n
+            for record in records:
+                malformed += 1
+                f.write(json.dumps(record) + '\n')
+                action = 'Found' if dry_run else 'Quarantined'
+                size = record['size']
+                reason = f"{size[0]}x{size[1]} image" if record['reason'] == 'too small' else record['reason']
+                tqdm.write(f"{action} {record['path']} - reason: {reason}")
+
+    click.echo(f'{malformed} malformed of {checked} files - report: {report}')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,159 @@
+import time
+import logging
+import threading
+from typing import Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+API_BASE_URL = "https://api.figma.com/v1"
+
+logger = logging.getLogger(__name__)
+
+
+class FigmaAPIError(Exception):
+    """The api responded with an error (e.g. `err` in the body)"""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+def create_session(concurrency: int = 16, retries: int = 3) -> requests.Session:
+    """Create a session with a connection pool sized for the concurrency, retrying on the transient errors.
+
+    Args:
+        concurrency: The number of concurrent requests (the pool size)
+        retries: The number of retries for the failed requests (connection errors and 5xx)
+
+    Returns:
+        The session, to be shared across the requests
+    """
+    session = requests.Session()
+    retry = Retry(
+        total=retries,
+        backoff_factor=0.5,
+        # 429 is handled by the client (with the retry-after header), not here
+        status_forcelist=[500, 502, 503, 504],
+        allowed_methods=['GET'],
+    )
+    adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency, max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class RateLimiter:
+    """The request budget shared by the threads (clients) using the same token.
+
+    Spaces the requests to at most `rate` per second (no spacing if None), and pauses all of them when one is rate limited (429).
+    """
+
+    def __init__(self, rate: Optional[float] = None):
+        self.interval = 1 / rate if rate else 0
+        self.lock = threading.Lock()
+        self.next_at = 0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            at = max(now, self.next_at)
+            self.next_at = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+    def pause(self, seconds: float):
+        with self.lock:
+            self.next_at = max(self.next_at, time.monotonic() + seconds)
+
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def rate_limiter(token: str, rate: Optional[float] = None) -> RateLimiter:
+    """The rate limiter of the token - the api rate limits are per token, so is the budget."""
+    with _limiters_lock:
+        if token not in _limiters:
+            _limiters[token] = RateLimiter(rate)
+        elif rate:
+            _limiters[token].interval = 1 / rate
+        return _limiters[token]
+
+
+class FigmaClient:
+    """Minimal client for the Figma REST API - one per token, safe to share across threads.
+
+    Args:
+        token: Figma access token
+        session: The session to request with (defaults to a new pooled session)
+        concurrency: The pool size of the default session
+        max_retries: The number of retries on 429 (rate limited)
+        retry_delay: The delay (seconds) before retrying a 429 without the retry-after header, multiplied by the attempt
+        rate_limit: The max requests per second of the token (shared by all the clients of the token), None for no limit
+    """
+
+    def __init__(self, token: str, session: Optional[requests.Session] = None, concurrency: int = 16, max_retries: int = 5, retry_delay: float = 5, rate_limit: Optional[float] = None):
+        self.token = token
+        self.session = session or create_session(concurrency=concurrency)
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.limiter = rate_limiter(token, rate_limit)
+
+    def get(self, path: str, params: Optional[Dict] = None, timeout: float = 60) -> Dict:
+        """GET the api path (e.g. /files/:key), waiting and retrying when rate limited.
+
+        Raises:
+            FigmaAPIError: If the api responds with an error
+            requests.RequestException: If the request fails
+        """
+        url = f"{API_BASE_URL}{path}"
+        headers = {"X-Figma-Token": self.token}
+        retry = 0
+        while True:
+            self.limiter.wait()
+            response = self.session.get(url, headers=headers, params=params, timeout=timeout)
+            if response.status_code != 429:
+                break
+            if retry >= self.max_retries:
+                raise FigmaAPIError(f"Rate limit exceeded ({self.max_retries} tries)", status=429)
+            retry_after = response.headers.get("retry-after")
+            retry_after = float(retry_after) if retry_after else self.retry_delay * (retry + 1)
+            logger.warning(f"HTTP429 - Waiting {retry_after} seconds before retrying... ({retry + 1}/{self.max_retries})")
+            # the other requests of the token would be rate limited as well - pause them all
+            self.limiter.pause(retry_after)
+            retry += 1
+
+        try:
+            data = response.json()
+        except ValueError:
+            response.raise_for_status()
+            raise FigmaAPIError(f"Invalid response from {path}", status=response.status_code)
+
+        error = data.get("err") or (data.get("message") if data.get("error") else None)
+        if error or response.status_code >= 400:
+            raise FigmaAPIError(error or f"HTTP{response.status_code}", status=response.status_code)
+        return data
+
+    def file(self, key: str, **params) -> Dict:
+        """The file (document) - GET /files/:key, e.g. `client.file(key, geometry="paths")`"""
+        return self.get(f"/files/{key}", params=params or None)
+
+    def file_images(self, key: str) -> Dict[str, str]:
+        """The urls of the image fills of the file, by the image hash - GET /files/:key/images"""
+        return self.get(f"/files/{key}/images").get("meta", {}).get("images", {}) or {}
+
+    def images(self, key: str, ids: List[str], scale=1, format: str = "png", **params) -> Dict[str, Optional[str]]:
+        """The render urls of the nodes, by the node id - GET /images/:key (a single request, see `figma_core.renders` for many ids)"""
+        data = self.get(f"/images/{key}", params={
+            "ids": ",".join(ids),
+            "scale": scale,
+            "format": format,
+            **params,
+        })
+        return data.get("images", {}) or {}
+
+    def thumbnail_url(self, key: str) -> Optional[str]:
+        """The url of the file thumbnail (only the top level of the document is requested)"""
+        return self.file(key, depth=1).get("thumbnailUrl")
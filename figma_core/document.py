@@ -0,0 +1,156 @@
+import io
+import json
+from pathlib import Path
+import ijson
+
+try:
+    # python-isal (optional) is a drop-in replacement of gzip, 2~3x faster on decompression
+    from isal import igzip as gzip
+except ImportError:
+    import gzip
+
+try:
+    # zstandard (optional) is only required for reading / writing .json.zst files
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# the documents are read sequentially from start to end - large buffers cut the number of syscalls (and seeks on hdd)
+BUFFER_SIZE = 1024 * 1024  # 1mb
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# the suffixes of the archived documents, in order of preference
+SUFFIXES = [".json", ".json.gz", ".json.zst"]
+
+
+class DocumentReader(io.BufferedReader):
+    """
+    buffered reader over a (decompressed) document stream, which also closes the underlying file on close.
+    """
+
+    def __init__(self, stream, source, buffer_size=BUFFER_SIZE):
+        super().__init__(stream, buffer_size)
+        self._source = source
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self._source.close()
+
+
+def open_document(path, buffer_size=BUFFER_SIZE) -> io.BufferedIOBase:
+    """
+    opens the document as a binary stream, decompressing gzip / zstd transparently.
+
+    the compression is detected by the magic bytes, not the file extension, so a mis-named file (e.g. gzipped file.json) is still readable.
+    """
+    source = open(path, "rb", buffering=buffer_size)
+    try:
+        magic = source.peek(4)[:4]
+        if magic.startswith(GZIP_MAGIC):
+            stream = gzip.GzipFile(fileobj=source, mode="rb")
+        elif magic == ZSTD_MAGIC:
+            if zstandard is None:
+                raise ImportError(
+                    f"zstandard is required to read {path} (pip install zstandard)")
+            stream = zstandard.ZstdDecompressor().stream_reader(
+                source, read_size=buffer_size, closefd=False)
+        else:
+            return source
+        return DocumentReader(stream, source, buffer_size=buffer_size)
+    except BaseException:
+        source.close()
+        raise
+
+
+def create_document(path) -> io.TextIOBase:
+    """
+    opens the document for writing (text), compressed by its suffix - `.json.gz` (gzip), `.json.zst` (zstd) or plain `.json`
+    """
+    path = str(path)
+    if path.endswith(".gz"):
+        return gzip.open(path, "wt", encoding="utf-8")
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise ImportError(
+                f"zstandard is required to write {path} (pip install zstandard)")
+        return io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(open(path, "wb"), closefd=True), encoding="utf-8")
+    return open(path, "w", encoding="utf-8")
+
+
+def load_document(path) -> dict:
+    """
+    loads the whole document (plain, gzip or zstd) as dict
+    """
+    with open_document(path) as f:
+        return json.load(f)
+
+
+def iter_roots(path):
+    """
+    streams the top-level nodes of the document as (root, canvas_id) one at a time, without loading the whole document.
+
+    only one root is held in memory at a time, so the caller can release each subtree right after processing it.
+    """
+    canvas_prefix = "document.children.item"
+    root_prefix = "document.children.item.children.item"
+
+    with open_document(path) as f:
+        canvas_id = None
+        # roots seen before their canvas' id (the figma api writes the id first, this is just to be safe)
+        pending = []
+        builder = None
+        for prefix, event, value in ijson.parse(f, use_float=True):
+            if builder is not None:
+                if prefix == root_prefix and event == "end_map":
+                    root = builder.value
+                    builder = None
+                    if canvas_id is None:
+                        pending.append(root)
+                    else:
+                        yield root, canvas_id
+                else:
+                    builder.event(event, value)
+            elif prefix == root_prefix and event == "start_map":
+                builder = ijson.ObjectBuilder()
+                builder.event(event, value)
+            elif prefix == canvas_prefix + ".id" and event == "string":
+                canvas_id = value
+                while pending:
+                    yield pending.pop(0), canvas_id
+            elif prefix == canvas_prefix and event == "end_map":
+                # canvas without id - should not happen
+                for root in pending:
+                    yield root, canvas_id
+                pending = []
+                canvas_id = None
+
+
+def is_document(path) -> bool:
+    return any(str(path).endswith(suffix) for suffix in SUFFIXES)
+
+
+def document_key(path) -> str:
+    """
+    the key (name without the document suffix) of the document - e.g. `/a/b/:key.json.gz` -> `:key`
+    """
+    name = Path(path).name
+    for suffix in sorted(SUFFIXES, key=len, reverse=True):
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return Path(path).stem
+
+
+def find_document(directory, key):
+    """
+    returns the path of `{directory}/{key}.json` (or .json.gz, .json.zst), whichever exists first. None if not found.
+    """
+    for suffix in SUFFIXES:
+        path = Path(directory) / f"{key}{suffix}"
+        if path.is_file():
+            return path
+    return None
@@ -0,0 +1,132 @@
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import requests
+
+CHUNK_SIZE = 64 * 1024
+
+# the number of bytes needed to detect the format (the webp signature is the longest)
+SNIFF_SIZE = 12
+
+
+def sniff(head: bytes) -> Optional[str]:
+    """Detect the image format from the first bytes of the file.
+
+    Args:
+        head: The first bytes (at least SNIFF_SIZE) of the file
+
+    Returns:
+        The format (as the extension, e.g. 'png') or None if unknown
+    """
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    if head[:2] in (b'MM', b'II'):
+        return 'tiff'
+    if head.startswith(b'BM'):
+        return 'bmp'
+    # the vector exports
+    if head.startswith(b'%PDF'):
+        return 'pdf'
+    if head.lstrip().startswith((b'<svg', b'<?xml')):
+        return 'svg'
+    return None
+
+
+def download_image(session: requests.Session, url: str, output_dir: Path, image_id: str, no_extension: bool = False) -> Path:
+    """Download the image, streaming it to a temporary file which is renamed once complete.
+
+    The format is sniffed from the first bytes, so an interrupted download never leaves a partial file under the final name.
+
+    Args:
+        session: The session to download with
+        url: The image url
+        output_dir: The directory to save the image to
+        image_id: The image id (hash), used as the file name
+        no_extension: Save the file without extension
+
+    Returns:
+        The path of the saved image
+
+    Raises:
+        requests.RequestException: If the download fails
+        IOError: If the file cannot be saved
+    """
+    with session.get(url, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        fd, tmp = tempfile.mkstemp(dir=output_dir, prefix=f'.{image_id}.', suffix='.tmp')
+        try:
+            head = b''
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    if len(head) < SNIFF_SIZE:
+                        head += chunk[:SNIFF_SIZE - len(head)]
+                    f.write(chunk)
+
+            image_type = sniff(head)
+            file_ext = '' if no_extension else (f'.{image_type}' if image_type else '.bin')
+            output_path = output_dir / f"{image_id}{file_ext}"
+            os.replace(tmp, output_path)
+            return output_path
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+
+def existing_images(output_dir: Path) -> set:
+    """List the ids of the images already saved in the directory (the file names without extension).
+
+    Args:
+        output_dir: The directory the images are saved to
+
+    Returns:
+        The image ids
+    """
+    if not output_dir.is_dir():
+        return set()
+    return {
+        name.split('.', 1)[0] for name in os.listdir(output_dir)
+        # the temporary (partial) downloads and the state files
+        if not name.startswith('.')
+    }
+
+
+def download_images(images: Dict[str, str], output_dir: Path, session: requests.Session, concurrency: int = 16, no_extension: bool = False, pbar=None) -> Tuple[Dict[str, Path], Dict[str, Exception]]:
+    """Download the images concurrently.
+
+    Args:
+        images: The image urls by the image id
+        output_dir: The directory to save the images to
+        session: The (shared) session to download with
+        concurrency: The number of concurrent downloads
+        no_extension: Save the files without extension
+        pbar: The progress bar to update (optional)
+
+    Returns:
+        The saved paths and the errors, by the image id
+    """
+    saved = {}
+    errors = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            executor.submit(download_image, session, url, output_dir, image_id, no_extension): image_id
+            for image_id, url in images.items() if url
+        }
+        for future in as_completed(futures):
+            image_id = futures[future]
+            try:
+                saved[image_id] = future.result()
+            except (requests.RequestException, IOError) as e:
+                errors[image_id] = e
+            if pbar is not None:
+                pbar.update(1)
+    return saved, errors
@@ -0,0 +1,269 @@
+import os
+import struct
+from collections import namedtuple
+from functools import lru_cache
+from typing import Optional
+
+
+# the dimensions (and the format) of an image, read from its header - a full decode is only needed to transform it.
+ImageInfo = namedtuple("ImageInfo", ["format", "width", "height"])
+
+# the header bytes read at once - enough for png, gif and webp, and most of the jpegs (the rest are read by segments, as the avif boxes)
+HEAD_SIZE = 64
+
+# the (last) bytes every complete file ends with
+TRAILERS = {
+    "png": b"IEND\xaeB`\x82",
+    "jpeg": b"\xff\xd9",
+    "gif": b"\x3b",
+}
+
+# the vector exports (no dimensions in pixels) - (signature, trailer) of a complete file. the svg may start with an xml declaration or a BOM, and some writers pad after the pdf trailer.
+VECTOR_FORMATS = {
+    "svg": (b"<", b"</svg>"),
+    "pdf": (b"%PDF-", b"%%EOF"),
+}
+
+# the extensions of the image files (the fills and the exports) - the raster images (see `probe`) and the vector exports
+GRAPHIC_FORMATS = [
+    ".png",
+    ".jpg",
+    ".jpeg",
+    ".gif",
+    ".svg",
+    ".pdf",
+    ".webp",
+    ".avif",
+]
+
+# the jpeg start of frame markers (the dimensions) - SOF0~SOF15, except DHT (C4), JPG (C8) and DAC (CC)
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _jpeg_size(f, head: bytes) -> Optional[tuple]:
+    """
+    walks the jpeg segments (seeking over their payload) until the start of frame
+    """
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        # the markers may be padded with 0xFF
+        while byte == b"\xff":
+            byte = f.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker == 0xD8 or marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            # standalone markers (no length)
+            continue
+        if marker == 0xDA or marker == 0xD9:
+            # start of scan / end of image - no frame before the image data
+            return None
+        length = f.read(2)
+        if len(length) < 2:
+            return None
+        (length,) = struct.unpack(">H", length)
+        if marker in SOF_MARKERS:
+            data = f.read(5)
+            if len(data) < 5:
+                return None
+            _, height, width = struct.unpack(">BHH", data)
+            return width, height
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+# the avif brands of the isobmff ftyp box (the still image and the image sequence)
+AVIF_BRANDS = {b"avif", b"avis"}
+
+
+def _boxes(f, start: int, end: int):
+    """
+    the (type, payload start, box end) of the isobmff boxes in [start, end) - reads the box headers only.
+    the last box may extend past the end (a truncated file).
+    """
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, kind = struct.unpack(">I4s", header)
+        payload = offset + 8
+        if size == 1:
+            # 64 bit size
+            large = f.read(8)
+            if len(large) < 8:
+                return
+            (size,) = struct.unpack(">Q", large)
+            payload += 8
+        elif size == 0:
+            # extends to the end (of the file, or of the parent box)
+            size = end - offset
+        if size < payload - offset:
+            return
+        yield kind, payload, offset + size
+        offset += size
+
+
+def _avif_size(f) -> Optional[tuple]:
+    """
+    the largest image spatial extent (ispe) of the avif - meta > iprp > ipco > ispe. the primary image is the largest item (the others are the alpha plane, the grid tiles or the thumbnails).
+    """
+    file_size = os.fstat(f.fileno()).st_size
+    sizes = []
+    for kind, start, end in _boxes(f, 0, file_size):
+        if kind == b"ftyp":
+            f.seek(start)
+            data = f.read(min(end - start, 64))
+            # the major brand, the minor version, then the compatible brands
+            brands = {data[i:i + 4] for i in range(8, len(data) - 3, 4)} | {data[:4]}
+            if not brands & AVIF_BRANDS:
+                return None
+        elif kind == b"meta":
+            # a full box - the version and the flags first
+            for kind, start, end in _boxes(f, start + 4, end):
+                if kind != b"iprp":
+                    continue
+                for kind, start, end in _boxes(f, start, end):
+                    if kind != b"ipco":
+                        continue
+                    for kind, start, end in _boxes(f, start, end):
+                        if kind == b"ispe":
+                            f.seek(start + 4)
+                            data = f.read(8)
+                            if len(data) == 8:
+                                sizes.append(struct.unpack(">II", data))
+            break
+    if not sizes:
+        return None
+    return max(sizes, key=lambda size: size[0] * size[1])
+
+
+def _probe(f) -> Optional[ImageInfo]:
+    head = f.read(HEAD_SIZE)
+
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        if len(head) < 24 or head[12:16] != b"IHDR":
+            return None
+        width, height = struct.unpack(">II", head[16:24])
+        return ImageInfo("png", width, height)
+
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        if len(head) < 10:
+            return None
+        width, height = struct.unpack("<HH", head[6:10])
+        return ImageInfo("gif", width, height)
+
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        chunk = head[12:16]
+        if chunk == b"VP8 " and len(head) >= 30 and head[23:26] == b"\x9d\x01\x2a":
+            width, height = struct.unpack("<HH", head[26:30])
+            return ImageInfo("webp", width & 0x3FFF, height & 0x3FFF)
+        if chunk == b"VP8L" and len(head) >= 25 and head[20] == 0x2F:
+            bits = int.from_bytes(head[21:25], "little")
+            return ImageInfo("webp", (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1)
+        if chunk == b"VP8X" and len(head) >= 30:
+            width = int.from_bytes(head[24:27], "little") + 1
+            height = int.from_bytes(head[27:30], "little") + 1
+            return ImageInfo("webp", width, height)
+        return None
+
+    if head.startswith(b"\xff\xd8"):
+        size = _jpeg_size(f, head)
+        if size is None:
+            return None
+        return ImageInfo("jpeg", *size)
+
+    if head[4:8] == b"ftyp":
+        size = _avif_size(f)
+        if size is None:
+            return None
+        return ImageInfo("avif", *size)
+
+    return None
+
+
+@lru_cache(maxsize=65536)
+def _probe_cached(path: str, mtime_ns: int, size: int) -> Optional[ImageInfo]:
+    try:
+        with open(path, "rb") as f:
+            return _probe(f)
+    except OSError:
+        return None
+
+
+def probe(path) -> Optional[ImageInfo]:
+    """
+    the format and the dimensions of the image (png, jpeg, gif, webp or avif), from its header only - None if not a (supported) image.
+    the results are cached by the path and the mtime (and size) of the file.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return _probe_cached(os.fspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+def dimensions(path) -> Optional[tuple]:
+    """
+    (width, height) of the image, None if not a (supported) image
+    """
+    info = probe(path)
+    return (info.width, info.height) if info else None
+
+
+def is_complete(path, info: Optional[ImageInfo] = None) -> bool:
+    """
+    rather if the image ends with the trailer of its format (png IEND, jpeg EOI, gif trailer) - a truncated download does not.
+    reads the last few bytes only. webp and avif have no trailer - the RIFF size (webp) / the box sizes (avif) are checked against the file size instead.
+    """
+    info = info or probe(path)
+    if info is None:
+        return False
+    try:
+        with open(path, "rb") as f:
+            if info.format == "webp":
+                (riff_size,) = struct.unpack("<I", f.read(8)[4:8])
+                return os.fstat(f.fileno()).st_size >= riff_size + 8
+            if info.format == "avif":
+                file_size = os.fstat(f.fileno()).st_size
+                last = 0
+                for _, _, last in _boxes(f, 0, file_size):
+                    pass
+                return 0 < last <= file_size
+            trailer = TRAILERS[info.format]
+            f.seek(0, os.SEEK_END)
+            end = f.tell()
+            # some encoders pad the jpegs after EOI - look a little further back
+            tail_size = 32 if info.format == "jpeg" else len(trailer)
+            f.seek(max(0, end - tail_size))
+            tail = f.read()
+            if info.format == "jpeg":
+                return trailer in tail
+            return tail.endswith(trailer)
+    except (OSError, struct.error):
+        return False
+
+
+def is_valid(path) -> bool:
+    """
+    rather if the image has a valid header (with non-zero dimensions) and is complete (see `is_complete`) - without decoding it.
+    """
+    info = probe(path)
+    return info is not None and info.width > 0 and info.height > 0 and is_complete(path, info)
+
+
+def is_valid_vector(path, format: str) -> bool:
+    """
+    rather if the vector export (svg or pdf) starts with its signature and ends with its trailer - reads the first and the last few bytes only.
+    """
+    signature, trailer = VECTOR_FORMATS[format]
+    try:
+        with open(path, "rb") as f:
+            head = f.read(HEAD_SIZE).lstrip(b"\xef\xbb\xbf \t\r\n")
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - 1024))
+            tail = f.read()
+    except OSError:
+        return False
+    return head.startswith(signature) and trailer in tail
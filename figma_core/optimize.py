@@ -0,0 +1,655 @@
+import os
+import json
+import math
+import shutil
+import logging
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageFile, UnidentifiedImageError
+from PIL.PngImagePlugin import PngInfo
+
+from . import imagesize
+
+# the optimizer (PIL & numpy) is only imported by the tools that optimize - import it lazily from the command line tools.
+
+ImageFile.LOAD_TRUNCATED_IMAGES = True
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+
+def optimize_image(path, out=None, max_size=1*MB, max_width=None, max_height=None):
+    """
+    Note: This only supports PNGs at the moment
+
+    max_size: maximum size in bytes - pass None to skip this check
+    max_width: maximum width in pixels - pass None to skip this check
+    max_height: maximum height in pixels - pass None to skip this check
+
+    If max_width or max_height is specified, the image will be resized again if necessary
+
+    returns:
+    - 0. True / False: whether the image was optimized
+    - 1. The space saved in bytes
+    - 2. The "A" width and height of the image
+    - 3. The "new" width and height of the image
+    - 4. The scale factor used to resize the image
+    """
+    # validate inputs
+    if max_width == 0:
+        max_width = None
+    if max_height == 0:
+        max_height = None
+    # either max_size or max_width or max_height must be specified
+    if max_size is None and max_width is None and max_height is None:
+        raise ValueError(
+            "Either max_size or max_width or max_height must be specified")
+
+    if out is None:
+        out = path
+
+    optimization_data = read_image_optimization_metadata(path)
+    ext = os.path.splitext(path)[1].lower()
+
+    if ext == '.png':
+        target_ext = 'png'
+    elif ext == '.jpg' or ext == '.jpeg':
+        target_ext = 'jpg'
+    else:
+        # not supported
+        return False, 0, 0, 0, 0
+
+    margin = 0.3
+    try:
+        if optimization_data is not None:
+            a_size = optimization_data['size']['a']
+            a_w, a_h = optimization_data['dimensions']['a']
+        else:
+            a_size = os.path.getsize(path)
+            # current dimensions (the header only)
+            dimensions = imagesize.dimensions(path)
+            if dimensions is None:
+                raise ValueError("not a valid image")
+            a_w, a_h = dimensions
+
+        new_size = (a_w, a_h)
+
+        targetsize = max_size - \
+            (margin * MB) if max_size is not None else float('inf')
+
+        scale_factor_a = math.sqrt(
+            targetsize / a_size) if max_size is not None and a_size > max_size else 1
+
+        # If either max_width or max_height is specified, resize the image while preserving aspect ratio
+        w_scale = max_width / a_w if max_width else float('inf')
+        h_scale = max_height / a_h if max_height else float('inf')
+        scale_factor_b = min(w_scale, h_scale)
+
+        scale_factor = min(scale_factor_a, scale_factor_b)
+
+        if optimization_data is not None and scale_factor >= 1:
+            # already optimized, and no (further) resize needed - nothing to decode
+            return False, 0, (a_w, a_h), (a_w, a_h), 1
+
+        # Open the image (decoded only from here)
+        img = Image.open(path)
+
+        if scale_factor < 1:  # Only resize if new size is smaller
+            new_size = (int(a_w * scale_factor), int(a_h * scale_factor))
+            if new_size[0] == 0 or new_size[1] == 0:
+                return False, 0, 0, 0, 0
+            img = img.resize(new_size)
+
+        # Save the image to a temporary file
+        with tempfile.NamedTemporaryFile(mode='wb', suffix=f'.{target_ext}', delete=False) as tmp:
+            metadata = a_w, a_h, a_size
+            if target_ext == 'png':
+                img.save(tmp.name,
+                         format='PNG',
+                         optimize=True,
+                         pnginfo=png_optimization_metadata(*metadata))
+            elif target_ext == 'jpg':
+                exif = img.getexif()
+                # 0x9286 is the exif tag for user comment
+                exif[0x9286] = jpg_optimization_metadata(*metadata)
+                img.save(tmp.name,
+                         format='JPEG',
+                         optimize=True,
+                         exif=exif)
+            else:
+                raise ValueError(f"Unsupported image format: {target_ext}")
+
+            # double check if it actually got smaller
+            if os.path.getsize(tmp.name) >= a_size:
+                os.remove(tmp.name)
+                return False, 0, (a_w, a_h), (a_w, a_h), 1
+            # Remove the original file before moving the temporary file to the original filename
+            os.remove(path)
+            shutil.move(tmp.name, out)
+        endsize = os.path.getsize(out)
+        saved = a_size - endsize
+
+        return True, saved, (a_w, a_h), new_size, scale_factor
+    except Exception as e:
+        logger.error(f"☒ Error optimizing {path}: {e}")
+        return False, 0, None, None, None
+
+
+def read_image_optimization_metadata(path):
+    path = Path(path)
+    ext = path.suffix.lower()
+    if ext == '.png':
+        return read_png_optimization_metadata(path)
+    elif ext in ('.jpg', '.jpeg', '.webp', '.avif'):
+        # the transcoded images keep the metadata in the exif user comment, as the jpgs
+        return read_jpg_optimization_metadata(path)
+    else:
+        return None
+        # raise ValueError(f"Unsupported file extension: {ext}")
+
+
+def png_optimization_metadata(aW, aH, aS):
+    metadata = PngInfo()
+    # save compressed text info
+    # AD stands for "A dimensions - original dimensions"
+    metadata.add_text('AD', f'{aW}x{aH}')
+    # AS stands for "A size - original size in bytes"
+    metadata.add_text('AS', f'{aS}')
+    return metadata
+
+
+def read_png_optimization_metadata(path):
+    try:
+        img = Image.open(path)
+    except (UnidentifiedImageError, OSError) as e:
+        logger.error(f"☒ Error reading {path}: {e}")
+        return None
+    metadata = img.info
+    aD = metadata.get('AD', None)
+    aW = int(aD.split('x')[0]) if aD else None
+    aH = int(aD.split('x')[1]) if aD else None
+    aS = metadata.get('AS', None)
+    aS = float(aS) if aS else None
+    img.close()
+
+    if aD is None:
+        return None
+
+    return {
+        'dimensions': {
+            'a': (aW, aH),
+            'b': img.size,
+        },
+        'size': {
+            'a': aS,
+            'b': os.path.getsize(path),
+        },
+    }
+
+
+def read_jpg_optimization_metadata(path):
+    try:
+        img = Image.open(path)
+    except (UnidentifiedImageError, OSError) as e:
+        logger.error(f"☒ Error reading {path}: {e}")
+        return None
+    exif = img.getexif()
+    # 0x9286 is the exif tag for user comment
+    data = exif.get(0x9286, None)
+    img.close()
+    try:
+        data = json.loads(data)
+        return {
+            'dimensions': {
+                'a': (data['AW'], data['AH']),
+                'b': img.size,
+            },
+            'size': {
+                'a': data['AS'],
+                'b': os.path.getsize(path),
+            },
+        }
+    except:
+        return None
+
+
+def jpg_optimization_metadata(aW, aH, aS):
+    return json.dumps({
+        'AW': aW,
+        'AH': aH,
+        'AS': aS,
+    }, separators=(',', ':'))
+
+
+# the modern formats the images can be transcoded to
+TRANSCODE_FORMATS = ["webp", "avif"]
+
+
+def avif_supported():
+    """
+    rather if the local PIL can encode AVIF (Pillow >= 11.2 built with libavif, or the pillow-avif-plugin)
+    """
+    try:
+        import pillow_avif  # noqa: F401 - registers the plugin on older Pillow
+    except ImportError:
+        pass
+    Image.init()
+    return "AVIF" in Image.SAVE
+
+
+def transcode_image(path, format="webp", quality=None, replace=False):
+    """
+    Transcodes the (png / jpg) image to webp or avif - {stem}.{format}, next to the original (or instead of it, with replace)
+
+    quality: None for lossless (webp) / near-lossless (avif, 4:4:4 at quality 100), or the lossy quality (0~100)
+    replace: removes the original once transcoded
+
+    The original dimensions & size are kept in the exif user comment (AD / AS, as the optimized jpgs) - carried over from the original if it was optimized already.
+    The transcoded image is only kept if it is smaller than the original.
+
+    returns:
+    - 0. True / False: whether the image was transcoded
+    - 1. The space saved in bytes
+    - 2. The transcoded image path (None if not transcoded)
+    """
+    path = Path(path)
+    format = format.lower()
+    if format not in TRANSCODE_FORMATS:
+        raise ValueError(f"Unsupported transcode format: {format}")
+    out = path.with_suffix(f".{format}")
+    if out.exists():
+        return False, 0, out
+
+    tmp = None
+    try:
+        size = os.path.getsize(path)
+        optimization_data = read_image_optimization_metadata(path)
+        if optimization_data is not None:
+            a_w, a_h = optimization_data['dimensions']['a']
+            a_size = optimization_data['size']['a']
+        else:
+            a_size = size
+            dimensions = imagesize.dimensions(path)
+            if dimensions is None:
+                raise ValueError("not a valid image")
+            a_w, a_h = dimensions
+
+        with Image.open(path) as img:
+            if img.mode not in ('RGB', 'RGBA'):
+                alpha = 'A' in img.getbands() or 'transparency' in img.info
+                img = img.convert('RGBA' if alpha else 'RGB')
+            exif = Image.Exif()
+            # 0x9286 is the exif tag for user comment
+            exif[0x9286] = jpg_optimization_metadata(a_w, a_h, a_size)
+
+            if format == 'webp':
+                options = dict(lossless=True, exact=True) if quality is None else dict(quality=quality)
+            else:
+                options = dict(quality=100 if quality is None else quality, subsampling='4:4:4' if quality is None else '4:2:0')
+
+            # a hidden, non-graphic temporary file (as the downloads) - not picked up as an image while it is written
+            fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.stem}.', suffix='.part')
+            with os.fdopen(fd, 'wb') as f:
+                img.save(f, format=format.upper(), exif=exif, **options)
+
+        # keep it only if it actually got smaller
+        if os.path.getsize(tmp) >= size:
+            os.remove(tmp)
+            return False, 0, None
+        os.replace(tmp, out)
+        saved = size - os.path.getsize(out)
+        if replace:
+            os.remove(path)
+        return True, saved, out
+    except Exception as e:
+        logger.error(f"☒ Error transcoding {path}: {e}")
+        if tmp is not None and os.path.exists(tmp):
+            os.remove(tmp)
+        return False, 0, None
+
+
+# the preview pyramid - {section}/previews/{size}/{stem}.webp, fit in {size}x{size}
+PREVIEWS_DIR = "previews"
+PREVIEW_FORMAT = "webp"
+
+
+def preview_path(path, size, format=PREVIEW_FORMAT):
+    """
+    the preview of the image at the size - {dir}/previews/{size}/{stem}.{format}
+    """
+    path = Path(path)
+    return path.parent / PREVIEWS_DIR / str(size) / f"{path.stem}.{format}"
+
+
+def write_previews(path, sizes, format=PREVIEW_FORMAT, quality=80):
+    """
+    Writes the preview pyramid of the image - a preview per size (fit in size x size, aspect ratio preserved), from a single decode.
+    The sizes not smaller than the image are skipped (the original serves them), as are the previews newer than the image.
+
+    returns the sizes that have a preview
+    """
+    path = Path(path)
+    dimensions = imagesize.dimensions(path)
+    if dimensions is None:
+        return []
+    sizes = sorted((size for size in sizes if size < max(dimensions)), reverse=True)
+    mtime = os.path.getmtime(path)
+    todo = [size for size in sizes
+            if not preview_path(path, size, format).exists()
+            or os.path.getmtime(preview_path(path, size, format)) < mtime]
+    if not todo:
+        return sizes
+
+    try:
+        with Image.open(path) as img:
+            # jpegs can be decoded at a fraction of their size
+            img.draft('RGB', (todo[0], todo[0]))
+            if img.mode not in ('RGB', 'RGBA'):
+                alpha = 'A' in img.getbands() or 'transparency' in img.info
+                img = img.convert('RGBA' if alpha else 'RGB')
+            # largest first - each level is resized from the previous one
+            for size in sizes:
+                img.thumbnail((size, size), Image.LANCZOS)
+                if size not in todo:
+                    continue
+                out = preview_path(path, size, format)
+                out.parent.mkdir(parents=True, exist_ok=True)
+                with tempfile.NamedTemporaryFile(mode='wb', suffix=f'.{format}', dir=out.parent, delete=False) as tmp:
+                    img.save(tmp, format=format.upper(), quality=quality)
+                os.replace(tmp.name, out)
+        return sizes
+    except Exception as e:
+        logger.error(f"☒ Error writing previews of {path}: {e}")
+        return []
+
+
+def previews_metadata(directory, format=PREVIEW_FORMAT):
+    """
+    the previews of the images in the directory, for its meta.json - None if there are none
+
+    {
+      "format": "webp",
+      "path": "previews/{size}/{name}.webp",
+      "sizes": [64, 256, 1024],
+      "map": { name: [64, 256] } # the sizes available per image
+    }
+    """
+    root = Path(directory) / PREVIEWS_DIR
+    if not root.is_dir():
+        return None
+    sizes = sorted(int(entry.name) for entry in os.scandir(root) if entry.is_dir() and entry.name.isdigit())
+    previews = {}
+    for size in sizes:
+        for entry in os.scandir(root / str(size)):
+            name, ext = os.path.splitext(entry.name)
+            if ext == f".{format}":
+                previews.setdefault(name, []).append(size)
+    return {
+        "format": format,
+        "path": f"{PREVIEWS_DIR}/{{size}}/{{name}}.{format}",
+        "sizes": sizes,
+        "map": previews,
+    }
+
+
+def get_node_dimensions(node):
+    """
+    Extract the width and height from a node's transformation matrix.
+
+    Parameters:
+    node: A document tree node.
+
+    Returns:
+    Tuple of width and height. (scale is applied to the original size)
+
+    Note: this is not considered as "absolute" transform since it does not iterates through the parents' relativeTransform.
+    """
+
+    # Get the transformation matrix
+    transform = node['relativeTransform']
+    size = node['size']
+
+    if transform is None or size is None:
+        raise ValueError(
+            f"Node {node.get('id')} is missing either relativeTransform or size")
+
+    x = size['x']
+    y = size['y']
+
+    if x is None or y is None:
+        raise ValueError(
+            f"Node {node.get('id')} is missing either size.x or size.y")
+
+    # The scaling factors are at positions [0][0] and [1][1]
+    width_scale = transform[0][0]
+    height_scale = transform[1][1]
+
+    # The width and height are the scaling factors multiplied by the original size
+    width = (width_scale if width_scale else 1) * size['x']
+    height = (height_scale if height_scale else 1) * size['y']
+
+    return width, height
+
+
+# the scale modes, as the codes in the plan arrays
+SCALE_MODES = {"FILL": 0, "FIT": 1, "TILE": 2, "STRETCH": 3}
+
+
+class FillSizePlan:
+    """
+    The max (rendered) size of each image fill in a document, computed for all the usages at once.
+
+    The usages of the paint map are gathered once per file into flat arrays (grouped by the hash) - the node sizes, scale modes, scaling factors and the image transforms.
+    The target sizes of FILL / FIT / TILE / STRETCH are then computed in a single vectorized pass, given the image dimensions.
+
+    ```
+    plan = FillSizePlan(image_paint_map(document))
+    plan.max_sizes({hash: (width, height), ...})  # {hash: (max width, max height)}
+    plan.max_size(hash, (width, height))  # a single image
+    ```
+    """
+
+    def __init__(self, paint_map: dict):
+        rows = []
+        for i, (hash_image, info) in enumerate(paint_map.items()):
+            for usage in info["usage"]:
+                row = self.usage_row(usage, info["nodes"][usage["id"]])
+                if row is not None:
+                    rows.append((i, *row))
+
+        self.hashes = list(paint_map.keys())
+        self.index = {hash_image: i for i, hash_image in enumerate(self.hashes)}
+
+        data = np.array(rows, dtype=np.float64).reshape(-1, 9)
+        # grouped by the hash - the usages of a hash are the slice [starts[i]:starts[i + 1]]
+        data = data[np.argsort(data[:, 0], kind="stable")]
+        self.owner = data[:, 0].astype(np.int64)
+        self.mode = data[:, 1].astype(np.int64)
+        self.node_w, self.node_h = data[:, 2], data[:, 3]
+        self.scaling = data[:, 4]
+        self.t00, self.t01, self.t10, self.t11 = data[:, 5], data[:, 6], data[:, 7], data[:, 8]
+        self.starts = np.searchsorted(self.owner, np.arange(len(self.hashes) + 1))
+
+    @staticmethod
+    def usage_row(usage, node):
+        """
+        the values of a usage - (mode, node width, node height, scaling factor, image transform a, b, c, d), None if it can't be sized.
+        """
+        paint = usage["paint"]
+        try:
+            node_w, node_h = get_node_dimensions(node)
+        except ValueError as e:
+            logger.error(f'Invalid node value - {e}')
+            return None
+
+        scale_mode = paint.get("scaleMode")
+        if scale_mode not in SCALE_MODES:
+            logger.error(f"Unsupported scale mode: {scale_mode}")
+            return None
+
+        scaling = 0
+        transform = (0, 0, 0, 0)
+        if scale_mode == "TILE":
+            scaling = paint.get("scalingFactor")
+            if scaling is None:
+                logger.error('unable to get desired size - missing scalingFactor')
+                return None
+        elif scale_mode == "STRETCH":
+            # the rotation of the paint cancels out (the image transform is rotated, then un-rotated) - only the 2x2 part of the image transform applies.
+            try:
+                (a, b, _), (c, d, _) = paint["imageTransform"]
+                transform = (float(a), float(b), float(c), float(d))
+            except (TypeError, ValueError, KeyError) as e:
+                logger.error(f'unable to get desired size - {e}')
+                return None
+
+        return (SCALE_MODES[scale_mode], node_w, node_h, scaling, *transform)
+
+    def targets(self, sl: slice, iw: np.ndarray, ih: np.ndarray):
+        """
+        the target sizes of the usages in the slice, for the image dimensions (per usage) - clamped to the image size.
+        """
+        mode = self.mode[sl]
+        node_w, node_h = self.node_w[sl], self.node_h[sl]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            width_ratio = node_w / iw
+            height_ratio = node_h / ih
+        fill = np.maximum(width_ratio, height_ratio)
+        fit = np.minimum(width_ratio, height_ratio)
+        scaling = self.scaling[sl]
+
+        width = np.select(
+            [mode == 0, mode == 1, mode == 2],
+            [iw * fill, iw * fit, iw * scaling],
+            np.ceil(np.abs(self.t00[sl] * iw + self.t01[sl] * ih)),
+        )
+        height = np.select(
+            [mode == 0, mode == 1, mode == 2],
+            [ih * fill, ih * fit, ih * scaling],
+            np.ceil(np.abs(self.t10[sl] * iw + self.t11[sl] * ih)),
+        )
+
+        # we cannot have an image bigger than the original
+        return np.minimum(iw, width), np.minimum(ih, height)
+
+    def max_sizes(self, sizes: dict) -> dict:
+        """
+        the max size of each image - {hash: (max width, max height)}, for the images of `sizes` ({hash: (width, height)}).
+        (0, 0) for the images with no (sizable) usage.
+        """
+        known = np.zeros(len(self.hashes), dtype=bool)
+        dims = np.zeros((len(self.hashes), 2), dtype=np.float64)
+        for hash_image, size in sizes.items():
+            i = self.index.get(hash_image)
+            if i is not None and size is not None:
+                known[i] = True
+                dims[i] = size
+
+        usages = known[self.owner]
+        owner = self.owner[usages]
+        iw, ih = dims[owner, 0], dims[owner, 1]
+        width, height = self.targets(usages, iw, ih)
+
+        max_width = np.zeros(len(self.hashes))
+        max_height = np.zeros(len(self.hashes))
+        np.maximum.at(max_width, owner, np.nan_to_num(width))
+        np.maximum.at(max_height, owner, np.nan_to_num(height))
+
+        return {
+            self.hashes[i]: (float(max_width[i]), float(max_height[i]))
+            for i in np.flatnonzero(known)
+        }
+
+    def max_size(self, hash_image, size) -> tuple:
+        """
+        the max size of a single image - (max width, max height)
+        """
+        i = self.index[hash_image]
+        sl = slice(self.starts[i], self.starts[i + 1])
+        n = sl.stop - sl.start
+        if n == 0:
+            return 0.0, 0.0
+        iw = np.full(n, float(size[0]))
+        ih = np.full(n, float(size[1]))
+        width, height = self.targets(sl, iw, ih)
+        return float(np.nan_to_num(width).max(initial=0)), float(np.nan_to_num(height).max(initial=0))
+
+
+def optimized_image_paint_map(paint_map, images: dict) -> dict[str, dict]:
+    """
+    Create a map that shows each hash image's usage in a document and the nodes that use it, along with the paint object.
+    Plus, it also returns a "max" property for each hash image, which is the maximum size of the image used in the document.
+    We can use max property to resize the image as so (if the original image is bigger than max), without losing quality.
+
+    Parameters:
+    node: A document tree node.
+    images: A dictionary mapping image hashes to local directory path (original file, without any optimizations).
+
+    (see FillSizePlan to plan the whole file once)
+    """
+    sizes = {}
+    for hash_image in paint_map:
+        original_image_path = images[hash_image]
+        # Read original image size (the header only)
+        size = imagesize.dimensions(original_image_path)
+        if size is None:
+            logger.error(f"Cannot read image {original_image_path}. Skipping...")
+            continue
+        sizes[hash_image] = size
+
+    for hash_image, (max_width, max_height) in FillSizePlan(paint_map).max_sizes(sizes).items():
+        paint_map[hash_image]["max"] = {
+            "width": max_width,
+            "height": max_height,
+        }
+
+    return paint_map
+
+
+def image_paint_map(node) -> dict:
+    """
+    Create a map that shows where each image hash is used in a document.
+
+    Parameters:
+    node: The current node in the document tree.
+
+    Returns:
+    A dictionary mapping each hash to a list of dictionaries, each containing the id, and the fill object of a node where the hash is used.
+    """
+    map = {}
+
+    # If the node has fills, check them for image references
+    if "fills" in node:
+        for fill in node["fills"]:
+            if "imageRef" in fill:
+                # This fill includes an image reference, so we record this node
+                if fill["imageRef"] not in map:
+                    map[fill["imageRef"]] = {"usage": [], "nodes": {}}
+
+                # Append usage and nodes if not already present
+                map[fill["imageRef"]]["usage"].append(
+                    {"id": node["id"], "paint": fill})
+                if node["id"] not in map[fill["imageRef"]]["nodes"]:
+                    map[fill["imageRef"]]["nodes"][node["id"]] = {
+                        "type": node["type"],
+                        "relativeTransform": node["relativeTransform"],
+                        "size": node["size"],
+                    }
+
+    # Recurse into the children of this node, if it has any
+    if "children" in node:
+        for child in node["children"]:
+            child_map = image_paint_map(child)
+            # Merge the child's map into our map
+            for hash, data in child_map.items():
+                if hash not in map:
+                    map[hash] = {"usage": [], "nodes": {}}
+
+                # Merge usage and nodes lists
+                map[hash]["usage"].extend(data["usage"])
+                map[hash]["nodes"].update(data["nodes"])
+
+    return map
@@ -0,0 +1,168 @@
+import os
+import json
+import tarfile
+from pathlib import Path
+
+
+# the directories of an archive (per file key) that are packed - {dir}/{key}/images, {dir}/{key}/exports
+SECTIONS = ["images", "exports"]
+
+PACK_SUFFIX = ".pack"
+INDEX_SUFFIX = ".pack.json"
+
+VERSION = 1
+
+
+def pack_paths(output, key):
+    """
+    the pack and its index paths for the key - ({output}/{key}.pack, {output}/{key}.pack.json)
+    """
+    return Path(output) / f"{key}{PACK_SUFFIX}", Path(output) / f"{key}{INDEX_SUFFIX}"
+
+
+def pack_members(archive):
+    """
+    the files to pack under the archive directory ({dir}/{key}), as sorted relative names - e.g. images/{hash}.png, exports/{id}.png
+    """
+    members = []
+    for section in SECTIONS:
+        directory = Path(archive) / section
+        if not directory.is_dir():
+            continue
+        for entry in os.scandir(directory):
+            if entry.is_file() and not entry.name.startswith("."):
+                members.append(f"{section}/{entry.name}")
+    return sorted(members)
+
+
+def write_pack(archive, output, key=None):
+    """
+    packs the images and exports of the archive ({dir}/{key}) to a single, uncompressed tar - {output}/{key}.pack, with an index of the byte ranges of the members - {output}/{key}.pack.json
+
+    the pack is a plain tar (readable with any tar tool), the index allows reading a single member with a single ranged read (HTTP Range).
+    returns the index, None if there is nothing to pack.
+    """
+    key = key or Path(archive).name
+    members = pack_members(archive)
+    if not members:
+        return None
+
+    pack_path, index_path = pack_paths(output, key)
+    pack_path.parent.mkdir(parents=True, exist_ok=True)
+
+    entries = {}
+    tmp = pack_path.with_name(pack_path.name + ".tmp")
+    # the pngs are already compressed, compressing the tar would only break the random access.
+    with tarfile.open(tmp, "w", format=tarfile.PAX_FORMAT) as tar:
+        for name in members:
+            tar.add(Path(archive) / name, arcname=name, recursive=False)
+            # (offset_data is only set when reading) - the data ends at the current offset, padded to the tar blocks
+            size = tar.members[-1].size
+            padded = -(-size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+            entries[name] = [tar.offset - padded, size]
+
+    index = {
+        "version": VERSION,
+        "key": key,
+        "size": os.path.getsize(tmp),
+        "entries": entries,
+    }
+
+    # the pack is replaced first, the (new) index last - the index never points to a pack that does not exist yet.
+    os.replace(tmp, pack_path)
+    tmp = index_path.with_name(index_path.name + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp, index_path)
+    return index
+
+
+def is_packed(archive, output, key=None):
+    """
+    rather if the pack of the archive exists and is newer than the packed directories
+    """
+    key = key or Path(archive).name
+    _, index_path = pack_paths(output, key)
+    if not index_path.exists():
+        return False
+    mtime = index_path.stat().st_mtime
+    for section in SECTIONS:
+        directory = Path(archive) / section
+        if directory.is_dir() and directory.stat().st_mtime > mtime:
+            return False
+    return True
+
+
+class Pack:
+    """
+    reads the members of a pack, from a local path or an url (e.g. the s3 / cdn url of the pack) - one (ranged) read per member.
+
+    ```
+    pack = Pack("https://example.com/packs/1035203688168086460.pack")
+    data = pack.read("exports/1:2.png")
+    data = pack.get("1:2")  # by the node id or the image hash
+    ```
+    """
+
+    def __init__(self, location, index=None, session=None):
+        self.location = str(location)
+        self.remote = self.location.startswith(("http://", "https://"))
+        self.session = session
+        if self.remote and self.session is None:
+            import requests
+            self.session = requests.Session()
+        self.index = index or self.load_index()
+        self.entries = self.index["entries"]
+        # the members by their stem - e.g. {"1:2": ["exports/1:2.png", "exports/1:2@2x.png"]}
+        self.stems = {}
+        for name in self.entries:
+            stem = name.split("/", 1)[-1].split(".", 1)[0].split("@", 1)[0]
+            self.stems.setdefault(stem, []).append(name)
+
+    def index_location(self):
+        if self.location.endswith(PACK_SUFFIX):
+            return self.location[: -len(PACK_SUFFIX)] + INDEX_SUFFIX
+        return self.location + ".json"
+
+    def load_index(self):
+        location = self.index_location()
+        if self.remote:
+            response = self.session.get(location)
+            response.raise_for_status()
+            return response.json()
+        with open(location, "r") as f:
+            return json.load(f)
+
+    def names(self):
+        return list(self.entries.keys())
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def read(self, name):
+        """
+        the bytes of the member (e.g. images/{hash}.png)
+        """
+        offset, size = self.entries[name]
+        if size == 0:
+            return b""
+        if self.remote:
+            response = self.session.get(
+                self.location, headers={"Range": f"bytes={offset}-{offset + size - 1}"})
+            response.raise_for_status()
+            if response.status_code != 206:
+                # the server ignored the range and sent the whole pack
+                return response.content[offset:offset + size]
+            return response.content
+        with open(self.location, "rb") as f:
+            f.seek(offset)
+            return f.read(size)
+
+    def get(self, id, section=None):
+        """
+        the bytes of the first member named by the id (node id for the exports, hash for the images), None if not packed
+        """
+        for name in self.stems.get(id, []):
+            if section is None or name.startswith(f"{section}/"):
+                return self.read(name)
+        return None
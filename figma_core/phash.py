@@ -0,0 +1,212 @@
+import os
+from pathlib import Path
+
+import numpy as np
+
+# the perceptual hashes (PIL & numpy) - import it lazily from the command line tools.
+
+# dHash - 8x8 horizontal gradients, a 64 bit hash
+HASH_SIZE = 8
+
+# the multi-index - the hash split in 4 bands of 16 bits. two hashes within a distance of d bits have (at least) a band within d // 4 bits.
+BANDS = 4
+BAND_BITS = 64 // BANDS
+
+# the popcount of each byte, for numpy < 2.0 (no bitwise_count)
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def hamming(a, b):
+    """
+    the hamming distance of the hashes (uint64 arrays, broadcasted)
+    """
+    x = np.bitwise_xor(np.asarray(a, dtype=np.uint64), np.asarray(b, dtype=np.uint64))
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(x).astype(np.int64)
+    return _POPCOUNT[x[..., None].view(np.uint8)].sum(axis=-1).astype(np.int64)
+
+
+def dhash_pixels(pixels: np.ndarray) -> int:
+    """
+    the dHash of the (HASH_SIZE + 1) x HASH_SIZE grayscale pixels - a bit per horizontal gradient (left brighter than right)
+    """
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def dhash(path) -> int:
+    """
+    the dHash of the image - downscaled to 9x8 grayscale (transparent pixels over white)
+    """
+    from PIL import Image
+    with Image.open(path) as img:
+        # jpegs can be decoded at a fraction of their size
+        img.draft("RGB", (HASH_SIZE * 8, HASH_SIZE * 8))
+        if img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info:
+            img = img.convert("RGBA")
+            background = Image.new("RGBA", img.size, (255, 255, 255, 255))
+            img = Image.alpha_composite(background, img)
+        # reduce first - the resize of a huge render to 9x8 is otherwise dominated by the filter
+        factor = min(img.width // (HASH_SIZE * 8), img.height // (HASH_SIZE * 8))
+        if factor > 1:
+            img = img.reduce(factor)
+        img = img.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS)
+        return dhash_pixels(np.asarray(img, dtype=np.int16))
+
+
+def bands(hashes: np.ndarray) -> np.ndarray:
+    """
+    the 16 bit bands of the hashes - (n, BANDS)
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    shifts = np.arange(BANDS, dtype=np.uint64) * np.uint64(BAND_BITS)
+    return ((hashes[:, None] >> shifts) & np.uint64((1 << BAND_BITS) - 1)).astype(np.uint32)
+
+
+def _band_masks(radius):
+    """
+    the xor masks of the band values within the radius (0 or 1 bit)
+    """
+    masks = [0]
+    if radius >= 1:
+        masks += [1 << i for i in range(BAND_BITS)]
+    return np.array(masks, dtype=np.uint32)
+
+
+class HashIndex:
+    """
+    A multi-index hashing lookup over 64 bit perceptual hashes - per band, the hashes sorted by the band value.
+
+    Candidates are the hashes with a band equal to (or within a bit of, for distances >= BANDS) the band of the query, checked by the exact hamming distance.
+    Exact (no misses) for distances up to 2 * BANDS - 1 (7 bits).
+
+    ```
+    index = HashIndex(hashes)
+    index.query(hash, distance=4)  # the indices of the hashes within 4 bits
+    index.pairs(distance=4)  # all (i, j) pairs within 4 bits, i < j
+    ```
+    """
+
+    def __init__(self, hashes: np.ndarray):
+        self.hashes = np.asarray(hashes, dtype=np.uint64)
+        self.bands = bands(self.hashes)
+        self.order = np.argsort(self.bands, axis=0, kind="stable")
+        self.sorted = np.take_along_axis(self.bands, self.order, axis=0)
+
+    @staticmethod
+    def check_distance(distance):
+        if distance >= 2 * BANDS:
+            raise ValueError(f"distance must be less than {2 * BANDS} bits")
+
+    def _join(self, queries: np.ndarray, distance: int):
+        """
+        the candidate (query, index) pairs - the queries' bands (n, BANDS) matched against the bands of the index
+        """
+        q_all, i_all = [], []
+        for band in range(BANDS):
+            column = self.sorted[:, band]
+            for mask in _band_masks(distance // BANDS):
+                values = queries[:, band] ^ mask
+                lo = np.searchsorted(column, values, side="left")
+                hi = np.searchsorted(column, values, side="right")
+                counts = hi - lo
+                total = int(counts.sum())
+                if total == 0:
+                    continue
+                q = np.repeat(np.arange(len(values)), counts)
+                # the position of each candidate within its [lo, hi) range
+                offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+                q_all.append(q)
+                i_all.append(self.order[np.repeat(lo, counts) + offsets, band])
+        if not q_all:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return np.concatenate(q_all), np.concatenate(i_all)
+
+    def query(self, hash, distance=4) -> np.ndarray:
+        """
+        the indices of the hashes within the distance of the hash, by the distance
+        """
+        self.check_distance(distance)
+        query = np.array([hash], dtype=np.uint64)
+        _, candidates = self._join(bands(query), distance)
+        candidates = np.unique(candidates)
+        d = hamming(self.hashes[candidates], query[0])
+        matches = candidates[d <= distance]
+        return matches[np.argsort(d[d <= distance], kind="stable")]
+
+    def pairs(self, distance=4):
+        """
+        all the (i, j) pairs (i < j) of the hashes within the distance - (i, j, distance) arrays
+        """
+        self.check_distance(distance)
+        i, j = self._join(self.bands, distance)
+        keep = i < j
+        i, j = i[keep], j[keep]
+        # the same pair is a candidate once per matching band
+        pairs = np.unique(np.stack([i, j], axis=1), axis=0) if len(i) else np.empty((0, 2), dtype=np.int64)
+        i, j = pairs[:, 0], pairs[:, 1]
+        d = hamming(self.hashes[i], self.hashes[j])
+        keep = d <= distance
+        return i[keep], j[keep], d[keep]
+
+
+def connected_components(n, i, j) -> np.ndarray:
+    """
+    the component label (the smallest member) of each of the n nodes, given the edges (i, j)
+    """
+    labels = np.arange(n)
+    if len(i) == 0:
+        return labels
+    while True:
+        m = np.minimum(labels[i], labels[j])
+        previous = labels.copy()
+        np.minimum.at(labels, i, m)
+        np.minimum.at(labels, j, m)
+        # pointer jumping
+        labels = labels[labels]
+        if np.array_equal(labels, previous):
+            return labels
+
+
+def clusters(hashes: np.ndarray, distance=4) -> list[np.ndarray]:
+    """
+    the clusters of near-duplicates (the indices of the hashes, 2 or more per cluster) - connected within the distance
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    # the identical hashes are collapsed first - a single (large) group, not n^2 pairs
+    unique, inverse = np.unique(hashes, return_inverse=True)
+    i, j, _ = HashIndex(unique).pairs(distance)
+    labels = connected_components(len(unique), i, j)[inverse.ravel()]
+
+    order = np.argsort(labels, kind="stable")
+    groups = np.split(order, np.flatnonzero(np.diff(labels[order])) + 1)
+    return [group for group in groups if len(group) > 1]
+
+
+def load_index(path):
+    """
+    the index file (npz) - {"root": str, "paths": str array (relative to the root), "hashes": uint64 array, "mtimes": int64 array}, empty if not found
+    """
+    if not Path(path).exists():
+        return {
+            "root": None,
+            "paths": np.array([], dtype=str),
+            "hashes": np.array([], dtype=np.uint64),
+            "mtimes": np.array([], dtype=np.int64),
+        }
+    with np.load(path) as data:
+        return {
+            "root": str(data["root"]),
+            **{key: data[key] for key in ("paths", "hashes", "mtimes")}
+        }
+
+
+def save_index(path, root, paths, hashes, mtimes):
+    """
+    saves the index (compressed npz) atomically
+    """
+    path = Path(path)
+    tmp = path.with_name(path.name + ".tmp.npz")
+    np.savez_compressed(tmp, root=np.array(str(root)), paths=np.asarray(paths, dtype=str),
+                        hashes=np.asarray(hashes, dtype=np.uint64), mtimes=np.asarray(mtimes, dtype=np.int64))
+    os.replace(tmp, path)
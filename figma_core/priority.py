@@ -0,0 +1,56 @@
+import re
+import json
+from pathlib import Path
+from typing import Dict, Optional
+
+# the popularity of the community files - the meta.jsonl of the index (see data/latest), mapped to the file keys with the map.json.
+
+# the meta fields to rank the files by
+POPULARITY_FIELDS = ["like_count", "duplicate_count"]
+
+
+def community_id(link: str) -> Optional[str]:
+    """
+    the id of the community file link - e.g. https://www.figma.com/community/file/1035203688168086460 → 1035203688168086460
+    """
+    match = re.search(r"community/file/([^/?]+)", link)
+    return match.group(1) if match else None
+
+
+def file_key(link: str) -> Optional[str]:
+    """
+    the key of the file link - e.g. https://www.figma.com/file/ckoLxKa4EKf3CaPq609rpa → ckoLxKa4EKf3CaPq609rpa
+    """
+    match = re.search(r"file/([^/?]+)", link)
+    return match.group(1) if match else None
+
+
+def load_popularity(meta, map=None, by="like_count") -> Dict[str, float]:
+    """
+    the popularity (the `by` field of meta.jsonl) of the files - by the community id, and by the file key (with the map.json, next to the meta.jsonl by default).
+    `meta` can also be the index directory, with meta.jsonl & map.json.
+    """
+    meta = Path(meta)
+    if meta.is_dir():
+        meta = meta / "meta.jsonl"
+    map = map or meta.parent / "map.json"
+
+    popularity = {}
+    with open(meta, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            obj = json.loads(line)
+            popularity[str(obj["id"])] = obj.get(by) or 0
+
+    if map is not None and Path(map).exists():
+        with open(map, "r") as f:
+            links = json.load(f)
+        for community_link, file_link in links.items():
+            id_ = community_id(community_link)
+            key = file_key(file_link) if file_link else None
+            if key and id_ in popularity:
+                popularity[key] = popularity[id_]
+
+    return popularity
@@ -0,0 +1,479 @@
+import os
+import json
+import time
+import hashlib
+import random
+import logging
+import threading
+from pathlib import Path
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from urllib.parse import urlencode, quote_plus
+
+import requests
+from tqdm import tqdm
+
+from .client import API_BASE_URL, FigmaClient, FigmaAPIError
+
+logger = logging.getLogger(__name__)
+
+# figma server allows up to 5000 characters in the url (between 4000 ~ 6000 characters)
+MAX_URL_LENGTH = 5000
+
+# the smallest chunk the sizer shrinks to (a few dozens of ids)
+MIN_URL_LENGTH = 500
+
+# the render latency (seconds) of a chunk the sizer aims for - slower chunks are likely to time out as they grow
+TARGET_LATENCY = 20
+
+# the nodes failed to render alone, per scale & format - {exports}/unrenderable.json
+UNRENDERABLE = "unrenderable.json"
+
+# the identical instances linked to their rendered representative (see `plan_instance_renders`) - {exports}/links.json
+LINKS = "links.json"
+
+# the errors of the render itself (the api message, lowercased) - the only ones bisected & recorded as unrenderable
+RENDER_ERRORS = ["render timeout"]
+
+
+class NodeFilter:
+    """
+    skips the nodes not worth rendering while extracting the ids - figma returns a null url or a blank image for them.
+    counts the skipped nodes by the reason (`skipped`) - shared by the threads.
+
+    - invisible: `visible: false` (the whole subtree is skipped with it)
+    - empty: nothing to render (`absoluteRenderBounds: null`)
+    - small: the render area (absoluteRenderBounds, or absoluteBoundingBox) below `min_area` px² - e.g. zero-size vectors
+    - mask: the mask layers (`isMask`) - rendered as the bare mask shape
+    """
+
+    INVISIBLE = "invisible"
+    EMPTY = "empty"
+    SMALL = "small"
+    MASK = "mask"
+
+    def __init__(self, invisible=True, empty=True, min_area=1.0, masks=True):
+        self.invisible = invisible
+        self.empty = empty
+        self.min_area = min_area
+        self.masks = masks
+        self.skipped = Counter()
+        self.lock = threading.Lock()
+
+    def reason(self, node) -> Optional[str]:
+        """
+        the reason to skip the node, None to keep it
+        """
+        if self.invisible and node.get("visible", True) is False:
+            return self.INVISIBLE
+        if self.masks and node.get("isMask"):
+            return self.MASK
+        # the nodes with no bounds at all (canvases, older documents) are kept
+        if "absoluteRenderBounds" in node and node["absoluteRenderBounds"] is None:
+            return self.EMPTY if self.empty else None
+        box = node.get("absoluteRenderBounds") or node.get("absoluteBoundingBox")
+        if self.min_area and box:
+            if (box.get("width") or 0) * (box.get("height") or 0) < self.min_area:
+                return self.SMALL
+        return None
+
+    def count(self, reason: str, n: int = 1):
+        with self.lock:
+            self.skipped[reason] += n
+
+    def copy(self) -> "NodeFilter":
+        """
+        a filter with the same settings, counting on its own
+        """
+        return NodeFilter(invisible=self.invisible, empty=self.empty, min_area=self.min_area, masks=self.masks)
+
+    def summary(self) -> str:
+        return ", ".join(f"{n} {reason}" for reason, n in self.skipped.most_common()) or "none"
+
+
+def get_node_ids_and_depths(data, depth=None, include_canvas=False, types=None, node_filter: Optional[NodeFilter] = None):
+    """
+    Returns a tuple of three lists:
+    1. The IDs of the nodes.
+    2. A dictionary that maps each ID to its depth in the tree.
+    3. The maximum depth among all nodes.
+
+    If `types` are specified, only nodes of those types are returned. Defaults to all types (None).
+    If `node_filter` is specified, the nodes not worth rendering are skipped (and counted) - see NodeFilter.
+    """
+    def extract_ids_recursively(node, current_depth):
+        if depth is not None and current_depth > depth:
+            return [], {}
+
+        ids = []
+        depth_map = {}
+
+        reason = node_filter.reason(node) if node_filter is not None else None
+        if reason == NodeFilter.INVISIBLE:
+            # the children of an invisible node are not rendered either
+            node_filter.count(reason)
+            return [], {}
+
+        if types is None or node["type"] in types:
+            if reason is None:
+                ids.append(node["id"])
+                depth_map[node["id"]] = current_depth
+            else:
+                node_filter.count(reason)
+
+        if "children" in node:
+            for child in node["children"]:
+                child_ids, child_depth_map = extract_ids_recursively(
+                    child, current_depth + 1)
+                ids.extend(child_ids)
+                depth_map.update(child_depth_map)
+
+        return ids, depth_map
+    try:
+        if include_canvas:
+            ids, depth_map = zip(*[
+                extract_ids_recursively(child, 0)
+                for child in data["document"]["children"]
+            ])
+        else:
+            ids, depth_map = zip(*[
+                extract_ids_recursively(child, 0)
+                for canvas in data["document"]["children"]
+                for child in canvas['children']
+            ])
+
+        # Flatten lists and merge dictionaries
+        ids = [id_ for sublist in ids for id_ in sublist]
+        depth_map = {k: v for dict_ in depth_map for k, v in dict_.items()}
+        try:
+            max_depth = max(depth_map.values())
+        except ValueError:
+            max_depth = 0
+
+        return ids, depth_map, max_depth
+    except (ValueError, TypeError):
+        return [], {}, 0
+
+
+def get_node_areas(data) -> Dict[str, float]:
+    """
+    the render area (absoluteBoundingBox width * height) of every node in the document - the cost estimate of rendering the node.
+    """
+    areas = {}
+    stack = list(data["document"].get("children", []))
+    while stack:
+        node = stack.pop()
+        box = node.get("absoluteBoundingBox") or {}
+        areas[node["id"]] = (box.get("width") or 0) * (box.get("height") or 0)
+        stack.extend(node.get("children", []))
+    return areas
+
+
+# the properties not affecting the render of a node - the ids, the names, the position on the page, prototyping & plugin data.
+# (the overrides of an instance are ignored as well - they reference the node ids, and are reflected in its children anyway)
+FINGERPRINT_IGNORED = {
+    "id", "name", "children", "absoluteBoundingBox", "absoluteRenderBounds", "overrides",
+    "transitionNodeID", "transitionDuration", "transitionEasing", "interactions", "reactions",
+    "prototypeStartNodeID", "prototypeDevice", "flowStartingPoints", "exportSettings",
+    "pluginData", "sharedPluginData",
+}
+
+
+def _render_props(node) -> dict:
+    """
+    the properties of the node that change its render - its size is taken from the bounding box (`size` is only sent with geometry=paths)
+    """
+    props = {k: v for k, v in node.items() if k not in FINGERPRINT_IGNORED}
+    box = node.get("absoluteBoundingBox")
+    if box:
+        # rounded - the same size across the positions may differ by float noise
+        props["box"] = [round(float(box.get("width") or 0), 2), round(float(box.get("height") or 0), 2)]
+    return props
+
+
+def _subtree_digest(node, memo: Dict[int, bytes]) -> bytes:
+    """
+    the digest of the render properties of the node & its descendants (post-order, memoized by the node object)
+    """
+    stack = [(node, False)]
+    while stack:
+        current, visited = stack.pop()
+        if id(current) in memo:
+            continue
+        children = current.get("children", [])
+        if not visited:
+            stack.append((current, True))
+            stack.extend((child, False) for child in children)
+            continue
+        props = _render_props(current)
+        digest = hashlib.sha1(json.dumps(props, sort_keys=True, separators=(",", ":")).encode())
+        for child in children:
+            digest.update(memo[id(child)])
+        memo[id(current)] = digest.digest()
+    return memo[id(node)]
+
+
+def instance_fingerprint(node, memo: Optional[Dict[int, bytes]] = None) -> Optional[str]:
+    """
+    the fingerprint of an INSTANCE node - the component, the size (of the bounding box, and the rotation) and the render properties of its subtree (fills, overrides, ...).
+    the instances with the same fingerprint render identically. None for the other nodes.
+    """
+    if node.get("type") != "INSTANCE" or not node.get("componentId"):
+        return None
+    memo = {} if memo is None else memo
+    props = _render_props(node)
+    transform = props.pop("relativeTransform", None)
+    if transform:
+        # the translation (the position) does not change the render - the rotation / flip does
+        props["rotation"] = [row[:2] for row in transform]
+    digest = hashlib.sha1(json.dumps(props, sort_keys=True, separators=(",", ":")).encode())
+    for child in node.get("children", []):
+        digest.update(_subtree_digest(child, memo))
+    return digest.hexdigest()
+
+
+def plan_instance_renders(data, ids: List[str]):
+    """
+    dedupes the identical instances among the ids - a single representative (the first) is rendered per instance fingerprint.
+
+    returns:
+    - 0. the ids to render (the ids, without the duplicate instances)
+    - 1. the links of the duplicate instances to their representative - {id: representative id}
+    """
+    wanted = set(ids)
+    memo = {}
+    fingerprints = {}
+    stack = list(data["document"].get("children", []))
+    while stack:
+        node = stack.pop()
+        if node["id"] in wanted:
+            fingerprint = instance_fingerprint(node, memo)
+            if fingerprint is not None:
+                fingerprints[node["id"]] = fingerprint
+        stack.extend(node.get("children", []))
+
+    representatives = {}
+    links = {}
+    render = []
+    for id_ in ids:
+        fingerprint = fingerprints.get(id_)
+        if fingerprint is None:
+            render.append(id_)
+        elif fingerprint in representatives:
+            links[id_] = representatives[fingerprint]
+        else:
+            representatives[fingerprint] = id_
+            render.append(id_)
+    return render, links
+
+
+def load_instance_links(directory) -> Dict[str, str]:
+    """
+    the links of the identical instances to their representative, saved when planned - {id: representative id}, from {directory}/links.json
+    """
+    try:
+        with open(Path(directory) / LINKS, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_instance_links(directory, links: Dict[str, str]):
+    """
+    merges the links of the identical instances into {directory}/links.json - the links planned in the previous runs (or levels) are kept
+    """
+    if not links:
+        return
+    path = Path(directory) / LINKS
+    path.parent.mkdir(parents=True, exist_ok=True)
+    data = {**load_instance_links(directory), **links}
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def interleave(ids: List[str], areas: Dict[str, float]) -> List[str]:
+    """
+    orders the ids so the cheap (small) and the expensive (large) nodes alternate - small, large, small, large, ...
+    each (consecutive) chunk then gets a mix of both, instead of a chunk full of huge nodes timing out on the render server.
+    """
+    ordered = sorted(ids, key=lambda id_: areas.get(id_, 0))
+    mixed = []
+    lo, hi = 0, len(ordered) - 1
+    while lo <= hi:
+        mixed.append(ordered[lo])
+        if lo != hi:
+            mixed.append(ordered[hi])
+        lo += 1
+        hi -= 1
+    return mixed
+
+
+def chunk(ids, url, params, max_len=MAX_URL_LENGTH):
+    """
+    chunk the ids for the api call to avoid the url max length limit.
+    most browsers have a limit of 2048 characters, but for this case, it is safe to increase it to 4000
+    the length is counted as the encoded url - {url}?{params}&ids=id1%2Cid2%2Cid3 (e.g. `:` and `,` take 3 characters each)
+    each id is measured once - linear to the number of ids.
+
+    `max_len` can be a callable, read at the start of each chunk (see `ChunkSizer`).
+    """
+    base = len(url) + 1 + len(urlencode({**params, "ids": ""}))
+    sep = len(quote_plus(","))
+
+    chunk = []
+    length = base
+    limit = max_len() if callable(max_len) else max_len
+    for id_ in ids:
+        size = len(quote_plus(id_))
+        if chunk and length + sep + size > limit:
+            yield chunk
+            chunk = []
+            length = base
+            limit = max_len() if callable(max_len) else max_len
+        length += size + (sep if chunk else 0)
+        chunk.append(id_)
+    if chunk:
+        yield chunk
+
+
+class ChunkSizer:
+    """
+    adapts the chunk (url) length of a file to the observed render latency.
+    halves on a slow or failed chunk, grows back by 10% on a fast one - the files with heavy nodes converge to smaller chunks.
+    """
+
+    def __init__(self, max_len=MAX_URL_LENGTH, min_len=MIN_URL_LENGTH, target_latency=TARGET_LATENCY):
+        self.max_len = max_len
+        self.min_len = min_len
+        self.target_latency = target_latency
+        self.len = max_len
+
+    def __call__(self):
+        return int(self.len)
+
+    def observe(self, latency: float, failed: bool = False):
+        if failed or latency > self.target_latency:
+            self.len = max(self.min_len, self.len / 2)
+        elif latency < self.target_latency / 2:
+            self.len = min(self.max_len, self.len * 1.1)
+
+
+def is_render_error(e: FigmaAPIError):
+    """
+    rather if the error is caused by the rendered nodes (the render timeout) - retrying with fewer nodes may succeed.
+    the other errors (auth, not found, rate limit, bad request, server errors) are not - the chunk fails as a whole, and is retried on the next run.
+    """
+    return e.status not in (401, 403, 404, 429) and any(message in str(e).lower() for message in RENDER_ERRORS)
+
+
+def unrenderable_key(scale, format):
+    return f"@{scale}x.{format}"
+
+
+def load_unrenderable(directory, scale, format) -> Dict[str, str]:
+    """
+    the nodes that failed to render (even alone) in the previous runs - {node id: error}, from {directory}/unrenderable.json
+    """
+    try:
+        with open(Path(directory) / UNRENDERABLE, "r") as f:
+            return json.load(f).get(unrenderable_key(scale, format), {})
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_unrenderable(directory, scale, format, unrenderable: Dict[str, str]):
+    """
+    saves the unrenderable nodes (per scale & format) to {directory}/unrenderable.json
+    """
+    path = Path(directory) / UNRENDERABLE
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        data = {}
+    key = unrenderable_key(scale, format)
+    if not unrenderable and key not in data:
+        return
+    data[key] = unrenderable
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def fetch_node_images(client: FigmaClient, file_key: str, ids: List[str], scale, format: str, concurrency: int = 1, position: Optional[int] = None, disable: bool = False, areas: Optional[Dict[str, float]] = None, unrenderable: Optional[Dict[str, str]] = None) -> Dict[str, Optional[str]]:
+    """
+    the render urls of the nodes (by the node id) - GET /images/:key, chunked by the url length.
+
+    the chunks are requested concurrently - the rate is bounded by the client (the shared budget of the token).
+    with the `areas` (see `get_node_areas`), the cheap and the expensive nodes are mixed in each chunk.
+    the chunk size adapts to the render latency of the file (see `ChunkSizer`).
+
+    a chunk failing to render is bisected and retried, until the failing node is isolated.
+    the isolated nodes are added to `unrenderable` ({node id: error}), and the nodes already in it are skipped.
+    the chunks failing otherwise (e.g. bad request, server or connection errors) are logged and skipped - their ids are missing from the result (and not recorded), so they are retried on the next run.
+    """
+    url = f"{API_BASE_URL}/images/{file_key}"
+    params = {
+        "use_absolute_bounds": "true",
+        "scale": scale,
+        "format": format,
+    }
+
+    if unrenderable is None:
+        unrenderable = {}
+    ids = [id_ for id_ in ids if id_ not in unrenderable]
+    if areas:
+        ids = interleave(ids, areas)
+    size = len(ids)
+
+    sizer = ChunkSizer()
+    chunks = chunk(ids, url=url, params=params, max_len=sizer)
+    lock = threading.Lock()
+
+    def fetch_images_chunk(chunk):
+        try:
+            return client.images(file_key, chunk, **params)
+        except FigmaAPIError as e:
+            if not is_render_error(e):
+                # ignore and report error
+                logger.error(f"Error fetching {len(chunk)} layer images [{','.join(chunk)}], e:{e}")
+                return {}
+            if len(chunk) == 1:
+                logger.error(f"Unrenderable layer {chunk[0]} @{scale}x.{format}, e:{e}")
+                with lock:
+                    unrenderable[chunk[0]] = str(e)
+                return {}
+            # bisect - the (few) bad nodes are isolated in log2(n) steps, the rest still renders
+            half = len(chunk) // 2
+            return {**fetch_images_chunk(chunk[:half]), **fetch_images_chunk(chunk[half:])}
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.error(f"Error fetching {len(chunk)} layer images [{','.join(chunk)}], e:{e}")
+            return {}
+
+    emojis = ['🛫', '🛬']
+    image_urls = {}
+
+    def worker(pbar):
+        while True:
+            with lock:
+                _chunk = next(chunks, None)
+            if _chunk is None:
+                return
+            start = time.monotonic()
+            failed = len(unrenderable)
+            result = fetch_images_chunk(_chunk)
+            with lock:
+                sizer.observe(time.monotonic() - start, failed=len(unrenderable) > failed or len(result) < len(_chunk))
+                image_urls.update(result)
+            pbar.update(len(_chunk))
+
+    with tqdm(total=size, desc=f"{random.choice(emojis)} {file_key[:8]:<8} @{scale}x.{format} ({size})"[:25], position=position, leave=False, mininterval=1, disable=disable) as pbar:
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            for future in [executor.submit(worker, pbar) for _ in range(max(1, concurrency))]:
+                future.result()
+
+    return image_urls
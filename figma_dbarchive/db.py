@@ -1,3 +1,5 @@
+import os
+import sys
 import random
 import threading
 from pathlib import Path
@@ -7,8 +9,12 @@ import time
 import click
 from tqdm import tqdm
 
+# for importing the shared figma_core package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 from dbarchive.workers import dbworker, fileworker
 from dbarchive.lock import get_processed_files
+from figma_core.document import is_document
 
 PBARPOS = 8
 
@@ -50,7 +56,7 @@ def main(mode, src, db, concurrency, depth, max, shuffle, gc):
     dbthread.start()
 
     # seed the file queue
-    files = [f for f in samples_path.glob("*/file.json")]
+    files = [f for f in samples_path.glob("*/file.json*") if is_document(f)]
     if shuffle:
         random.shuffle(files)
     n = 0
@@ -1,17 +1,23 @@
 
-import json
+from figma_core.document import load_document, iter_roots
 from .utils import getfrom
 
 
 def roots_from_file(file_path):
-    with open(file_path, "r") as f:
-        data = json.load(f)
-        roots = []
-        for canvas in data["document"]["children"]:
-            for root in canvas["children"]:
-                roots.append((root, canvas['id']))
-
-        return roots
+    data = load_document(file_path)
+    roots = []
+    for canvas in data["document"]["children"]:
+        for root in canvas["children"]:
+            roots.append((root, canvas['id']))
+
+    return roots
+
+
+def iter_roots_from_file(file_path):
+    """
+    lazy variant of `roots_from_file` - streams the top-level nodes (root, canvas_id) one at a time, without loading the whole document.
+    """
+    yield from iter_roots(file_path)
 
 
 def process_node(node: dict, depth, canvas, parent=None, current_depth=0):
@@ -4,7 +4,7 @@ from queue import Queue, Empty
 import sqlite3
 import time
 from tqdm import tqdm
-from .node import process_node, roots_from_file
+from .node import process_node, iter_roots_from_file
 from .table import create_table, insert_node
 from .lock import update_processed_files, processed_files
 
@@ -54,9 +54,8 @@ def fileworker(queue: Queue, db: Queue, depth, threshold=4096, clean=False):
             break
 
         try:
-            root_nodes = roots_from_file(file_path)
-            # tqdm.write(f'☐ {file_id} ({len(root_nodes)} items)')
-            for node, canvas in root_nodes:
+            # roots are streamed one by one, so each subtree can be released right after it is processed
+            for node, canvas in iter_roots_from_file(file_path):
                 for processed in process_node(node=node, canvas=canvas, parent=None, depth=depth):
                     record = {
                         'file_id': file_id,
@@ -76,7 +75,7 @@ def fileworker(queue: Queue, db: Queue, depth, threshold=4096, clean=False):
                     db.put((record, 'PUT'))
                     del processed
                     del record
-            del root_nodes
+                del node
             if clean:
                 gc.collect()
             update_processed_files(1)
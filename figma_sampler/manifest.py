@@ -0,0 +1,85 @@
+import os
+import json
+import threading
+from pathlib import Path
+
+
+class Manifest:
+    """
+    journal of the samples in the output directory - `{output}/manifest.jsonl`
+
+    each line is `{"id": ..., "status": "started" | "complete" | "failed"}`, appended (a single O_APPEND write) as each sample starts and ends. the last status of an id wins.
+    - complete - the sample is complete (will be skipped)
+    - started - the sample was interrupted, its directory is malformed (will be replaced)
+    - failed - the sample failed and its directory was removed
+    """
+
+    NAME = 'manifest.jsonl'
+
+    def __init__(self, output: Path):
+        self.output = Path(output)
+        self.path = self.output / Manifest.NAME
+        self.status = {}
+        self.lock = threading.Lock()
+        self.fd = None
+
+    def exists(self):
+        return self.path.exists()
+
+    def load(self):
+        self.status = {}
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # partially written line (interrupted) - ignore
+                    continue
+                self.status[entry['id']] = entry['status']
+        return self
+
+    def rebuild(self):
+        """
+        rebuilds the manifest by scanning the sample directories (one level - does not walk the images).
+        this is for recovery, when the manifest is missing or out of sync with the output directory.
+        """
+        self.status = {}
+        for dir in self.output.iterdir():
+            if not dir.is_dir():
+                continue
+            if (dir / 'map.json').exists():
+                self.status[dir.name] = 'complete'
+            elif any(dir.glob('file.json*')):
+                # if file.json exists, but map.json does not, it means the file is malformed
+                self.status[dir.name] = 'started'
+
+        # write atomically
+        tmp = self.path.with_suffix('.tmp')
+        with open(tmp, 'w') as f:
+            for id, status in self.status.items():
+                f.write(json.dumps({'id': id, 'status': status}) + '\n')
+        os.replace(tmp, self.path)
+        return self
+
+    @property
+    def completes(self):
+        return [id for id, status in self.status.items() if status == 'complete']
+
+    @property
+    def malforms(self):
+        return [id for id, status in self.status.items() if status == 'started']
+
+    def record(self, id, status):
+        line = (json.dumps({'id': id, 'status': status}) + '\n').encode()
+        with self.lock:
+            if self.fd is None:
+                self.fd = os.open(
+                    self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            os.write(self.fd, line)
+            self.status[id] = status
+
+    def close(self):
+        with self.lock:
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
@@ -1,15 +1,28 @@
 import os
+import sys
+import errno
 import random
 from urllib.parse import urlparse
 import gzip
 import json
 import shutil
 from pathlib import Path
+from functools import partial
+from multiprocessing import cpu_count
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 import click
 from tqdm import tqdm
 import jsonlines
 from colorama import Fore
 import logging
+from manifest import Manifest
+from strategies import head, weighted_reservoir, stratified_reservoir, size_bucket
+
+# for importing the shared figma_core package
+sys.path.insert(0, os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))))
+
+from figma_core.document import find_document
 
 logging.basicConfig(filename='error-files.log', level=logging.ERROR)
 
@@ -31,8 +44,21 @@ logging.basicConfig(filename='error-files.log', level=logging.ERROR)
 @click.option('--skip-images', is_flag=True, default=False, help='Skip images copy for files')
 @click.option('--only-images', is_flag=True, default=False, help='Only copy images for files')
 @click.option('--shuffle', is_flag=True, default=False, help='Shuffle the index')
+@click.option('--seed', default=None, type=int, help='Seed for --shuffle and the random sampling strategies (for reproducible samples)')
+@click.option('--strategy', default='head', type=click.Choice(['head', 'weighted', 'stratified']), help='Sampling strategy - head (first n of the index), weighted (by --weight-by) or stratified (by --stratify-by)')
+@click.option('--weight-by', default='like_count', type=click.Choice(['like_count', 'duplicate_count']), help='(weighted) Meta field to weight the samples with')
+@click.option('--stratify-by', default='size', type=click.Choice(['size', 'tag']), help='(stratified) Strata of the samples - size (log2 bucket of the file size) or tag (the first tag)')
 @click.option('--link', is_flag=True, default=False, help='Use symbolic link instead of copy')
-def main(index, map, meta, output, dir_files_archive, dir_images_archive, dir_image_exports_archive, dir_image_fills_archive, sample, sample_all, no_compress, ensure_images, ensure_meta, skip_images, only_images, shuffle, link):
+@click.option('--hardlink', is_flag=True, default=False, help='Use hard links instead of copy for images (and file.json with --no-compress) - falls back to copy across devices')
+@click.option('--reflink', is_flag=True, default=False, help='Use copy-on-write clones (APFS, Btrfs, XFS) instead of copy for images (and file.json with --no-compress) - falls back to copy if not supported')
+@click.option('-c', '--concurrency', default=16, type=int, help='Number of samples to process concurrently (threads)')
+@click.option('-p', '--processes', default=cpu_count(), type=int, help='Number of processes for the gzip compression')
+@click.option('--rebuild-manifest', is_flag=True, default=False, help='Rebuild the manifest (completes & malforms) by scanning the output directory')
+def main(index, map, meta, output, dir_files_archive, dir_images_archive, dir_image_exports_archive, dir_image_fills_archive, sample, sample_all, no_compress, ensure_images, ensure_meta, skip_images, only_images, shuffle, link, hardlink, reflink, concurrency, processes, rebuild_manifest, seed, strategy, weight_by, stratify_by):
+    if sum([link, hardlink, reflink]) > 1:
+        raise click.UsageError(
+            'Only one of --link, --hardlink and --reflink can be set')
+
     index = Path(index)
     dir_files_archive = Path(dir_files_archive)
 
@@ -67,19 +93,6 @@ def main(index, map, meta, output, dir_files_archive, dir_images_archive, dir_im
             raise click.UsageError(
                 'If index is not a directory, map and meta must be provided')
 
-    # Read index file
-    with jsonlines.open(index, mode='r') as reader:
-        # get id, link, title
-        index_data = [(obj["id"], obj["link"], obj["title"]) for obj in reader]
-
-    # Read meta file
-    with jsonlines.open(meta, mode='r') as reader:
-        # it is a array of objects with id, name, description, version, ...
-        meta_data = {}
-        for obj in reader:
-            # Now, convert it to key-value pair with id as key
-            meta_data[obj["id"]] = obj
-
     # Read map file
     with open(map, 'r') as f:
         map_data = json.load(f)
@@ -90,47 +103,90 @@ def main(index, map, meta, output, dir_files_archive, dir_images_archive, dir_im
 
     tqdm.write(f"📂 {output}")
 
+    manifest = Manifest(output)
     if only_images:
         completes = []
         malforms = []
     else:
-        # locate the already-sampled files with finding map.json files
-        # get the ids of the already-sampled files
-        completes = [x.parent.name for x in output.glob('**/map.json')]
-        # if file.json exists, but map.json does not, it means the file is malformed
-        malforms = [x.parent.name for x in output.glob(
-            '**/file.json*') if not (x.parent / 'map.json').exists()]
+        # the already-sampled (complete) and malformed samples are tracked with the manifest journal
+        # the output directory is scanned only if asked to, or if the manifest does not exist yet (e.g. output from older versions)
+        if rebuild_manifest or not manifest.exists():
+            tqdm.write(f"📂 {output} rebuilding {Manifest.NAME}...")
+            manifest.rebuild()
+        else:
+            manifest.load()
+        completes = manifest.completes
+        malforms = manifest.malforms
 
     tqdm.write(
         f"📂 {output} already contains {len(completes)} samples (will be skipped), {len(malforms)} malformed samples (will be replaced)")
 
-    # pre-validate the targtes (check if drafted file exists for community lunk)
-    available = [(id, link, _) for id, link, _ in index_data
-                 if link in map_data and map_data[link] is not None]
+    rng = random.Random(seed)
 
-    # remove the already-sampled files from the available list
-    available = [x for x in available if x[0] not in completes]
+    # pre-validate the targtes (check if drafted file exists for community lunk)
+    # and remove the already-sampled files from the available list
+    # the index is streamed record by record into the strategy - only the sampled items are held
+    completes = set(completes)
+    available = ((id, link, _) for id, link, _ in read_index(index)
+                 if link in map_data and map_data[link] is not None and id not in completes)
 
-    # shuffle the available list
+    # shuffle the available list (this one needs the whole list)
     if shuffle:
-        random.shuffle(available)
+        available = list(available)
+        rng.shuffle(available)
 
-    # Calculate sample size
-    if sample_all:
-        sample_size = len(available)
+    # Calculate sample size (all of the available, unless --sample)
+    if sample_all or sample is None:
+        sample_size = sys.maxsize
     else:
-        sample_size = sample if sample is not None else len(available)
+        sample_size = sample
+
+    # the strategies are single-pass over the available items, and only hold O(k) items
+    if strategy == 'weighted':
+        # only the weights are kept from meta (not the records)
+        weights = read_meta(meta, field=weight_by)
+
+        def weight(item):
+            # +1, so the files with no likes (or duplicates) still have a chance
+            return (weights.get(item[0]) or 0) + 1
+
+        targets = weighted_reservoir(
+            available, sample_size, weight=weight, rng=rng)
+    elif strategy == 'stratified':
+        if stratify_by == 'tag':
+            tags = read_meta(meta, field='tags')
+
+        def stratum(item):
+            if stratify_by == 'size':
+                # the archived document as stored (.json, .json.gz or .json.zst)
+                origin = find_document(
+                    dir_files_archive, extract_file_key(map_data[item[1]]))
+                return size_bucket(origin.stat().st_size if origin else 0)
+            elif stratify_by == 'tag':
+                _tags = tags.get(item[0]) or []
+                return _tags[0] if len(_tags) > 0 else ''
+
+        targets = stratified_reservoir(
+            available, sample_size, stratum=stratum, rng=rng)
+    else:
+        targets = head(available, sample_size)
 
-    targets = available[:sample_size]
+    # the meta records of the sampled items only
+    meta_data = read_meta(meta, ids={id for id, _, _ in targets})
 
-    # Process samples with tqdm progress bar
-    for id, link, title in tqdm(targets, desc='🗳️', leave=True, colour='white'):
+    copy_mode = 'hardlink' if hardlink else 'reflink' if reflink else 'copy'
+
+    def process(id, community_link, title):
+        file_key = None
+        output_dir = None
         try:
-            file_url = map_data[link]
+            file_url = map_data[community_link]
 
             file_key = extract_file_key(file_url)
             output_dir: Path = output / id
 
+            do_files and manifest.record(id, 'started')
+
             # If the output directory already exists, remove it
             if output_dir.exists():
                 shutil.rmtree(output_dir)
@@ -143,7 +199,12 @@ def main(index, map, meta, output, dir_files_archive, dir_images_archive, dir_im
             # Copy file.json (compress if needed)
             if do_files:
                 try:
-                    copy_and_compress(origin, target, no_compress)
+                    if no_compress:
+                        copy_file(origin, target, mode=copy_mode)
+                    else:
+                        # compression is cpu bound - run it on the process pool
+                        compressor.submit(
+                            copy_and_compress, origin, target).result()
                 except FileNotFoundError as e:
                     shutil.rmtree(output_dir)
                     raise SamplerException(
@@ -160,7 +221,7 @@ def main(index, map, meta, output, dir_files_archive, dir_images_archive, dir_im
                             raise OkException(
                                 id, file_key, f"Meta not found for sample <{title}>")
                         else:
-                            continue
+                            return
 
             if do_files:
                 # Write map.json
@@ -194,10 +255,10 @@ def main(index, map, meta, output, dir_files_archive, dir_images_archive, dir_im
                                 os.symlink(item, target)
                             else:
                                 if item.is_file():
-                                    shutil.copy(item, target)
+                                    copy_file(item, target, mode=copy_mode)
                                 elif item.is_dir():
                                     shutil.copytree(
-                                        item, output_dir / item.name)
+                                        item, output_dir / item.name, copy_function=partial(copy_file, mode=copy_mode))
                     else:
                         if ensure_images:
                             raise OkException(
@@ -210,9 +271,12 @@ def main(index, map, meta, output, dir_files_archive, dir_images_archive, dir_im
                     cp(dir_image_exports_archive / file_key)
                     cp(dir_image_fills_archive / file_key)
 
+            do_files and manifest.record(id, 'complete')
             tqdm.write(
                 Fore.WHITE + f"☑ {id} → {output_dir} ({file_key} / {title})")
         except OkException as e:
+            # the sample is complete (with warnings) if the map.json is written
+            do_files and (output_dir / "map.json").exists() and manifest.record(id, 'complete')
             tqdm.write(
                 Fore.YELLOW + f'☒ {e.id} → {output_dir} WARNING ({e.file}) - {e.message}')
             logging.warning(
@@ -221,13 +285,30 @@ def main(index, map, meta, output, dir_files_archive, dir_images_archive, dir_im
             tqdm.write(Fore.RED + f"☒ {e.id}/{file_key} - {e.message}")
             logging.error(f"☒ {e.id}/{file_key} - {e.message}")
             output_dir.exists() and shutil.rmtree(output_dir)
+            do_files and manifest.record(id, 'failed')
         except Exception as e:
             tqdm.write(
                 Fore.RED + f"☒ {id}/{file_key} - ERROR sampleing <{title}>")
             logging.error(f"☒ {id}/{file_key} - ERROR sampleing <{title}>")
-            output_dir.exists() and shutil.rmtree(output_dir)
+            output_dir is not None and output_dir.exists() and shutil.rmtree(output_dir)
+            do_files and manifest.record(id, 'failed')
             raise e
 
+    # Process samples with tqdm progress bar
+    # the samples are processed concurrently on a thread pool (i/o bound - copies and links), while the gzip compression runs on a process pool.
+    with ProcessPoolExecutor(max_workers=processes) as compressor, ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(process, id, community_link, title)
+                   for id, community_link, title in targets]
+        try:
+            for future in tqdm(as_completed(futures), total=len(futures), desc='🗳️', leave=True, colour='white'):
+                future.result()
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+        finally:
+            manifest.close()
+
     # ensure after sampling is complete
     if only_images:
         # if only images, remove all files under top level directories
@@ -237,6 +318,28 @@ def main(index, map, meta, output, dir_files_archive, dir_images_archive, dir_im
                 file.unlink()
 
 
+def read_index(path):
+    """
+    streams the index (jsonlines) as (id, link, title)
+    """
+    with jsonlines.open(path, mode='r') as reader:
+        for obj in reader:
+            yield obj["id"], obj["link"], obj["title"]
+
+
+def read_meta(path, ids=None, field=None):
+    """
+    streams the meta (jsonlines, objects with id, name, description, version, ...) as {id: record} - of the ids only (all if None), or {id: record[field]} with the field
+    """
+    meta = {}
+    with jsonlines.open(path, mode='r') as reader:
+        for obj in reader:
+            if ids is not None and obj["id"] not in ids:
+                continue
+            meta[obj["id"]] = obj if field is None else obj.get(field)
+    return meta
+
+
 class SamplerException(Exception):
     def __init__(self, id, file, message):
         self.message = message
@@ -255,7 +358,55 @@ def copy_and_compress(origin, target, no_compress=False):
     else:
         with open(origin, 'rb') as src:
             with gzip.open(target, 'wb') as dest:
-                shutil.copyfileobj(src, dest)
+                shutil.copyfileobj(src, dest, length=1024 * 1024)
+
+
+# ioctl request code for FICLONE (linux - btrfs, xfs)
+FICLONE = 0x40049409
+
+
+def reflink(origin, target) -> bool:
+    """
+    creates a copy-on-write clone of origin at target. returns False if not supported by the os / filesystem.
+    """
+    try:
+        if sys.platform == 'darwin':
+            import ctypes
+            libc = ctypes.CDLL(None, use_errno=True)
+            if libc.clonefile(os.fsencode(origin), os.fsencode(target), 0) == 0:
+                return True
+            return False
+        elif sys.platform.startswith('linux'):
+            import fcntl
+            with open(origin, 'rb') as src, open(target, 'wb') as dest:
+                try:
+                    fcntl.ioctl(dest.fileno(), FICLONE, src.fileno())
+                    return True
+                except OSError:
+                    ...
+            os.unlink(target)
+            return False
+    except (OSError, AttributeError):
+        ...
+    return False
+
+
+def copy_file(origin, target, mode='copy'):
+    """
+    copies a single file with the given mode - 'copy', 'hardlink' or 'reflink'.
+    hardlink and reflink fall back to a regular copy if not possible (e.g. across devices or on unsupported filesystems)
+    """
+    if mode == 'hardlink':
+        try:
+            os.link(origin, target)
+            return target
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.ENOTSUP, errno.EMLINK):
+                raise
+    elif mode == 'reflink':
+        if reflink(origin, target):
+            return target
+    return shutil.copy2(origin, target)
 
 
 def extract_file_key(url):
@@ -0,0 +1,92 @@
+import heapq
+import math
+import random
+from typing import Callable, Iterable, TypeVar
+
+T = TypeVar('T')
+
+
+def head(items: Iterable[T], k: int) -> list[T]:
+    """
+    the first k items
+    """
+    out = []
+    for item in items:
+        if len(out) >= k:
+            break
+        out.append(item)
+    return out
+
+
+def weighted_reservoir(items: Iterable[T], k: int, weight: Callable[[T], float], rng: random.Random) -> list[T]:
+    """
+    weighted random sampling without replacement, in a single pass with O(k) memory (Efraimidis & Spirakis, A-Res).
+
+    each item gets the key u^(1/w) (u ~ U(0, 1)) and the k items with the largest keys are kept.
+    the items are returned in the order of their keys (most likely first).
+    """
+    heap = []  # min-heap of (key, n, item)
+    for n, item in enumerate(items):
+        w = weight(item)
+        if w <= 0:
+            continue
+        key = rng.random() ** (1 / w)
+        if len(heap) < k:
+            heapq.heappush(heap, (key, n, item))
+        elif key > heap[0][0]:
+            heapq.heapreplace(heap, (key, n, item))
+    return [item for _, _, item in sorted(heap, reverse=True)]
+
+
+def stratified_reservoir(items: Iterable[T], k: int, stratum: Callable[[T], str], rng: random.Random) -> list[T]:
+    """
+    stratified random sampling in a single pass - a uniform reservoir (algorithm R) of up to k items is kept for each stratum, with O(k * strata) memory.
+
+    the k items are then allocated evenly across the strata (round-robin), so that smaller strata contribute all they have and the rest is filled from the larger ones.
+    """
+    reservoirs: dict[str, list[T]] = {}
+    seen: dict[str, int] = {}
+    for item in items:
+        s = stratum(item)
+        reservoir = reservoirs.setdefault(s, [])
+        seen[s] = seen.get(s, 0) + 1
+        if len(reservoir) < k:
+            reservoir.append(item)
+        else:
+            j = rng.randrange(seen[s])
+            if j < k:
+                reservoir[j] = item
+
+    for reservoir in reservoirs.values():
+        rng.shuffle(reservoir)
+
+    # round-robin over the strata (in a deterministic order)
+    strata = [reservoirs[s] for s in sorted(reservoirs.keys())]
+    out = []
+    i = 0
+    while len(out) < k and any(strata):
+        for reservoir in strata:
+            if i < len(reservoir) and len(out) < k:
+                out.append(reservoir[i])
+        i += 1
+        if all(i >= len(reservoir) for reservoir in strata):
+            break
+    return out
+
+
+def size_bucket(size: int) -> str:
+    """
+    log2 bucket of the size in bytes - e.g. '1MB-2MB'
+    """
+    def fmt(n):
+        for unit in ['B', 'KB', 'MB', 'GB']:
+            if n < 1024:
+                return f'{n}{unit}'
+            n //= 1024
+        return f'{n}TB'
+
+    if size <= 0:
+        return '0B'
+    upper = 2 ** math.ceil(math.log2(size))
+    # zero padded, so the buckets are ordered by size when sorted
+    return f'{upper:016d}:{fmt(upper // 2)}-{fmt(upper)}'
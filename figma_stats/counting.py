@@ -0,0 +1,78 @@
+import heapq
+import tempfile
+from collections import Counter
+
+
+def escape(text: str):
+    """
+    escapes the text to a single tsv field
+    """
+    return text.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+class ExternalCounter:
+    """
+    counts the lines as (text, count, n_files) with bounded memory.
+
+    while the in-memory table grows over `max_items`, it is spilled to disk as a sorted run.
+    `items()` k-way merges the runs (and what is left in memory), yielding the totals in (escaped) text order.
+    """
+
+    def __init__(self, max_items=1_000_000, tmpdir=None):
+        self.max_items = max_items
+        self.tmpdir = tmpdir
+        self.table = {}  # text -> [count, n_files]
+        self.runs = []
+
+    def add_file(self, lines):
+        """
+        adds the lines of a single file - the file is counted once per distinct text (n_files)
+        """
+        for text, n in Counter(lines).items():
+            entry = self.table.get(text)
+            if entry is None:
+                self.table[text] = [n, 1]
+            else:
+                entry[0] += n
+                entry[1] += 1
+
+        if len(self.table) > self.max_items:
+            self.spill()
+
+    def spill(self):
+        run = tempfile.TemporaryFile(
+            mode='w+', encoding='utf-8', dir=self.tmpdir)
+        for key, (count, files) in sorted((escape(text), entry) for text, entry in self.table.items()):
+            run.write(f'{key}\t{count}\t{files}\n')
+        run.seek(0)
+        self.runs.append(run)
+        self.table = {}
+
+    def items(self):
+        def read(run):
+            for line in run:
+                key, count, files = line.rstrip('\n').split('\t')
+                yield key, int(count), int(files)
+
+        memory = sorted((escape(text), count, files)
+                        for text, (count, files) in self.table.items())
+        merged = heapq.merge(memory, *[read(run) for run in self.runs],
+                             key=lambda x: x[0])
+
+        current = None
+        for key, count, files in merged:
+            if current is not None and current[0] == key:
+                current[1] += count
+                current[2] += files
+            else:
+                if current is not None:
+                    yield tuple(current)
+                current = [key, count, files]
+        if current is not None:
+            yield tuple(current)
+
+    def close(self):
+        for run in self.runs:
+            run.close()
+        self.runs = []
+        self.table = {}
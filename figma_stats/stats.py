@@ -1,84 +1,195 @@
-from utils import is_text_not_empty, visit, flatten, extract_text
-import json
+import os
+import sys
 from pathlib import Path
 import random
-import re
+from multiprocessing import Pool, cpu_count
 import click
 from tqdm import tqdm
-import os
-import sys
 
-# for easily importing utils
+# for easily importing utils (and the shared figma_core package)
 current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, current_dir)
+sys.path.insert(0, os.path.dirname(current_dir))
 
+from utils import ARTIFACTS, extract_lines
+from counting import ExternalCounter
+from summary import SummaryCache, summarize, merge, empty, dumps
+from figma_core.document import find_document, iter_roots
 
-@click.command()
-@click.argument('samples', type=click.Path(exists=True), required=True)
-@click.option('--max', type=click.INT, default=None, required=False)
-@click.option('--shuffle', is_flag=True, type=click.BOOL, default=False, required=False)
-def main(samples, max, shuffle):
-    samples = Path(samples)
 
-    # list directories in samples
-    directories = [d for d in samples.iterdir() if d.is_dir()]
+def extract_file(directory: Path):
+    """
+    streams the sample's file.json (or file.json.gz) once, and returns the lines for every artifact.
+    only one top-level layer is held in memory at a time.
+    """
+    json_path = find_document(directory, 'file')
+    if json_path is None:
+        return directory.name, None
+
+    lines = {artifact: [] for artifact in ARTIFACTS}
+    try:
+        for root, _ in iter_roots(json_path):
+            for artifact, _lines in extract_lines(root).items():
+                lines[artifact].extend(_lines)
+            del root
+    except Exception as e:
+        tqdm.write(f'☒ {directory.name} - {e}')
+        return directory.name, None
+
+    return directory.name, lines
+
+
+def list_samples(samples: Path, max=None, shuffle=False, seed=None):
+    # list directories in samples (sorted, so the output order is deterministic)
+    directories = sorted([d for d in samples.iterdir() if d.is_dir()])
+
+    # Shuffle the list if shuffle is specified
+    if shuffle:
+        random.Random(seed).shuffle(directories)
 
     # Cut the list if max is specified
     if max:
         directories = directories[:max]
 
-    # Shuffle the list if shuffle is specified
-    if shuffle:
-        directories = random.shuffle(directories)
+    return directories
+
+
+class DefaultGroup(click.Group):
+    """
+    a group falling back to the default command when the first argument is not a command - `stats.py <samples>` (the usage before the subcommands) runs `stats.py texts <samples>`.
+    """
+
+    def __init__(self, *args, default=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.default = default
 
-    ids = [d.name for d in directories]
+    def parse_args(self, ctx, args):
+        if args and args[0] not in self.commands and args[0] not in ctx.help_option_names:
+            args = [self.default] + list(args)
+        return super().parse_args(ctx, args)
 
-    root_elements = {}
 
-    for directory in tqdm(directories, desc='Indexing..', leave=False):
-        # get the text layers' json file
-        json_path = directory / 'file.json'
-        with open(json_path, 'r') as data:
-            data = json.load(data)
-        document = data['document']
-        toplayers = flatten([canvas['children']
-                             for canvas in document['children']])
+@click.group(cls=DefaultGroup, default='texts')
+def cli():
+    ...
 
-        root_elements[directory.name] = toplayers
 
-    artifects_dir = Path('artifacts')
+@cli.command()
+@click.argument('samples', type=click.Path(exists=True), required=True)
+@click.option('--max', type=click.INT, default=None, required=False)
+@click.option('--shuffle', is_flag=True, type=click.BOOL, default=False, required=False)
+@click.option('--seed', type=click.INT, default=None, required=False, help='Seed for --shuffle (for reproducible outputs)')
+@click.option('-c', '--concurrency', type=click.INT, default=cpu_count(), help='Number of processes to utilize')
+@click.option('-o', '--output', type=click.Path(file_okay=False), default='artifacts', help='Directory to write the artifacts to')
+@click.option('--dedupe', is_flag=True, default=False, help='Write deduplicated artifacts ({name}.counts.tsv - text, count, n_files) instead of the raw lines')
+@click.option('--max-memory-items', type=click.INT, default=1_000_000, help='(with --dedupe) Max distinct texts held in memory per artifact before spilling to disk')
+def texts(samples, max, shuffle, seed, concurrency, output, dedupe, max_memory_items):
+    """
+    extracts the text artifacts (texts, layer names) from the samples
+    """
+    directories = list_samples(Path(samples), max=max, shuffle=shuffle, seed=seed)
+
+    artifects_dir = Path(output)
     artifects_dir.mkdir(exist_ok=True)
 
-    # output the text layers' text content into one file
-    with open(artifects_dir / 'texts.txt', 'w') as f:
-        for id in tqdm(ids, desc="Text Layers"):
-            texts = extract_text(root_elements[id])
-            for text in texts:
-                f.write(text + '\n')
-        f.close()
-
-    # output the layers' name content into one file
-    with open(artifects_dir / 'layer-names.txt', 'w') as f:
-        for id in tqdm(ids, desc="Layer Names"):
-            for layer in visit(root_elements[id], skip_types=['TEXT']):
-                is_text_not_empty(layer['name']) and f.write(
-                    layer['name'].strip() + '\n')
-        f.close()
-
-    with open(artifects_dir / 'layer-names-top.txt', 'w') as f:
-        for id in tqdm(ids, desc="Top Layer Names"):
-            for layer in visit(root_elements[id], skip_types=['TEXT'], max=0):
-                is_text_not_empty(layer['name']) and f.write(
-                    layer['name'].strip() + '\n')
-        f.close()
-
-    with open(artifects_dir / 'layer-names-top-frames.txt', 'w') as f:
-        for id in tqdm(ids, desc="Top Layer Names"):
-            for layer in visit(root_elements[id], visit_types=["FRAME"], max=0):
-                is_text_not_empty(layer['name']) and f.write(
-                    layer['name'].strip() + '\n')
-        f.close()
+    # all artifacts are written at once, in a single pass over the samples.
+    # the results are consumed in the order of the directories (imap), so the output is deterministic regardless of the concurrency.
+    if dedupe:
+        counters = {artifact: ExternalCounter(max_items=max_memory_items, tmpdir=artifects_dir)
+                    for artifact in ARTIFACTS}
+    else:
+        files = {artifact: open(artifects_dir / f'{artifact}.txt', 'w')
+                 for artifact in ARTIFACTS}
+    try:
+        with Pool(concurrency) as pool:
+            for id, lines in tqdm(pool.imap(extract_file, directories), total=len(directories), desc='Extracting..'):
+                if lines is None:
+                    continue
+                for artifact, _lines in lines.items():
+                    if dedupe:
+                        counters[artifact].add_file(_lines)
+                    else:
+                        for line in _lines:
+                            files[artifact].write(line + '\n')
+
+        if dedupe:
+            for artifact, counter in counters.items():
+                with open(artifects_dir / f'{artifact}.counts.tsv', 'w') as f:
+                    for text, count, n_files in tqdm(counter.items(), desc=f'Merging {artifact}', leave=False):
+                        f.write(f'{text}\t{count}\t{n_files}\n')
+    finally:
+        if dedupe:
+            for counter in counters.values():
+                counter.close()
+        else:
+            for f in files.values():
+                f.close()
+
+
+@cli.command()
+@click.argument('samples', type=click.Path(exists=True), required=True)
+@click.option('--max', type=click.INT, default=None, required=False)
+@click.option('-c', '--concurrency', type=click.INT, default=cpu_count(), help='Number of processes to utilize')
+@click.option('-o', '--output', type=click.Path(file_okay=False), default='artifacts', help='Directory to write the summary.json to')
+@click.option('--cache', type=click.Path(file_okay=False), default='.cache/summary', help='Directory to cache the per-file aggregates (by file hash)')
+@click.option('--top', type=click.INT, default=10, help='Number of top items to print for each histogram')
+def summary(samples, max, concurrency, output, cache, top):
+    """
+    aggregated statistics of the samples (node types, depths, fonts, colors, image fills, sizes).
+    the per-file aggregates are cached, so re-running after adding files only processes the new files.
+    """
+    directories = list_samples(Path(samples), max=max)
+    paths = [find_document(d, 'file') for d in directories]
+    paths = [p for p in paths if p is not None]
+
+    cache = SummaryCache(cache)
+    total = empty()
+    n_cached = 0
+    n_failed = 0
+    try:
+        with Pool(concurrency) as pool:
+            tasks = [(p, cache.dir.parent, cache.known_hash(p)) for p in paths]
+            for path, hash, partial, cached, error in tqdm(pool.imap_unordered(summarize, tasks), total=len(tasks), desc='Summarizing..'):
+                if partial is None:
+                    # truncated / corrupted sample - skipped (and not cached, so it is retried next time)
+                    tqdm.write(f'☒ {path} - {error}')
+                    n_failed += 1
+                    continue
+                merge(total, partial)
+                cache.remember(path, hash)
+                n_cached += cached
+    finally:
+        cache.save()
+
+    tqdm.write(f'📊 {len(paths)} files ({n_cached} from cache, {n_failed} failed)')
+
+    artifects_dir = Path(output)
+    artifects_dir.mkdir(exist_ok=True)
+    with open(artifects_dir / 'summary.json', 'w') as f:
+        f.write(dumps(total))
+
+    files = total['files'] or 1
+    click.echo(f"files: {total['files']}")
+    click.echo(f"size: {total['size'] / (1024 * 1024):.2f} MB (avg. {total['size'] / files / (1024 * 1024):.2f} MB)")
+    click.echo(f"nodes: {total['nodes']} (avg. {total['nodes'] / files:.1f} per file)")
+    click.echo(f"image fills: {total['image_fills']} (avg. {total['image_fills'] / files:.1f} per file)")
+    for title, key, ordered in [
+        ('types', 'types', False),
+        ('depths', 'depths', True),
+        ('fonts', 'fonts', False),
+        ('colors', 'colors', False),
+        ('nodes per file (≤)', 'nodes_per_file', True),
+        ('file size (≤ bytes)', 'file_sizes', True),
+    ]:
+        counter = total[key]
+        if ordered:
+            items = sorted(counter.items(), key=lambda x: int(x[0]))
+        else:
+            items = counter.most_common(top)
+        click.echo(f'\n{title}')
+        for k, v in items:
+            click.echo(f'  {k:<24} {v}')
 
 
 if __name__ == '__main__':
-    main()
+    cli()
@@ -0,0 +1,175 @@
+import os
+import json
+import math
+import hashlib
+from pathlib import Path
+from collections import Counter
+from utils import walk
+from figma_core.document import iter_roots
+
+
+# bump this when the shape of the partial aggregates changes - invalidates the cache
+VERSION = 1
+
+# the counters (histograms) in the aggregates - everything else is a plain number
+COUNTERS = [
+    # (the keys are always strings, as they are stored as json)
+    'types',  # node type -> n
+    'depths',  # depth -> n
+    'fonts',  # font family -> n (text layers)
+    'colors',  # hex color -> n (solid fills)
+    'nodes_per_file',  # log2 bucket of the node count -> n files
+    'file_sizes',  # log2 bucket of the file size (bytes) -> n files
+]
+
+
+def file_hash(path, buffer_size=1024 * 1024):
+    """
+    sha1 of the file content - the key of the cached partial aggregates
+    """
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        while chunk := f.read(buffer_size):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def bucket(n):
+    """
+    log2 bucket of n - e.g. 1000 -> 1024 (1000 is in (512, 1024])
+    """
+    return 0 if n <= 0 else 2 ** math.ceil(math.log2(n))
+
+
+def hex6(color: dict):
+    return '#' + ''.join(f'{round(color.get(c, 0) * 255):02x}' for c in 'rgb')
+
+
+def file_summary(path):
+    """
+    the partial aggregates of a single file
+    """
+    summary = {
+        'files': 1,
+        'nodes': 0,
+        'size': os.path.getsize(path),
+        'image_fills': 0,
+        **{counter: Counter() for counter in COUNTERS},
+    }
+
+    for root, _ in iter_roots(path):
+        for node, depth in walk(root):
+            summary['nodes'] += 1
+            summary['types'][node.get('type')] += 1
+            summary['depths'][str(depth)] += 1
+
+            if node.get('type') == 'TEXT':
+                family = (node.get('style') or {}).get('fontFamily')
+                if family:
+                    summary['fonts'][family] += 1
+
+            for fill in node.get('fills') or []:
+                if not fill.get('visible', True):
+                    continue
+                if fill.get('type') == 'SOLID' and 'color' in fill:
+                    summary['colors'][hex6(fill['color'])] += 1
+                elif fill.get('type') == 'IMAGE':
+                    summary['image_fills'] += 1
+        del root
+
+    summary['nodes_per_file'][str(bucket(summary['nodes']))] += 1
+    summary['file_sizes'][str(bucket(summary['size']))] += 1
+    return summary
+
+
+def merge(a: dict, b: dict):
+    """
+    merges the partial aggregates b into a (in place)
+    """
+    for k, v in b.items():
+        if k in COUNTERS:
+            a.setdefault(k, Counter()).update(v)
+        else:
+            a[k] = a.get(k, 0) + v
+    return a
+
+
+def empty():
+    return {'files': 0, 'nodes': 0, 'size': 0, 'image_fills': 0, **{counter: Counter() for counter in COUNTERS}}
+
+
+def dumps(summary: dict):
+    return json.dumps(summary, separators=(',', ':'))
+
+
+def loads(txt: str):
+    data = json.loads(txt)
+    for counter in COUNTERS:
+        data[counter] = Counter(data.get(counter, {}))
+    return data
+
+
+class SummaryCache:
+    """
+    caches the partial aggregates of each file by its content hash, under `{dir}/{sha1}.json`.
+
+    the (size, mtime) of the files seen before are kept in `{dir}/index.json`, so unchanged files are not even re-hashed.
+    """
+
+    def __init__(self, dir):
+        self.dir = Path(dir) / f'v{VERSION}'
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.dir / 'index.json'
+        try:
+            with open(self.index_path, 'r') as f:
+                self.index = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.index = {}
+
+    def known_hash(self, path):
+        """
+        the cached hash of the file, if the file has not changed since (size, mtime)
+        """
+        stat = os.stat(path)
+        entry = self.index.get(str(Path(path).resolve()))
+        if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return entry[2]
+        return None
+
+    def remember(self, path, hash):
+        stat = os.stat(path)
+        self.index[str(Path(path).resolve())] = [
+            stat.st_size, stat.st_mtime_ns, hash]
+
+    def save(self):
+        tmp = self.index_path.with_suffix('.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp, self.index_path)
+
+
+def summarize(args):
+    """
+    process pool worker - returns (path, hash, partial aggregates, is_cached, error).
+    the partial aggregates are None (with the error) if the file cannot be read or parsed - nothing is cached for it.
+    """
+    path, cache_dir, hash = args
+    try:
+        hash = hash or file_hash(path)
+        cached = Path(cache_dir) / f'v{VERSION}' / f'{hash}.json'
+        if cached.exists():
+            try:
+                return path, hash, loads(cached.read_text()), True, None
+            except json.JSONDecodeError:
+                ...
+
+        summary = file_summary(path)
+    except Exception as e:
+        # (the parse errors of ijson span multiple lines)
+        message = (str(e).splitlines() or [''])[0]
+        return path, hash, None, False, f'{type(e).__name__}: {message}'
+
+    tmp = cached.with_suffix(f'.{os.getpid()}.tmp')
+    tmp.write_text(dumps(summary))
+    os.replace(tmp, cached)
+    return path, hash, summary, False, None
@@ -46,3 +46,47 @@ def flatten(lst):
         else:
             result.append(item)
     return result
+
+
+# the text artifacts extracted from the files (artifacts/{name}.txt)
+ARTIFACTS = [
+    'texts',  # text layers' text content
+    'layer-names',  # all layers' names (except text layers)
+    'layer-names-top',  # top layers' names (except text layers)
+    'layer-names-top-frames',  # top frames' names
+]
+
+
+def walk(layer, depth=0):
+    yield layer, depth
+    for child in layer.get('children', []):
+        yield from walk(child, depth=depth + 1)
+
+
+def extract_lines(layer: dict):
+    """
+    walks the top layer and its children once, and collects the lines for every artifact (see ARTIFACTS)
+    """
+    lines = {artifact: [] for artifact in ARTIFACTS}
+
+    for node, depth in walk(layer):
+        _type = node.get('type')
+        if _type is None:
+            continue
+
+        if _type == 'TEXT':
+            lines['texts'].append(node.get('characters', ''))
+            continue
+
+        name = node.get('name')
+        if not is_text_not_empty(name):
+            continue
+        name = name.strip()
+
+        lines['layer-names'].append(name)
+        if depth == 0:
+            lines['layer-names-top'].append(name)
+            if _type == 'FRAME':
+                lines['layer-names-top-frames'].append(name)
+
+    return lines
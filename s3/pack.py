@@ -0,0 +1,82 @@
+# packs the images and exports of each archive ({dir}/{key}/images|exports) to a single object per file key - {key}.pack (plain tar) + {key}.pack.json (the byte ranges of the members)
+# uploading (and serving) millions of small pngs as individual objects is dominated by the per-request overhead & cost.
+# with the packs, the uploads are one PUT per file key, and a single image is still one (ranged) GET.
+
+import os
+import sys
+from pathlib import Path
+from multiprocessing import Pool, cpu_count
+import click
+from tqdm import tqdm
+
+# for importing the shared figma_core package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from figma_core.pack import Pack, write_pack, is_packed
+
+
+def pack_archive(args):
+    archive, output, force = args
+    if not force and is_packed(archive, output):
+        return archive.name, 'skipped', None
+    try:
+        index = write_pack(archive, output)
+        if index is None:
+            return archive.name, 'empty', None
+        return archive.name, 'packed', index
+    except Exception as e:
+        return archive.name, 'failed', e
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.argument('dir', type=click.Path(exists=True, file_okay=False))
+@click.option('-o', '--output', default=None, type=click.Path(file_okay=False), help='The directory to write the packs to (defaults to {dir})')
+@click.option('-c', '--concurrency', type=click.INT, default=cpu_count(), help='Number of processes to utilize')
+@click.option('--force', is_flag=True, default=False, help='Re-pack the archives that are already packed (and up to date)')
+def pack(dir, output, concurrency, force):
+    """
+    packs {dir}/{key}/images|exports to {output}/{key}.pack (+ .pack.json index)
+    """
+    root = Path(dir)
+    output = Path(output or dir)
+    archives = sorted(d for d in root.iterdir() if d.is_dir())
+
+    counts = {'packed': 0, 'skipped': 0, 'empty': 0, 'failed': 0}
+    with Pool(concurrency) as pool:
+        for key, status, result in tqdm(pool.imap_unordered(pack_archive, [(a, output, force) for a in archives]), total=len(archives), desc='📦'):
+            counts[status] += 1
+            if status == 'failed':
+                tqdm.write(f'☒ {key} - {result}')
+
+    click.echo(', '.join(f'{n} {status}' for status, n in counts.items()))
+
+
+@cli.command()
+@click.argument('pack')
+@click.argument('names', nargs=-1, required=True)
+@click.option('-o', '--output', default='.', type=click.Path(file_okay=False), help='The directory to write the members to')
+def get(pack, names, output):
+    """
+    reads the members (by name - e.g. exports/1:2.png, or by node id / image hash) from a pack - a local path or an url
+    """
+    pack = Pack(pack)
+    os.makedirs(output, exist_ok=True)
+    for name in names:
+        members = [name] if name in pack else pack.stems.get(name, [])
+        if not members:
+            tqdm.write(f'☒ {name} - not found')
+            continue
+        for member in members:
+            path = Path(output) / Path(member).name
+            with open(path, 'wb') as f:
+                f.write(pack.read(member))
+            tqdm.write(f'☑ {member} → {path}')
+
+
+if __name__ == '__main__':
+    cli()
@@ -1,22 +1,28 @@
 # this is a file syncer, which you can specify your own file pattern with wildcards to selectively upload files to s3
 # this is useful when...
 # - .json.gz types' content type and encoding must be specified
+# - images must be uploaded with their content type and cache headers
 # - one-time-modifications are required.
-# in most cases, you may want to use awscli's s3 sync instead - it's more efficient and optimized.
-# this script does not have diff checking, so it will upload all files every time.
+# only the new or changed files are uploaded - the local files are compared with the bucket listing by size / ETag (--diff).
+# the md5 of the local files are cached in a manifest (--manifest), so unchanged files are not re-hashed on the next sync.
 
 import os
-import glob
+import json
 import click
 import boto3
+import fnmatch
+import mimetypes
+import hashlib
 import logging
 import queue
 import threading
 from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor
+from boto3.s3.transfer import TransferConfig
+from s3transfer.manager import TransferManager
+from botocore.config import Config
 from botocore.exceptions import NoCredentialsError
 
-s3 = boto3.client('s3')
-
 # Setup logging
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -26,97 +32,319 @@ logger.addHandler(handler)
 
 
 DEFAULT_HEADERS = {
-    'Cache-Control': 'public, max-age=2592000',
+    'CacheControl': 'public, max-age=2592000',
+}
+
+# the images are never modified in place (re-archived images are new versions), so they can be cached longer
+IMAGE_HEADERS = {
+    'CacheControl': 'public, max-age=31536000',
 }
 
+CONTENT_TYPES = {
+    '.json': 'application/json',
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.gif': 'image/gif',
+    '.webp': 'image/webp',
+    '.avif': 'image/avif',
+    '.svg': 'image/svg+xml',
+    '.pdf': 'application/pdf',
+    # the archive packs (see pack.py)
+    '.pack': 'application/x-tar',
+}
+
+# never uploaded
+IGNORE = ['.DS_Store']
+
+MB = 1024 * 1024
+
+# files larger than this are uploaded with multipart, in chunks of this size.
+# the ETag of the multipart uploads depends on the chunk size, so changing this will cause a re-upload of the large files once (with --diff=etag).
+MULTIPART_CHUNKSIZE = 64 * MB
+
+
+def transfer_config(concurrency=10):
+    return TransferConfig(
+        multipart_threshold=MULTIPART_CHUNKSIZE,
+        multipart_chunksize=MULTIPART_CHUNKSIZE,
+        max_concurrency=concurrency,
+        # the small files (images) are read at once, the large ones are streamed in parts
+        io_chunksize=1 * MB,
+    )
+
+
+def local_etag(filepath, chunksize=MULTIPART_CHUNKSIZE):
+    """
+    computes the ETag s3 would give to the file uploaded with the given chunk size
+    - md5 of the file for single part uploads
+    - md5 of the concatenated md5s of the parts, suffixed with -{n parts} for multipart uploads
+    """
+    md5s = []
+    with open(filepath, 'rb') as f:
+        while True:
+            chunk = f.read(chunksize)
+            if not chunk:
+                break
+            md5s.append(hashlib.md5(chunk))
+
+    if len(md5s) == 0:
+        return hashlib.md5(b'').hexdigest()
+    if len(md5s) == 1:
+        return md5s[0].hexdigest()
+    return hashlib.md5(b''.join(m.digest() for m in md5s)).hexdigest() + f'-{len(md5s)}'
+
+
+def list_remote(s3, bucket, prefix='', concurrency=16):
+    """
+    lists the objects under the prefix as {key: (size, etag)}.
+
+    the first level of the prefix is listed with the delimiter, then each sub-prefix is listed (paginated) in parallel.
+    """
+    objects = {}
+    paginator = s3.get_paginator('list_objects_v2')
+
+    def list_prefix(prefix, delimiter=None):
+        found = {}
+        subprefixes = []
+        kwargs = {'Bucket': bucket, 'Prefix': prefix}
+        if delimiter:
+            kwargs['Delimiter'] = delimiter
+        for page in paginator.paginate(**kwargs):
+            for obj in page.get('Contents', []):
+                found[obj['Key']] = (obj['Size'], obj['ETag'].strip('"'))
+            for p in page.get('CommonPrefixes', []):
+                subprefixes.append(p['Prefix'])
+        return found, subprefixes
+
+    top, subprefixes = list_prefix(prefix, delimiter='/')
+    objects.update(top)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for found, _ in tqdm(executor.map(list_prefix, subprefixes), total=len(subprefixes), desc='☁️ listing', leave=False):
+            objects.update(found)
+
+    return objects
+
+
+class SyncManifest:
+    """
+    local cache of the md5 (ETag) of the files - {key: [size, mtime_ns, etag]}.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path, 'r') as f:
+                self.entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.entries = {}
+
+    def etag(self, key, filepath):
+        """
+        the ETag of the local file - from the cache if the file has not changed since (size, mtime), otherwise computed.
+        """
+        stat = os.stat(filepath)
+        entry = self.entries.get(key)
+        if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return entry[2]
+        etag = local_etag(filepath)
+        with self.lock:
+            self.entries[key] = [stat.st_size, stat.st_mtime_ns, etag]
+        return etag
+
+    def save(self):
+        if self.path is None:
+            return
+        with self.lock:
+            tmp = f'{self.path}.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self.entries, f)
+            os.replace(tmp, self.path)
+
+
+def is_changed(key, filepath, remote, diff, manifest: SyncManifest):
+    """
+    rather if the local file is different from the remote object (or the object does not exist)
+    """
+    if diff == 'none':
+        return True
+    if key not in remote:
+        return True
+    size, etag = remote[key]
+    if os.path.getsize(filepath) != size:
+        return True
+    if diff == 'size':
+        return False
+    return manifest.etag(key, filepath) != etag
+
+
+def headers(filepath):
+    """
+    the content type, encoding and cache headers for the file, by its extension
+    """
+    name = os.path.basename(filepath).lower()
+    if name.endswith('.json.gz'):
+        return {'ContentType': 'application/json', 'ContentEncoding': 'gzip', **DEFAULT_HEADERS}
+    ext = os.path.splitext(name)[1]
+    if ext in CONTENT_TYPES:
+        content_type = CONTENT_TYPES[ext]
+    else:
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    if content_type.startswith('image/') or ext == '.pdf':
+        return {'ContentType': content_type, **IMAGE_HEADERS}
+    return {'ContentType': content_type, **DEFAULT_HEADERS}
+
+
+def walk(folder, pattern):
+    """
+    yields the files under the folder matching the pattern (by name), while walking the directory tree - without listing the whole tree first.
+    the symlinked directories (e.g. the sampler's --link outputs) are followed, each directory is visited once (no cycles).
+    """
+    stack = [folder]
+    visited = set()
+    while stack:
+        directory = stack.pop()
+        try:
+            stat = os.stat(directory)
+            if (stat.st_dev, stat.st_ino) in visited:
+                continue
+            visited.add((stat.st_dev, stat.st_ino))
+            with os.scandir(directory) as it:
+                dirs = []
+                for entry in it:
+                    if entry.is_dir():
+                        dirs.append(entry.path)
+                    elif entry.name not in IGNORE and fnmatch.fnmatch(entry.name, pattern):
+                        yield entry.path
+                # walk in (reversed) order, so the sub directories are visited in name order
+                stack.extend(sorted(dirs, reverse=True))
+        except (PermissionError, FileNotFoundError) as e:
+            logger.info(e.filename)
+
 
 class UploadWorker(threading.Thread):
-    def __init__(self, upload_queue, local_folder, bucket, pbar):
+    """
+    takes the files from the queue, checks if they are changed (see `is_changed`) and uploads them with the transfer manager.
+    """
+
+    def __init__(self, transfer: TransferManager, upload_queue, local_folder, bucket, pbar, prefix='', remote={}, diff='etag', manifest: SyncManifest = None, dry_run=False):
         threading.Thread.__init__(self)
+        self.transfer = transfer
         self.upload_queue = upload_queue
         self.local_folder = local_folder
         self.bucket = bucket
         self.pbar = pbar
+        self.prefix = prefix
+        self.remote = remote
+        self.diff = diff
+        self.manifest = manifest
+        self.dry_run = dry_run
+        self.uploaded = 0
 
     def run(self):
         while True:
             filepath = self.upload_queue.get()
             if filepath is None:
+                self.upload_queue.task_done()
                 break
-            self.upload_file(filepath)
-            self.upload_queue.task_done()
+            try:
+                self.upload_file(filepath)
+            except Exception as e:
+                tqdm.write(f'☒ {filepath} - {e}')
+                logger.info(filepath)  # Log the failed file
+            finally:
+                self.pbar.update()
+                self.upload_queue.task_done()
 
     def upload_file(self, filepath):
-        with open(filepath, 'rb') as data:
-            # Create the key by removing the local_folder prefix from the filepath
-            key = os.path.relpath(filepath, self.local_folder)
+        key = to_key(filepath, self.local_folder, self.prefix)
+        if not is_changed(key, filepath, self.remote, self.diff, self.manifest):
+            return
+        if not self.dry_run:
             try:
-                if filepath.endswith('.json.gz'):
-                    s3.upload_fileobj(data, self.bucket, key,
-                                      ExtraArgs={'ContentType': 'application/json', 'ContentEncoding': 'gzip', **DEFAULT_HEADERS})
-                elif filepath.endswith('.json'):
-                    s3.upload_fileobj(data, self.bucket, key,
-                                      ExtraArgs={'ContentType': 'application/json', **DEFAULT_HEADERS})
-                else:
-                    # skip
-                    self.pbar.update()
-                    return
+                self.transfer.upload(filepath, self.bucket, key,
+                                     extra_args=headers(filepath)).result()
             except FileNotFoundError:
                 logger.info(filepath)  # Log the failed file
-            self.pbar.update()
+                return
+        # counted once uploaded (the failures raise, see run)
+        self.uploaded += 1
+
+
+def to_key(filepath, local_folder, prefix=''):
+    # Create the key by removing the local_folder prefix from the filepath
+    return prefix + os.path.relpath(filepath, local_folder).replace(os.sep, '/')
 
 
 @click.command()
 @click.argument('local_folder', type=click.Path(exists=True, file_okay=False))
 @click.argument('bucket', type=str)
-@click.option('--pattern', default='*.json*', help='The pattern of files to match.')
+@click.option('--pattern', default='*.json*', help='The pattern of files (names) to match. e.g. "*" for all files, "*.png" for png images')
+@click.option('--prefix', default='', help='The key prefix to upload the files under (e.g. "files/")')
 @click.option('-c', '--concurrency', default=64, help='The number of worker threads to use.')
-def sync_files(local_folder, bucket, pattern, concurrency):
+@click.option('--diff', default='etag', type=click.Choice(['etag', 'size', 'none']), help='How to detect changed files - etag (size & md5), size (size only), none (upload all)')
+@click.option('--manifest', default=None, type=click.Path(dir_okay=False), help='Path to the manifest caching the md5 of the local files (defaults to ./.s3sync.{bucket}.json)')
+@click.option('--endpoint-url', default=None, help='Custom S3 endpoint (e.g. MinIO or a moto server for testing)')
+@click.option('--dry-run', is_flag=True, default=False, help='Only print the number of files to upload')
+@click.option('-y', '--yes', is_flag=True, default=False, help='Do not ask for confirmation')
+def sync_files(local_folder, bucket, pattern, prefix, concurrency, diff, manifest, endpoint_url, dry_run, yes):
+    # the connection pool is sized to the concurrency, so the workers don't wait for a connection
+    s3 = boto3.client('s3', endpoint_url=endpoint_url, config=Config(
+        max_pool_connections=concurrency))
+
     # Normalize local_folder to ensure it ends with '/'
     local_folder = os.path.join(local_folder, "")
-    local_pattern = local_folder + '**/' + pattern
-    # Generate a list of files to upload
-    files = [f for f in glob.glob(local_pattern, recursive=True)]
 
-    if len(files) == 0:
-        click.echo(
-            f'No files found matching pattern "{pattern}" - "{local_pattern}".')
+    # Check for AWS credentials before starting the process
+    try:
+        s3.list_buckets()
+    except NoCredentialsError:
+        click.echo("No AWS credentials found.")
         return
 
-    click.echo(
-        f'Found {len(files)} files to upload (matching pattern "{pattern}").')
     # ask if to continue
-    if click.confirm('Do you want to continue?'):
+    if dry_run or yes or click.confirm(f'Do you want to upload the new or changed files matching pattern "{pattern}" under "{local_folder}" to s3://{bucket}/{prefix}?'):
         pass
     else:
         return
 
-    # Check for AWS credentials before starting the process
+    manifest = SyncManifest(
+        manifest or f'.s3sync.{bucket.replace("/", "_")}.json')
+
+    remote = {} if diff == 'none' else list_remote(
+        s3, bucket, prefix, concurrency=concurrency)
+    click.echo(f'Found {len(remote)} objects in s3://{bucket}/{prefix}')
+
+    # the walk is streamed into the (bounded) queue - the uploads start right away, with constant memory
+    upload_queue = queue.Queue(maxsize=concurrency * 16)
+    transfer = TransferManager(s3, transfer_config(concurrency))
+
     try:
-        s3.list_buckets()
-    except NoCredentialsError:
-        click.echo("No AWS credentials found.")
-        return
+        with tqdm(desc='☁️', unit='files') as pbar:
+            # Start worker threads
+            workers = []
+            for _ in range(concurrency):
+                worker = UploadWorker(transfer, upload_queue, local_folder, bucket, pbar, prefix=prefix,
+                                      remote=remote, diff=diff, manifest=manifest, dry_run=dry_run)
+                worker.start()
+                workers.append(worker)
+            # Enqueue files to upload
+            for filepath in walk(local_folder, pattern):
+                upload_queue.put(filepath)
+            # Stop worker threads
+            for _ in range(concurrency):
+                upload_queue.put(None)
+            for worker in workers:
+                worker.join()
+    finally:
+        transfer.shutdown()
+        manifest.save()
 
-    upload_queue = queue.Queue()
-
-    with tqdm(total=len(files)) as pbar:
-        # Start worker threads
-        workers = []
-        for _ in range(concurrency):
-            worker = UploadWorker(upload_queue, local_folder, bucket, pbar)
-            worker.start()
-            workers.append(worker)
-        # Enqueue files to upload
-        for filepath in files:
-            upload_queue.put(filepath)
-        # Block until all tasks are done
-        upload_queue.join()
-        # Stop worker threads
-        for _ in range(concurrency):
-            upload_queue.put(None)
-        for worker in workers:
-            worker.join()
+    uploaded = sum(worker.uploaded for worker in workers)
+    click.echo(
+        f'{"Found" if dry_run else "Uploaded"} {uploaded} new or changed files (of {pbar.n} files matching pattern "{pattern}").')
 
 
 if __name__ == "__main__":
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# the tools are standalone scripts - the shared figma_core package (the repo root) and the script directories are importable
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+for path in [ROOT, os.path.join(ROOT, 's3'), os.path.join(ROOT, 'figma_sampler')]:
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,148 @@
+import io
+import os
+import struct
+
+import pytest
+from PIL import Image, features
+
+from figma_core import imagesize
+
+
+def save(tmp_path, name, size=(123, 45), **kwargs):
+    path = tmp_path / name
+    Image.new("RGB", size, (200, 30, 90)).save(path, **kwargs)
+    return path
+
+
+@pytest.mark.parametrize("name, kwargs, format", [
+    ("a.png", {}, "png"),
+    ("a.gif", {}, "gif"),
+    ("a.jpg", {}, "jpeg"),
+    ("progressive.jpg", {"progressive": True}, "jpeg"),
+    ("lossy.webp", {"quality": 80}, "webp"),
+    ("lossless.webp", {"lossless": True}, "webp"),
+])
+def test_probe(tmp_path, name, kwargs, format):
+    path = save(tmp_path, name, **kwargs)
+    assert imagesize.probe(path) == imagesize.ImageInfo(format, 123, 45)
+    assert imagesize.dimensions(path) == (123, 45)
+    assert imagesize.is_valid(path)
+
+
+def test_probe_webp_extended(tmp_path):
+    # VP8X - with an alpha channel (and the exif)
+    path = tmp_path / "alpha.webp"
+    Image.new("RGBA", (300, 20), (0, 0, 0, 128)).save(path, exif=Image.Exif())
+    with open(path, "rb") as f:
+        assert f.read(16)[12:16] == b"VP8X"
+    assert imagesize.probe(path) == ("webp", 300, 20)
+    assert imagesize.is_valid(path)
+
+
+def test_probe_progressive_jpeg_frame(tmp_path):
+    path = save(tmp_path, "progressive.jpg", size=(640, 480), progressive=True)
+    data = path.read_bytes()
+    # SOF2, after the (large) quantization tables - beyond the header bytes read at once
+    assert b"\xff\xc2" in data and b"\xff\xc0" not in data
+    assert imagesize.dimensions(path) == (640, 480)
+
+
+def test_probe_jpeg_padded_markers(tmp_path):
+    data = save(tmp_path, "a.jpg", size=(64, 32)).read_bytes()
+    # the fill bytes (0xFF) before a marker are allowed
+    padded = data[:2] + b"\xff\xff\xff" + data[2:]
+    path = tmp_path / "padded.jpg"
+    path.write_bytes(padded)
+    assert imagesize.dimensions(path) == (64, 32)
+
+
+def test_probe_not_an_image(tmp_path):
+    path = tmp_path / "a.txt"
+    path.write_bytes(b"hello world" * 10)
+    assert imagesize.probe(path) is None
+    assert imagesize.probe(tmp_path / "missing.png") is None
+    assert not imagesize.is_valid(path)
+
+
+def test_probe_is_cached_by_mtime(tmp_path):
+    path = save(tmp_path, "a.png")
+    assert imagesize.dimensions(path) == (123, 45)
+    stat = os.stat(path)
+    Image.new("RGB", (10, 20)).save(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert imagesize.dimensions(path) == (10, 20)
+
+
+@pytest.mark.parametrize("name", ["a.png", "a.gif", "a.jpg", "a.webp"])
+def test_truncated_images_are_not_complete(tmp_path, name):
+    data = save(tmp_path, name, size=(256, 256)).read_bytes()
+    path = tmp_path / f"truncated-{name}"
+    path.write_bytes(data[:len(data) - 10])
+    # the header is still readable
+    assert imagesize.dimensions(path) == (256, 256)
+    assert not imagesize.is_complete(path)
+    assert not imagesize.is_valid(path)
+
+
+def test_jpeg_padded_after_eoi_is_complete(tmp_path):
+    data = save(tmp_path, "a.jpg").read_bytes()
+    path = tmp_path / "trailing.jpg"
+    path.write_bytes(data + b"\x00" * 16)
+    assert imagesize.is_valid(path)
+
+
+def test_zero_dimensions_are_not_valid(tmp_path):
+    buf = io.BytesIO()
+    Image.new("RGB", (1, 1)).save(buf, "PNG")
+    data = bytearray(buf.getvalue())
+    # IHDR width = 0 (the crc is not checked)
+    data[16:20] = struct.pack(">I", 0)
+    path = tmp_path / "zero.png"
+    path.write_bytes(bytes(data))
+    assert imagesize.dimensions(path) == (0, 1)
+    assert not imagesize.is_valid(path)
+
+
+@pytest.mark.parametrize("format, data, valid", [
+    ("svg", b'<svg xmlns="http://www.w3.org/2000/svg"></svg>\n', True),
+    ("svg", b'\xef\xbb\xbf<?xml version="1.0"?>\n<svg></svg>', True),
+    ("svg", b'<svg xmlns="http://www.w3.org/2000/svg"><rect/>', False),
+    ("svg", b'{"err": "not found"}', False),
+    ("pdf", b"%PDF-1.3\n...\n%%EOF\n", True),
+    ("pdf", b"%PDF-1.3\n...\n%%EOF\n" + b"\x00" * 100, True),
+    ("pdf", b"%PDF-1.3\n...\n", False),
+    ("pdf", b"<html></html>", False),
+])
+def test_is_valid_vector(tmp_path, format, data, valid):
+    path = tmp_path / f"a.{format}"
+    path.write_bytes(data)
+    assert imagesize.is_valid_vector(path, format) is valid
+
+
+def test_is_valid_vector_missing_file(tmp_path):
+    assert not imagesize.is_valid_vector(tmp_path / "missing.svg", "svg")
+
+
+avif_codec = pytest.mark.skipif(not features.check("avif"), reason="no avif codec")
+
+
+@avif_codec
+@pytest.mark.parametrize("mode", ["RGB", "RGBA"])
+def test_probe_avif(tmp_path, mode):
+    path = tmp_path / "a.avif"
+    # the alpha plane is an auxiliary image (with its own ispe)
+    Image.new(mode, (123, 45)).save(path)
+    assert imagesize.probe(path) == ("avif", 123, 45)
+    assert imagesize.is_valid(path)
+
+    truncated = tmp_path / "truncated.avif"
+    truncated.write_bytes(path.read_bytes()[:-10])
+    assert imagesize.dimensions(truncated) == (123, 45)
+    assert not imagesize.is_valid(truncated)
+
+
+def test_probe_other_isobmff_brands(tmp_path):
+    # e.g. an mp4 - ftyp, but not an avif brand
+    path = tmp_path / "a.mp4"
+    path.write_bytes(struct.pack(">I4s4sI4s", 20, b"ftyp", b"isom", 0, b"mp41") + b"\x00" * 64)
+    assert imagesize.probe(path) is None
@@ -0,0 +1,133 @@
+import math
+import os
+import tempfile
+
+import pytest
+from PIL import Image
+
+from figma_core import imagesize
+from figma_core.optimize import FillSizePlan, image_paint_map, optimized_image_paint_map, transcode_image, avif_supported
+
+
+def node(id, width, height, paint, scale=(1, 1)):
+    return {
+        "id": id,
+        "type": "RECTANGLE",
+        "relativeTransform": [[scale[0], 0, 0], [0, scale[1], 0]],
+        "size": {"x": width, "y": height},
+        "fills": [paint],
+    }
+
+
+def paint_map(*nodes):
+    return image_paint_map({"id": "0:0", "type": "DOCUMENT", "children": list(nodes)})
+
+
+def fill(mode, **kwargs):
+    return {"type": "IMAGE", "imageRef": "img", "scaleMode": mode, **kwargs}
+
+
+def test_fill_covers_the_node():
+    plan = FillSizePlan(paint_map(node("1:1", 100, 100, fill("FILL"))))
+    assert plan.max_size("img", (1000, 500)) == (200, 100)
+
+
+def test_fit_is_contained_in_the_node():
+    plan = FillSizePlan(paint_map(node("1:1", 100, 100, fill("FIT"))))
+    assert plan.max_size("img", (1000, 500)) == (100, 50)
+
+
+def test_tile_scales_the_image():
+    plan = FillSizePlan(paint_map(node("1:1", 100, 100, fill("TILE", scalingFactor=0.5))))
+    assert plan.max_size("img", (1000, 500)) == (500, 250)
+
+
+def test_stretch_applies_the_image_transform():
+    paint = fill("STRETCH", imageTransform=[[0.25, 0, 0], [0.1, 0.3, 0]])
+    plan = FillSizePlan(paint_map(node("1:1", 100, 100, paint)))
+    assert plan.max_size("img", (1000, 500)) == (250, math.ceil(0.1 * 1000 + 0.3 * 500))
+
+
+def test_node_scale_is_applied():
+    plan = FillSizePlan(paint_map(node("1:1", 100, 100, fill("FIT"), scale=(2, 2))))
+    assert plan.max_size("img", (1000, 500)) == (200, 100)
+
+
+def test_targets_are_clamped_to_the_image_size():
+    plan = FillSizePlan(paint_map(node("1:1", 4000, 4000, fill("FILL"))))
+    assert plan.max_size("img", (1000, 500)) == (1000, 500)
+
+
+def test_max_over_all_the_usages():
+    plan = FillSizePlan(paint_map(
+        node("1:1", 100, 100, fill("FIT")),
+        node("1:2", 300, 50, fill("FIT")),
+        node("1:3", 10, 10, fill("TILE", scalingFactor=0.2)),
+    ))
+    # FIT 100x100 -> (100, 50), FIT 300x50 -> (100, 50), TILE 0.2 -> (200, 100)
+    assert plan.max_size("img", (1000, 500)) == (200, 100)
+    assert plan.max_sizes({"img": (1000, 500)}) == {"img": (200, 100)}
+
+
+def test_max_sizes_per_hash():
+    other = {**fill("FIT"), "imageRef": "other"}
+    plan = FillSizePlan(paint_map(
+        node("1:1", 100, 100, fill("FILL")),
+        node("1:2", 50, 50, other),
+    ))
+    assert plan.max_sizes({"img": (1000, 500), "other": (200, 400)}) == {
+        "img": (200, 100),
+        "other": (25, 50),
+    }
+    # only the images with a known size
+    assert plan.max_sizes({"other": (200, 400)}) == {"other": (25, 50)}
+
+
+def test_unsizable_usages_are_skipped():
+    plan = FillSizePlan(paint_map(
+        node("1:1", 100, 100, fill("TILE")),  # no scalingFactor
+        node("1:2", 100, 100, fill("STRETCH")),  # no imageTransform
+        node("1:3", None, 100, fill("FILL")),
+        node("1:4", 100, 100, fill("CROP")),
+    ))
+    assert plan.max_size("img", (1000, 500)) == (0, 0)
+    assert plan.max_sizes({"img": (1000, 500)}) == {"img": (0, 0)}
+
+
+def test_optimized_image_paint_map_reads_the_image_headers(tmp_path):
+    path = tmp_path / "img.png"
+    Image.new("RGB", (1000, 500)).save(path)
+    missing = tmp_path / "missing.png"
+    other = {**fill("FIT"), "imageRef": "other"}
+
+    result = optimized_image_paint_map(
+        paint_map(node("1:1", 100, 100, fill("FILL")), node("1:2", 100, 100, other)),
+        {"img": str(path), "other": str(missing)},
+    )
+    assert result["img"]["max"] == {"width": 200, "height": 100}
+    assert "max" not in result["other"]
+
+
+@pytest.mark.parametrize("format", ["webp", pytest.param("avif", marks=pytest.mark.skipif(not avif_supported(), reason="no avif codec"))])
+def test_transcode_image(tmp_path, monkeypatch, format):
+    path = tmp_path / "a.png"
+    Image.effect_noise((64, 64), 40).convert("RGB").resize((256, 256)).save(path)
+
+    temporary = []
+    mkstemp = tempfile.mkstemp
+
+    def spy(*args, **kwargs):
+        fd, name = mkstemp(*args, **kwargs)
+        temporary.append(os.path.basename(name))
+        return fd, name
+    monkeypatch.setattr(tempfile, "mkstemp", spy)
+
+    transcoded, saved, out = transcode_image(path, format=format, quality=80)
+    assert transcoded and saved > 0
+    assert out == tmp_path / f"a.{format}"
+    assert imagesize.probe(out) == (format, 256, 256)
+    assert imagesize.is_valid(out)
+    # written to a hidden, non-graphic file first
+    assert len(temporary) == 1
+    assert temporary[0].startswith(".a.") and temporary[0].endswith(".part")
+    assert sorted(os.listdir(tmp_path)) == sorted(["a.png", f"a.{format}"])
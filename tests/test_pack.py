@@ -0,0 +1,119 @@
+import os
+import tarfile
+
+import pytest
+
+from figma_core.pack import Pack, write_pack, is_packed, pack_paths
+
+
+@pytest.fixture
+def archive(tmp_path):
+    """
+    an archive ({dir}/{key}) with members around the tar block boundaries, an empty one and a long (pax header) name
+    """
+    archive = tmp_path / 'archives' / 'key'
+    files = {
+        'images/empty.png': b'',
+        'images/a.png': os.urandom(1),
+        'images/b.png': os.urandom(511),
+        'images/c.png': os.urandom(512),
+        'images/d.png': os.urandom(513),
+        'exports/1:2.png': os.urandom(5000),
+        'exports/1:2@2x.png': os.urandom(7000),
+        f"exports/{'9' * 150}:1.png": os.urandom(100),
+    }
+    for name, data in files.items():
+        path = archive / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+    # not packed
+    (archive / 'exports' / '.hidden').write_bytes(b'x')
+    (archive / 'meta.json').write_bytes(b'{}')
+    return archive, files
+
+
+def test_index_offsets_match_the_tar(archive, tmp_path):
+    archive, files = archive
+    index = write_pack(archive, tmp_path / 'packs')
+    pack_path, index_path = pack_paths(tmp_path / 'packs', 'key')
+
+    assert index['key'] == 'key'
+    assert index_path.exists()
+    assert sorted(index['entries']) == sorted(files)
+    assert index['size'] == os.path.getsize(pack_path)
+
+    # the pack is a plain tar - the offsets are the data offsets of its members
+    with tarfile.open(pack_path) as tar:
+        for member in tar.getmembers():
+            assert index['entries'][member.name] == [member.offset_data, member.size]
+
+
+def test_read_members(archive, tmp_path):
+    archive, files = archive
+    write_pack(archive, tmp_path / 'packs')
+    pack = Pack(tmp_path / 'packs' / 'key.pack')
+
+    for name, data in files.items():
+        assert pack.read(name) == data
+    assert 'images/a.png' in pack
+    assert pack.get('1:2', section='exports') == files['exports/1:2.png']
+    assert pack.get('b') == files['images/b.png']
+    assert pack.get('missing') is None
+
+
+class Response:
+    def __init__(self, content, status_code):
+        self.content = content
+        self.status_code = status_code
+
+    def raise_for_status(self):
+        pass
+
+
+class RangeSession:
+    """
+    serves the pack - honoring the range header (206), or ignoring it (200, the whole pack)
+    """
+
+    def __init__(self, data, ranges=True):
+        self.data = data
+        self.ranges = ranges
+        self.requests = []
+
+    def get(self, url, headers=None):
+        self.requests.append(headers)
+        if self.ranges and headers and 'Range' in headers:
+            start, end = headers['Range'][len('bytes='):].split('-')
+            return Response(self.data[int(start):int(end) + 1], 206)
+        return Response(self.data, 200)
+
+
+@pytest.mark.parametrize('ranges', [True, False])
+def test_read_remote_members(archive, tmp_path, ranges):
+    archive, files = archive
+    index = write_pack(archive, tmp_path / 'packs')
+    session = RangeSession((tmp_path / 'packs' / 'key.pack').read_bytes(), ranges=ranges)
+    pack = Pack('https://example.com/packs/key.pack', index=index, session=session)
+
+    for name, data in files.items():
+        assert pack.read(name) == data
+    # a single request per (non empty) member
+    assert len(session.requests) == len(files) - 1
+
+
+def test_is_packed(archive, tmp_path):
+    archive, _ = archive
+    output = tmp_path / 'packs'
+    assert not is_packed(archive, output)
+    write_pack(archive, output)
+    assert is_packed(archive, output)
+
+    # a new file in a section after packing
+    (archive / 'images' / 'new.png').write_bytes(b'x')
+    os.utime(archive / 'images', (os.path.getmtime(pack_paths(output, 'key')[1]) + 10,) * 2)
+    assert not is_packed(archive, output)
+
+
+def test_nothing_to_pack(tmp_path):
+    (tmp_path / 'key').mkdir()
+    assert write_pack(tmp_path / 'key', tmp_path / 'packs') is None
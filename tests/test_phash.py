@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from figma_core import phash
+
+
+def flip(hash, bits):
+    for bit in bits:
+        hash ^= 1 << bit
+    return hash
+
+
+def brute_pairs(hashes, distance):
+    return {
+        (i, j)
+        for i in range(len(hashes))
+        for j in range(i + 1, len(hashes))
+        if bin(int(hashes[i]) ^ int(hashes[j])).count("1") <= distance
+    }
+
+
+@pytest.fixture
+def hashes():
+    rng = np.random.default_rng(7)
+    base = [int(h) for h in rng.integers(0, 2**63, size=60, dtype=np.uint64) * np.uint64(2)]
+    near = []
+    for n, h in enumerate(base[:40]):
+        d = 1 + n % 8
+        # the flipped bits spread over the bands as evenly as possible - the worst case of the multi-index
+        bits = [(b % phash.BANDS) * phash.BAND_BITS + b // phash.BANDS for b in range(d)]
+        near.append(flip(h, bits))
+    # identical hashes
+    near += base[:3]
+    return np.array(base + near, dtype=np.uint64)
+
+
+def test_hamming():
+    a = np.array([0, 0b1011, 2**64 - 1], dtype=np.uint64)
+    assert list(phash.hamming(a, np.uint64(0))) == [0, 3, 64]
+    assert phash.hamming(np.uint64(0b1100), np.uint64(0b0110)) == 2
+
+
+def test_bands():
+    hash = 0x0004_0003_0002_0001
+    assert phash.bands(np.array([hash], dtype=np.uint64)).tolist() == [[1, 2, 3, 4]]
+
+
+@pytest.mark.parametrize("distance", [0, 3, 4, 5, 7])
+def test_pairs_match_brute_force(hashes, distance):
+    i, j, d = phash.HashIndex(hashes).pairs(distance)
+    assert set(zip(i.tolist(), j.tolist())) == brute_pairs(hashes, distance)
+    assert (d == phash.hamming(hashes[i], hashes[j])).all()
+
+
+@pytest.mark.parametrize("distance", [3, 5, 7])
+def test_query_matches_brute_force(hashes, distance):
+    index = phash.HashIndex(hashes)
+    for hash in hashes[::7]:
+        expected = {n for n, h in enumerate(hashes) if bin(int(h) ^ int(hash)).count("1") <= distance}
+        found = index.query(int(hash), distance)
+        assert set(found.tolist()) == expected
+        # by the distance
+        assert (np.diff(phash.hamming(hashes[found], hash)) >= 0).all()
+
+
+def test_distance_limit(hashes):
+    with pytest.raises(ValueError):
+        phash.HashIndex(hashes).pairs(2 * phash.BANDS)
+
+
+def test_clusters():
+    a = 0x0123_4567_89AB_CDEF
+    b = 0xFEDC_BA98_7654_3210
+    hashes = np.array([a, b, flip(a, [0, 20]), a, flip(flip(a, [0, 20]), [40, 60]), flip(b, [63]), 0], dtype=np.uint64)
+    clusters = sorted(sorted(c.tolist()) for c in phash.clusters(hashes, distance=2))
+    # a - a+2 - a+4 are chained (connected within the distance), 0 has no near-duplicate
+    assert clusters == [[0, 2, 3, 4], [1, 5]]
+    assert phash.clusters(np.array([a, b], dtype=np.uint64)) == []
+
+
+def test_dhash_of_a_resized_image(tmp_path):
+    gradient = np.tile(np.arange(256, dtype=np.uint8), (128, 1))
+    gradient[:, 100:140] = 0
+    image = Image.fromarray(gradient)
+    image.save(tmp_path / "a.png")
+    image.resize((64, 32)).save(tmp_path / "small.png")
+    Image.fromarray(255 - gradient).save(tmp_path / "inverted.png")
+
+    a = phash.dhash(tmp_path / "a.png")
+    assert phash.hamming(np.uint64(a), np.uint64(phash.dhash(tmp_path / "small.png"))) <= 2
+    assert phash.hamming(np.uint64(a), np.uint64(phash.dhash(tmp_path / "inverted.png"))) > 32
+
+
+def test_index_round_trip(tmp_path):
+    path = tmp_path / "index.npz"
+    assert len(phash.load_index(path)["hashes"]) == 0
+    phash.save_index(path, tmp_path, ["a.png", "b/c.png"], [1, 2**64 - 1], [10, 20])
+    index = phash.load_index(path)
+    assert index["root"] == str(tmp_path)
+    assert index["paths"].tolist() == ["a.png", "b/c.png"]
+    assert index["hashes"].tolist() == [1, 2**64 - 1]
+    assert index["mtimes"].tolist() == [10, 20]
@@ -0,0 +1,141 @@
+import logging
+from urllib.parse import urlencode
+
+import requests
+
+from figma_core.client import FigmaAPIError
+from figma_core.renders import chunk, ChunkSizer, interleave, fetch_node_images, is_render_error, load_instance_links, save_instance_links, MAX_URL_LENGTH
+
+URL = 'https://api.figma.com/v1/images/key'
+PARAMS = {'use_absolute_bounds': 'true', 'scale': 1, 'format': 'png'}
+
+
+def encoded_length(ids):
+    return len(f"{URL}?{urlencode({**PARAMS, 'ids': ','.join(ids)})}")
+
+
+def test_chunk_fits_the_encoded_url_length():
+    ids = [f'{i}:{i * 7}' for i in range(5000)] + ['I1:2;3:4;5:6']
+    chunks = list(chunk(ids, URL, PARAMS, max_len=1000))
+
+    assert [id_ for c in chunks for id_ in c] == ids
+    assert all(encoded_length(c) <= 1000 for c in chunks)
+    # full chunks - the next id would not fit
+    assert all(encoded_length(c + [chunks[n + 1][0]]) > 1000 for n, c in enumerate(chunks[:-1]))
+
+
+def test_chunk_default_length():
+    ids = [f'{i}:{i}' for i in range(10000)]
+    assert all(encoded_length(c) <= MAX_URL_LENGTH for c in chunk(ids, URL, PARAMS))
+
+
+def test_chunk_yields_an_oversized_id_alone():
+    ids = ['1:1', 'x' * 2000, '1:2']
+    assert list(chunk(ids, URL, PARAMS, max_len=500)) == [['1:1'], ['x' * 2000], ['1:2']]
+
+
+def test_chunk_reads_a_callable_length_per_chunk():
+    lengths = iter([300, 1000, 1000, 1000, 1000])
+    chunks = list(chunk([f'{i}:{i}' for i in range(200)], URL, PARAMS, max_len=lambda: next(lengths)))
+    assert encoded_length(chunks[0]) <= 300
+    assert len(chunks[1]) > len(chunks[0])
+
+
+def test_chunk_sizer_halves_and_grows_back():
+    sizer = ChunkSizer(max_len=4000, min_len=500, target_latency=20)
+    assert sizer() == 4000
+
+    sizer.observe(30)
+    assert sizer() == 2000
+    sizer.observe(1, failed=True)
+    assert sizer() == 1000
+    for _ in range(10):
+        sizer.observe(60)
+    assert sizer() == 500
+
+    # within the target - unchanged
+    sizer.observe(15)
+    assert sizer() == 500
+    sizer.observe(1)
+    assert sizer() == 550
+    for _ in range(100):
+        sizer.observe(1)
+    assert sizer() == 4000
+
+
+def test_interleave_alternates_small_and_large():
+    areas = {str(i): i for i in range(6)}
+    assert interleave(list(areas), areas) == ['0', '5', '1', '4', '2', '3']
+    assert interleave(['a'], {}) == ['a']
+    assert sorted(interleave(['a', 'b', 'c'], {})) == ['a', 'b', 'c']
+
+
+class FakeClient:
+    """
+    renders the ids, failing the chunks with any of the `errors` ids - {id: exception}
+    """
+
+    def __init__(self, errors):
+        self.errors = errors
+        self.calls = []
+
+    def images(self, key, ids, **params):
+        self.calls.append(list(ids))
+        for id_ in ids:
+            if id_ in self.errors:
+                raise self.errors[id_]
+        return {id_: f'https://render/{id_}.png' for id_ in ids}
+
+
+def test_fetch_node_images_isolates_the_render_timeouts():
+    ids = [f'1:{i}' for i in range(64)]
+    client = FakeClient({'1:7': FigmaAPIError('Render timeout', status=400)})
+    unrenderable = {}
+    urls = fetch_node_images(client, 'key', ids, 1, 'png', unrenderable=unrenderable, disable=True)
+
+    assert set(urls) == set(ids) - {'1:7'}
+    assert list(unrenderable) == ['1:7']
+
+
+def test_fetch_node_images_does_not_record_the_other_errors():
+    ids = [f'1:{i}' for i in range(64)]
+    client = FakeClient({
+        '1:3': FigmaAPIError('Invalid parameter: scale', status=400),
+        '1:40': FigmaAPIError('HTTP500', status=500),
+    })
+    unrenderable = {}
+    urls = fetch_node_images(client, 'key', ids, 1, 'png', unrenderable=unrenderable, disable=True)
+
+    # a single chunk (all the ids fit in the url) - failed as a whole, not bisected
+    assert urls == {}
+    assert unrenderable == {}
+    assert len(client.calls) == 1
+
+
+def test_fetch_node_images_logs_the_failed_chunks(caplog):
+    client = FakeClient({'1:1': requests.exceptions.ConnectionError('reset')})
+    with caplog.at_level(logging.ERROR):
+        urls = fetch_node_images(client, 'key', ['1:1', '1:2'], 1, 'png', disable=True)
+    assert urls == {}
+    assert '1:1,1:2' in caplog.text
+    assert 'reset' in caplog.text
+
+
+def test_is_render_error():
+    assert is_render_error(FigmaAPIError('Render timeout', status=400))
+    assert is_render_error(FigmaAPIError('Render timeout', status=500))
+    assert not is_render_error(FigmaAPIError('Invalid parameter', status=400))
+    assert not is_render_error(FigmaAPIError('HTTP502', status=502))
+    assert not is_render_error(FigmaAPIError('Not found', status=404))
+
+
+def test_instance_links_are_merged(tmp_path):
+    directory = tmp_path / 'exports'
+    assert load_instance_links(directory) == {}
+    save_instance_links(directory, {})
+    assert not directory.exists()
+
+    save_instance_links(directory, {'1:2': '1:1', '1:3': '1:1'})
+    # the next run (or level) - the links planned before are kept
+    save_instance_links(directory, {'2:2': '2:1'})
+    assert load_instance_links(directory) == {'1:2': '1:1', '1:3': '1:1', '2:2': '2:1'}
@@ -0,0 +1,70 @@
+import random
+from collections import Counter
+
+from strategies import head, weighted_reservoir, stratified_reservoir, size_bucket
+
+
+def test_head_consumes_k_items_only():
+    consumed = []
+
+    def items():
+        for i in range(100):
+            consumed.append(i)
+            yield i
+
+    assert head(items(), 3) == [0, 1, 2]
+    # the stream is not drained past the k-th item (+1 to find out it is done)
+    assert len(consumed) <= 4
+
+
+def test_weighted_reservoir_size_and_uniqueness():
+    out = weighted_reservoir(iter(range(1000)), 50, weight=lambda i: 1, rng=random.Random(0))
+    assert len(out) == 50
+    assert len(set(out)) == 50
+
+
+def test_weighted_reservoir_skips_non_positive_weights():
+    out = weighted_reservoir(iter(range(10)), 10, weight=lambda i: 0 if i % 2 else 1, rng=random.Random(0))
+    assert sorted(out) == [0, 2, 4, 6, 8]
+
+
+def test_weighted_reservoir_prefers_heavy_items():
+    rng = random.Random(1)
+    hits = Counter()
+    for _ in range(500):
+        # item 0 weighs as much as the other 99 together
+        hits.update(weighted_reservoir(iter(range(100)), 1, weight=lambda i: 99 if i == 0 else 1, rng=rng))
+    assert 200 < hits[0] < 300
+
+
+def test_weighted_reservoir_is_reproducible():
+    a = weighted_reservoir(iter(range(100)), 10, weight=lambda i: i + 1, rng=random.Random(42))
+    b = weighted_reservoir(iter(range(100)), 10, weight=lambda i: i + 1, rng=random.Random(42))
+    assert a == b
+
+
+def test_stratified_reservoir_balances_strata():
+    # 90 'a', 10 'b' - an even split takes 5 of each
+    items = [('a', i) for i in range(90)] + [('b', i) for i in range(10)]
+    out = stratified_reservoir(iter(items), 10, stratum=lambda item: item[0], rng=random.Random(0))
+    assert Counter(s for s, _ in out) == {'a': 5, 'b': 5}
+
+
+def test_stratified_reservoir_fills_from_larger_strata():
+    items = [('a', i) for i in range(90)] + [('b', i) for i in range(2)]
+    out = stratified_reservoir(iter(items), 10, stratum=lambda item: item[0], rng=random.Random(0))
+    assert Counter(s for s, _ in out) == {'a': 8, 'b': 2}
+    assert len(set(out)) == 10
+
+
+def test_stratified_reservoir_fewer_items_than_k():
+    out = stratified_reservoir(iter(range(3)), 10, stratum=lambda i: str(i % 2), rng=random.Random(0))
+    assert sorted(out) == [0, 1, 2]
+
+
+def test_size_bucket_orders_by_size():
+    assert size_bucket(0) == '0B'
+    assert size_bucket(1000).endswith(':512B-1KB')
+    assert size_bucket(3 * 1024 * 1024).endswith(':2MB-4MB')
+    buckets = [size_bucket(n) for n in (1, 100, 10_000, 10_000_000)]
+    assert buckets == sorted(buckets)
@@ -0,0 +1,155 @@
+import gzip
+import importlib
+import os
+
+import boto3
+import pytest
+from click.testing import CliRunner
+from moto import mock_aws
+
+BUCKET = 'archive'
+
+
+@pytest.fixture
+def sync(tmp_path, monkeypatch):
+    """
+    sync_files with a mocked bucket - the cwd is the tmp dir (the failed-files.log & the manifest are written there)
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    with mock_aws():
+        boto3.client('s3').create_bucket(Bucket=BUCKET)
+        yield importlib.import_module('sync_files')
+
+
+def write(path, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def run(sync, folder, *args):
+    result = CliRunner().invoke(sync.sync_files, [str(folder), BUCKET, '-y', '-c', '4', *args])
+    assert result.exit_code == 0, result.output
+    return result.output
+
+
+def keys():
+    objects = boto3.client('s3').list_objects_v2(Bucket=BUCKET).get('Contents', [])
+    return sorted(obj['Key'] for obj in objects)
+
+
+def test_uploads_matching_files_only(sync, tmp_path):
+    src = tmp_path / 'src'
+    write(src / 'a.json', b'{}')
+    write(src / 'sub' / 'b.json.gz', gzip.compress(b'{}'))
+    write(src / 'sub' / 'c.png', b'png')
+    write(src / '.DS_Store', b'')
+
+    output = run(sync, src)
+    assert keys() == ['a.json', 'sub/b.json.gz']
+    assert 'Uploaded 2 new or changed files' in output
+
+    run(sync, src, '--pattern', '*', '--prefix', 'p/')
+    assert 'p/sub/c.png' in keys()
+    assert 'p/.DS_Store' not in keys()
+
+
+def test_only_new_or_changed_files_are_uploaded(sync, tmp_path):
+    src = tmp_path / 'src'
+    write(src / 'a.json', b'{"a": 1}')
+    write(src / 'b.json', b'{"b": 1}')
+    run(sync, src)
+
+    assert 'Uploaded 0 new or changed files' in run(sync, src)
+
+    # same size, different content - only the etag diff catches it
+    write(src / 'a.json', b'{"a": 2}')
+    assert 'Uploaded 0 new or changed files' in run(sync, src, '--diff', 'size')
+    assert 'Uploaded 1 new or changed files' in run(sync, src, '--diff', 'etag')
+    assert boto3.client('s3').get_object(Bucket=BUCKET, Key='a.json')['Body'].read() == b'{"a": 2}'
+
+    write(src / 'c.json', b'{}')
+    assert 'Uploaded 1 new or changed files' in run(sync, src)
+    assert 'Uploaded 3 new or changed files' in run(sync, src, '--diff', 'none')
+
+
+def test_headers(sync, tmp_path):
+    src = tmp_path / 'src'
+    write(src / 'file.json.gz', gzip.compress(b'{}'))
+    write(src / 'file.json', b'{}')
+    write(src / 'image.png', b'png')
+    write(src / 'export.svg', b'<svg/>')
+    run(sync, src, '--pattern', '*')
+
+    s3 = boto3.client('s3')
+    gz = s3.head_object(Bucket=BUCKET, Key='file.json.gz')
+    assert gz['ContentType'] == 'application/json'
+    assert gz['ContentEncoding'] == 'gzip'
+    assert gz['CacheControl'] == sync.DEFAULT_HEADERS['CacheControl']
+
+    plain = s3.head_object(Bucket=BUCKET, Key='file.json')
+    assert plain['ContentType'] == 'application/json'
+    assert 'ContentEncoding' not in plain
+
+    png = s3.head_object(Bucket=BUCKET, Key='image.png')
+    assert png['ContentType'] == 'image/png'
+    assert png['CacheControl'] == sync.IMAGE_HEADERS['CacheControl']
+    assert s3.head_object(Bucket=BUCKET, Key='export.svg')['ContentType'] == 'image/svg+xml'
+
+
+def test_dry_run_uploads_nothing(sync, tmp_path):
+    src = tmp_path / 'src'
+    write(src / 'a.json', b'{}')
+    write(src / 'b.json', b'{}')
+
+    output = run(sync, src, '--dry-run')
+    assert 'Found 2 new or changed files' in output
+    assert keys() == []
+
+
+def test_local_etag_matches_multipart_etags(sync, tmp_path):
+    path = tmp_path / 'big.bin'
+    write(path, os.urandom(2500))
+    # 3 parts of 1000 bytes - md5 of the part md5s, suffixed with the part count
+    assert sync.local_etag(path, chunksize=1000).endswith('-3')
+    assert '-' not in sync.local_etag(path)
+
+
+def test_follows_symlinked_directories(sync, tmp_path):
+    # the sampler's --link output - the sample directories link to the archive
+    archive = tmp_path / 'archive'
+    write(archive / 'key' / 'exports' / '1:2.png', b'png')
+    write(archive / 'key' / 'images' / 'abc.png', b'png')
+    src = tmp_path / 'src'
+    write(src / 'sample' / 'meta.json', b'{}')
+    os.symlink(archive / 'key' / 'exports', src / 'sample' / 'exports')
+    os.symlink(archive / 'key' / 'images', src / 'sample' / 'images')
+    # a cycle - visited once
+    os.symlink(src, src / 'sample' / 'loop')
+
+    output = run(sync, src, '--pattern', '*')
+    assert keys() == ['sample/exports/1:2.png', 'sample/images/abc.png', 'sample/meta.json']
+    assert 'Uploaded 3 new or changed files' in output
+    assert not os.path.exists('failed-files.log') or open('failed-files.log').read() == ''
+
+
+def test_failed_uploads_are_not_counted(sync, tmp_path, monkeypatch):
+    src = tmp_path / 'src'
+    write(src / 'a.json', b'{}')
+    write(src / 'b.json', b'{}')
+
+    # the upload of b.json fails
+    headers = sync.headers
+
+    def failing_headers(filepath):
+        if filepath.endswith('b.json'):
+            raise IOError('upload failed')
+        return headers(filepath)
+    monkeypatch.setattr(sync, 'headers', failing_headers)
+
+    output = run(sync, src)
+    assert 'Uploaded 1 new or changed files' in output
+    assert keys() == ['a.json']